@@ -0,0 +1,679 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import sys
+
+from matrix_is_tester.fakehs import (
+    FakeHomeserverPool,
+    get_shared_fake_hs,
+    validate_behaviour,
+)
+from matrix_is_tester.mailsink import get_shared_mailsink
+
+
+def _parse_weights(specs):
+    weights = {}
+    for spec in specs:
+        for part in spec.split(","):
+            name, _, weight = part.partition("=")
+            weights[name.strip()] = float(weight) if weight else 1.0
+    return weights
+
+
+def _parse_list(specs, type, default):
+    if not specs:
+        return list(default)
+    return [type(part) for spec in specs for part in spec.split(",")]
+
+
+def _get_base_url(args):
+    if args.base_url:
+        return args.base_url
+
+    # Only import this when needed: it fails if there is no launcher available.
+    # Only the one server is needed, so don't start both.
+    os.environ.setdefault("MATRIX_IS_TESTER_PREWARM", "0")
+    from matrix_is_tester.launch_is import get_or_launch_is
+
+    return get_or_launch_is(args.with_terms)
+
+
+def _get_hs_addr(args):
+    """
+    Returns the address of the fake homeserver, or a list of the address of
+    each of --homeservers.
+    """
+    if args.homeservers > 1:
+        pool = FakeHomeserverPool(args.homeservers, behaviour=args.hs_behaviour)
+        pool.launch()
+        atexit.register(pool.tearDown)
+        return pool.get_addrs()
+
+    fake_hs = get_shared_fake_hs()
+    if args.hs_behaviour is not None:
+        fake_hs.set_behaviour(args.hs_behaviour)
+    return fake_hs.get_addr()
+
+
+def _write_json(path, report):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def _cmd_load(args):
+    from matrix_is_tester.load import format_report, run_load
+
+    base_url = _get_base_url(args)
+    mail_sink = get_shared_mailsink()
+    hs_addr = _get_hs_addr(args)
+
+    report = asyncio.run(
+        run_load(
+            base_url,
+            mail_sink,
+            hs_addr,
+            _parse_weights(args.scenario or ["bind=1,lookup=4"]),
+            args.duration,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            accounts=args.accounts,
+        )
+    )
+
+    print(format_report(report))
+    if args.json:
+        _write_json(args.json, report)
+
+
+def _cmd_bench(args):
+    from matrix_is_tester.benchmarks import format_results, run_benchmarks
+    from matrix_is_tester.regression import (
+        compare,
+        format_comparison,
+        load_results,
+        parse_tolerance,
+        regressions,
+    )
+
+    tolerances = {}
+    endpoint_tolerances = {}
+    for spec in args.tolerance or []:
+        endpoint, metric, value = parse_tolerance(spec)
+        if endpoint is None:
+            tolerances[metric] = value
+        else:
+            endpoint_tolerances.setdefault(endpoint, {})[metric] = value
+
+    results = run_benchmarks(
+        _get_base_url(args),
+        get_shared_mailsink(),
+        _get_hs_addr(args),
+        endpoints=_parse_list(args.endpoint, str, []) or None,
+        requests=args.requests,
+        concurrency=args.concurrency,
+    )
+    if args.output:
+        _write_json(args.output, results)
+
+    if not args.baseline:
+        print(format_results(results))
+        return
+    if args.update_baseline:
+        _write_json(args.baseline, results)
+        print("Wrote baseline to %s" % (args.baseline,))
+        return
+
+    baseline = load_results(args.baseline)
+    if args.endpoint:
+        # Only compare the endpoints that were benchmarked this time
+        baseline["endpoints"] = dict(
+            (endpoint, stats)
+            for endpoint, stats in baseline["endpoints"].items()
+            if endpoint in results["endpoints"]
+        )
+
+    rows = compare(results, baseline, tolerances, endpoint_tolerances)
+    print(format_comparison(rows))
+    failed = regressions(rows)
+    if failed:
+        print("")
+        print("%d regressions against %s:" % (len(failed), args.baseline))
+        print(format_comparison(failed))
+        return 1
+
+
+def _cmd_bench_lookup(args):
+    from matrix_is_tester.bench_lookup import (
+        DEFAULT_ALGORITHMS,
+        DEFAULT_BATCH_SIZES,
+        DEFAULT_HIT_RATIOS,
+        format_results,
+        run_benchmark,
+    )
+
+    base_url = _get_base_url(args)
+    mail_sink = get_shared_mailsink()
+    hs_addr = _get_hs_addr(args)
+
+    seed = None
+    if not args.base_url and not args.no_cache:
+        from matrix_is_tester.launch_is import get_launcher_pool, supports_snapshots
+
+        launcher = get_launcher_pool().get(args.with_terms)
+        if supports_snapshots(launcher):
+            from matrix_is_tester.fixture_cache import seed_with_cache
+
+            def seed_from_cache(size):
+                return seed_with_cache(
+                    launcher,
+                    mail_sink,
+                    hs_addr,
+                    size,
+                    prefix="bench",
+                    in_flight=args.seed_concurrency,
+                )
+
+            seed = seed_from_cache
+
+    report = run_benchmark(
+        base_url,
+        mail_sink,
+        hs_addr,
+        args.size,
+        batch_sizes=_parse_list(args.batch_size, int, DEFAULT_BATCH_SIZES),
+        algorithms=_parse_list(args.algorithm, str, DEFAULT_ALGORITHMS),
+        hit_ratios=_parse_list(args.hit_ratio, float, DEFAULT_HIT_RATIOS),
+        requests=args.requests,
+        concurrency=args.concurrency,
+        seed_concurrency=args.seed_concurrency,
+        journal=args.journal,
+        seed=seed,
+        stream=args.stream,
+        chunk_size=args.chunk_size,
+    )
+
+    print(format_results(report))
+    if args.json:
+        _write_json(args.json, report)
+
+
+def _cmd_seed(args):
+    from matrix_is_tester.seed import Seeder, format_progress, format_report
+
+    seeder = Seeder(
+        _get_base_url(args),
+        get_shared_mailsink(),
+        _get_hs_addr(args),
+        prefix=args.prefix,
+        accounts=args.accounts,
+        journal=args.journal,
+        in_flight=args.in_flight,
+        stage_workers=args.stage_workers,
+        mail_slots=args.mail_slots,
+    )
+
+    def on_progress(progress):
+        print(format_progress(progress))
+        sys.stdout.flush()
+
+    report = asyncio.run(seeder.run(args.count, on_progress=on_progress))
+
+    print(format_report(report))
+    if args.json:
+        del report["bindings"]
+        _write_json(args.json, report)
+    if report["failed"]:
+        return 1
+
+
+def _cmd_invite_storm(args):
+    from matrix_is_tester.invite_storm import InviteStorm, format_report, problems
+    from matrix_is_tester.key_validity import KeyValidityCache
+
+    storm = InviteStorm(
+        _get_base_url(args),
+        get_shared_mailsink(),
+        _get_hs_addr(args),
+        addresses=args.addresses,
+        rooms=args.rooms,
+        senders=args.senders,
+        concurrency=args.concurrency,
+        mail_timeout=args.mail_timeout,
+        # Otherwise the shared cache, which the environment can also bypass
+        key_cache=KeyValidityCache(bypass=True) if args.no_key_cache else None,
+    )
+    report = asyncio.run(storm.run(args.invites))
+
+    print(format_report(report))
+    if args.json:
+        _write_json(args.json, report)
+    found = problems(report)
+    if found:
+        print("")
+        for problem in found:
+            print("! %s" % (problem,))
+        return 1
+
+
+def _cmd_soak(args):
+    from matrix_is_tester.soak import format_window, run_soak
+
+    base_url = _get_base_url(args)
+    pid = args.pid
+    if pid is None and not args.base_url:
+        from matrix_is_tester.launch_is import get_is_pid
+
+        pid = get_is_pid(args.with_terms)
+
+    def on_window(report):
+        print(format_window(report))
+        sys.stdout.flush()
+
+    report = asyncio.run(
+        run_soak(
+            base_url,
+            get_shared_mailsink(),
+            _get_hs_addr(args),
+            _parse_weights(args.scenario or ["validate=1,bind=1,lookup=4,ping=1"]),
+            args.duration,
+            window=args.window,
+            concurrency=args.concurrency,
+            accounts=args.accounts,
+            pid=pid,
+            drift_threshold=args.drift_threshold,
+            on_window=on_window,
+        )
+    )
+
+    if args.json:
+        _write_json(args.json, report)
+
+    print("")
+    for flag in report["flags"]:
+        print("FLAGGED: %s" % (flag,))
+    if report["flags"]:
+        return 1
+    print("No leaks or latency drift detected")
+
+
+def _add_server_args(parser):
+    parser.add_argument(
+        "--base-url",
+        help=(
+            "Base URL of an already running identity server. If not given, one is "
+            "started with matrix_is_test.launcher.MatrixIsTestLauncher."
+        ),
+    )
+    parser.add_argument(
+        "--with-terms",
+        action="store_true",
+        help="Launch the identity server with terms configured",
+    )
+    parser.add_argument(
+        "--hs-behaviour",
+        type=json.loads,
+        metavar="JSON",
+        help=(
+            "Latency, error rate and concurrency limit of each fake homeserver "
+            "endpoint, as for matrix_is_tester.fakehs.validate_behaviour, eg. "
+            '\'{"userinfo": {"latency": {"distribution": "lognormal", '
+            '"median": 0.05, "sigma": 0.5}, "error_rate": 0.01}}\''
+        ),
+    )
+    parser.add_argument(
+        "--homeservers",
+        type=int,
+        default=1,
+        metavar="N",
+        help=(
+            "Number of fake homeservers, each with its own server name, to spread "
+            "accounts over (default 1)"
+        ),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="matrix-is-tester")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    load = subparsers.add_parser(
+        "load", help="Drive sustained traffic at an identity server"
+    )
+    _add_server_args(load)
+    load.add_argument(
+        "--scenario",
+        action="append",
+        metavar="NAME=WEIGHT",
+        help=(
+            "Scenario to run and its relative weight; may be given several times "
+            "or comma-separated. One of: ping, register, validate, bind, lookup. "
+            "Default: bind=1,lookup=4"
+        ),
+    )
+    load.add_argument(
+        "--duration", type=float, default=30, help="Seconds to run for (default 30)"
+    )
+    load.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help=(
+            "Scenarios to run in parallel, or with --rate, the most to have in "
+            "flight at once (default 10)"
+        ),
+    )
+    load.add_argument(
+        "--rate", type=float, help="Target scenario iterations per second"
+    )
+    load.add_argument(
+        "--accounts",
+        type=int,
+        default=10,
+        help="Accounts to register up front and share between scenarios",
+    )
+    load.add_argument("--json", metavar="FILE", help="Also write the report as JSON")
+    load.set_defaults(func=_cmd_load)
+
+    bench = subparsers.add_parser(
+        "bench",
+        help="Benchmark each endpoint and compare against a baseline",
+    )
+    _add_server_args(bench)
+    bench.add_argument(
+        "--endpoint",
+        action="append",
+        help=(
+            "Endpoint to benchmark, eg. /lookup; may be repeated or "
+            "comma-separated. Default: all of them"
+        ),
+    )
+    bench.add_argument(
+        "--requests",
+        type=int,
+        default=200,
+        help="Requests to time per endpoint (default 200)",
+    )
+    bench.add_argument(
+        "--concurrency", type=int, default=10, help="Requests in flight (default 10)"
+    )
+    bench.add_argument("--output", metavar="FILE", help="Write the results as JSON")
+    bench.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="Results to compare against; exit with status 1 on any regression",
+    )
+    bench.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Write the results to the --baseline file instead of comparing",
+    )
+    bench.add_argument(
+        "--tolerance",
+        action="append",
+        metavar="[ENDPOINT:]METRIC=VALUE",
+        help=(
+            "How much worse a metric may get before it is a regression, as a "
+            "proportion, eg. p95=0.3 or /lookup:throughput=0.1. Metrics are "
+            "p50, p95, p99, throughput and error_rate"
+        ),
+    )
+    bench.set_defaults(func=_cmd_bench)
+
+    bench_lookup = subparsers.add_parser(
+        "bench-lookup", help="Measure v2 /lookup throughput against seeded 3PIDs"
+    )
+    _add_server_args(bench_lookup)
+    bench_lookup.add_argument(
+        "--size",
+        type=int,
+        default=10000,
+        help="Number of 3PIDs to bind before looking any up (default 10000)",
+    )
+    bench_lookup.add_argument(
+        "--batch-size",
+        action="append",
+        metavar="N",
+        help="Addresses per lookup; may be repeated or comma-separated "
+        "(default 1,10,100,1000)",
+    )
+    bench_lookup.add_argument(
+        "--algorithm",
+        action="append",
+        metavar="ALG",
+        help="Lookup algorithm; may be repeated or comma-separated "
+        "(default none,sha256)",
+    )
+    bench_lookup.add_argument(
+        "--hit-ratio",
+        action="append",
+        metavar="RATIO",
+        help="Proportion of each batch that is bound; may be repeated or "
+        "comma-separated (default 0,0.5,1)",
+    )
+    bench_lookup.add_argument(
+        "--requests",
+        type=int,
+        default=200,
+        help="Lookups to send for each combination (default 200)",
+    )
+    bench_lookup.add_argument(
+        "--concurrency", type=int, default=10, help="Lookups in flight (default 10)"
+    )
+    bench_lookup.add_argument(
+        "--seed-concurrency",
+        type=int,
+        default=256,
+        help="Bindings in flight while seeding (default 256)",
+    )
+    bench_lookup.add_argument(
+        "--journal",
+        metavar="FILE",
+        help="Seeding journal, to reuse bindings from an earlier run (see seed)",
+    )
+    bench_lookup.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=(
+            "Always seed from scratch, rather than restoring a cached snapshot "
+            "when the launcher supports snapshots"
+        ),
+    )
+    bench_lookup.add_argument(
+        "--stream",
+        action="store_true",
+        help="Parse each response as it arrives, for very large batches",
+    )
+    bench_lookup.add_argument(
+        "--chunk-size",
+        type=int,
+        metavar="N",
+        help="Split each batch into concurrent requests of up to N addresses, "
+        "and report their latency by chunk size",
+    )
+    bench_lookup.add_argument(
+        "--json", metavar="FILE", help="Also write the results as JSON"
+    )
+    bench_lookup.set_defaults(func=_cmd_bench_lookup)
+
+    seed = subparsers.add_parser(
+        "seed", help="Bind many email addresses on an identity server, quickly"
+    )
+    _add_server_args(seed)
+    seed.add_argument(
+        "--count", type=int, required=True, help="Number of addresses to bind"
+    )
+    seed.add_argument(
+        "--prefix",
+        default="seed",
+        help="Addresses are <prefix>-<n>@seed.test (default 'seed')",
+    )
+    seed.add_argument(
+        "--journal",
+        metavar="FILE",
+        help=(
+            "Record each binding in this file, and skip those already in it. "
+            "Only meaningful against an IS that keeps its database between runs."
+        ),
+    )
+    seed.add_argument(
+        "--accounts",
+        type=int,
+        default=10,
+        help="Number of accounts to bind the addresses to (default 10)",
+    )
+    seed.add_argument(
+        "--in-flight",
+        type=int,
+        default=256,
+        help="Most bindings in progress at once (default 256)",
+    )
+    seed.add_argument(
+        "--stage-workers",
+        type=int,
+        default=32,
+        help="Requests each stage sends in parallel (default 32)",
+    )
+    seed.add_argument(
+        "--mail-slots",
+        type=int,
+        default=128,
+        help="Most sessions waiting for their mail at once (default 128)",
+    )
+    seed.add_argument("--json", metavar="FILE", help="Also write the report as JSON")
+    seed.set_defaults(func=_cmd_seed)
+
+    invite_storm = subparsers.add_parser(
+        "invite-storm",
+        help="Store many invites at once and check every invite mail arrives",
+    )
+    _add_server_args(invite_storm)
+    invite_storm.add_argument(
+        "--invites", type=int, default=1000, help="Invites to store (default 1000)"
+    )
+    invite_storm.add_argument(
+        "--addresses",
+        type=int,
+        help="Distinct addresses to invite (default: one per invite)",
+    )
+    invite_storm.add_argument(
+        "--rooms", type=int, default=10, help="Rooms to invite to (default 10)"
+    )
+    invite_storm.add_argument(
+        "--senders",
+        type=int,
+        default=10,
+        help="Accounts to send the invites from (default 10)",
+    )
+    invite_storm.add_argument(
+        "--concurrency",
+        type=int,
+        default=100,
+        help="Most /store-invite requests in flight at once (default 100)",
+    )
+    invite_storm.add_argument(
+        "--mail-timeout",
+        type=float,
+        default=30,
+        help="Seconds to wait for each invite's mail (default 30)",
+    )
+    invite_storm.add_argument(
+        "--no-key-cache",
+        action="store_true",
+        help=(
+            "Check every public key returned with every invite, to measure the "
+            "key validity endpoint itself"
+        ),
+    )
+    invite_storm.add_argument(
+        "--json", metavar="FILE", help="Also write the report as JSON"
+    )
+    invite_storm.set_defaults(func=_cmd_invite_storm)
+
+    soak = subparsers.add_parser(
+        "soak", help="Run the test flows for hours, watching for leaks and slowdown"
+    )
+    _add_server_args(soak)
+    soak.add_argument(
+        "--scenario",
+        action="append",
+        metavar="NAME=WEIGHT",
+        help="As for load. Default: validate=1,bind=1,lookup=4,ping=1",
+    )
+    soak.add_argument(
+        "--duration",
+        type=float,
+        default=4 * 3600,
+        help="Seconds to run for (default 4 hours)",
+    )
+    soak.add_argument(
+        "--window",
+        type=float,
+        default=300,
+        help="Seconds per reporting window (default 300)",
+    )
+    soak.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help="Scenarios to run in parallel (default 10)",
+    )
+    soak.add_argument(
+        "--accounts",
+        type=int,
+        default=10,
+        help="Accounts to register up front and share between scenarios",
+    )
+    soak.add_argument(
+        "--pid",
+        type=int,
+        help=(
+            "Process ID of the identity server, to sample its memory and file "
+            "descriptors. Found from the launcher if it has get_pid()."
+        ),
+    )
+    soak.add_argument(
+        "--drift-threshold",
+        type=float,
+        default=0.5,
+        help=(
+            "Flag endpoints whose p95 latency grows by more than this "
+            "proportion between the first and last windows (default 0.5)"
+        ),
+    )
+    soak.add_argument("--json", metavar="FILE", help="Also write the report as JSON")
+    soak.set_defaults(func=_cmd_soak)
+
+    args = parser.parse_args(argv)
+    if args.hs_behaviour is not None:
+        try:
+            validate_behaviour(args.hs_behaviour)
+        except ValueError as e:
+            parser.error("--hs-behaviour: %s" % (e,))
+    if args.command == "bench" and args.update_baseline and not args.baseline:
+        parser.error("--update-baseline needs --baseline")
+    if args.command in ("load", "soak") and args.accounts < 1:
+        parser.error("--accounts must be at least 1")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keeps a pool of accounts registered with an identity server ahead of time, so
+that tests and load runs can lease one instead of registering their own.
+
+Set MATRIX_IS_TESTER_ACCOUNT_POOL_SIZE to change how many accounts the tests'
+pools keep ready (default 10) when the IS's launcher supports snapshots.
+"""
+
+import atexit
+import os
+import random
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from twisted.python import log
+
+from matrix_is_tester.fakehs import hs_addr_list, server_name_for, token_for_user
+from matrix_is_tester.is_api import IsApi
+
+ACCOUNT_POOL_SIZE_ENV = "MATRIX_IS_TESTER_ACCOUNT_POOL_SIZE"
+DEFAULT_POOL_SIZE = 10
+
+_test_pools = {}
+# Reentrant, as get_test_account_pool holds it while resetting the IS, which
+# calls _on_test_is_reset
+_test_pools_lock = threading.RLock()
+_test_pool_hook_added = False
+
+
+class Account(object):
+    """
+    An account registered with an identity server.
+    """
+
+    def __init__(self, user_id, token, generation):
+        self.user_id = user_id
+        self.token = token
+        # Set by IsApi.logout, after which the token is no good
+        self.logged_out = False
+        # Whether the account is in the snapshot the IS is reset to
+        self.persistent = False
+        self.generation = generation
+
+    @property
+    def headers(self):
+        return {"Authorization": "Bearer %s" % (self.token,)}
+
+    def __repr__(self):
+        return "<Account %s>" % (self.user_id,)
+
+
+def _policy_urls(terms):
+    # Every language's URL of every policy
+    urls = []
+    for policy in terms.get("policies", {}).values():
+        for key, value in policy.items():
+            if key != "version" and isinstance(value, dict) and "url" in value:
+                urls.append(value["url"])
+    return urls
+
+
+class AccountPool(object):
+    """
+    Accounts ready to be leased, topped up in the background once fewer than
+    `low_water` are left. Leased accounts that are released without having
+    been logged out go back into the pool.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        hs_addr,
+        size=DEFAULT_POOL_SIZE,
+        low_water=None,
+        accept_terms=False,
+        concurrency=4,
+        prefix="pool",
+    ):
+        """
+        Args:
+            base_url (str): The base URL of the IS to register with.
+            hs_addr (tuple|list[tuple]): Host, port of the fake homeserver, or
+                a list of them to spread the accounts over.
+            size (int): How many accounts to keep ready.
+            low_water (int|None): Refill once fewer than this many are ready.
+                Defaults to half of `size`.
+            accept_terms (bool): Agree to all of the IS's terms with each
+                account once it is registered.
+            concurrency (int): Registrations in flight at once when filling.
+            prefix (str): Prefix of the accounts' user IDs.
+        """
+        self.base_url = base_url
+        self.hs_addrs = hs_addr_list(hs_addr)
+        self.size = size
+        self.low_water = size // 2 if low_water is None else low_water
+        self.accept_terms = accept_terms
+        self.concurrency = concurrency
+        self.prefix = "%s-%s" % (prefix, uuid.uuid4().hex[:8])
+
+        self._api = IsApi(base_url, "v2", None)
+        self._cond = threading.Condition()
+        self._available = deque()
+        # Accounts that survive the IS being reset, leased or not, and those
+        # of them that were logged out, until the next reset brings them back
+        self._persistent = []
+        self._logged_out = set()
+        self._counter = 0
+        # Bumped whenever the IS loses its accounts
+        self._generation = 0
+        # Registrations in flight
+        self._pending = 0
+        self._closed = False
+
+        self.registered = 0
+        self.leases = 0
+        self.reused = 0
+        self.on_demand = 0
+        self.logged_out = 0
+
+        self._refill_thread = None
+
+    def _new_user_id(self):
+        with self._cond:
+            self._counter += 1
+            i = self._counter
+        server_name = server_name_for(random.choice(self.hs_addrs))
+        return "@%s-%d:%s" % (self.prefix, i, server_name)
+
+    def _register(self):
+        """
+        Register and set up a new account.
+
+        Returns:
+            Account
+        """
+        with self._cond:
+            generation = self._generation
+        user_id = self._new_user_id()
+        server_name = user_id.split(":", 1)[1]
+
+        body = self._api.register(server_name, token_for_user(user_id))
+        if "token" not in body:
+            raise Exception("Failed to register %s: %r" % (user_id, body))
+        account = Account(user_id, body["token"], generation)
+
+        if self.accept_terms:
+            api = IsApi(self.base_url, "v2", None)
+            api.use_account(account)
+            body = api.agree_to_terms(_policy_urls(api.get_terms()))
+            if "errcode" in body:
+                raise Exception("Failed to agree to terms: %r" % (body,))
+
+        with self._cond:
+            self.registered += 1
+        return account
+
+    def _add(self, account):
+        with self._cond:
+            # Registered before the IS was reset, so it no longer exists
+            if account.generation != self._generation:
+                return
+            self._available.append(account)
+            self._cond.notify_all()
+
+    def fill(self):
+        """
+        Register accounts until the pool is full, waiting for them.
+        """
+        with self._cond:
+            missing = self.size - len(self._available) - self._pending
+            if missing <= 0:
+                return
+            self._pending += missing
+        try:
+            with ThreadPoolExecutor(min(self.concurrency, missing)) as pool:
+                for account in pool.map(lambda _: self._register(), range(missing)):
+                    self._add(account)
+        finally:
+            with self._cond:
+                self._pending -= missing
+                self._cond.notify_all()
+
+    def _start_refill(self):
+        # Called with the lock held
+        if self._refill_thread is None and not self._closed:
+            self._refill_thread = threading.Thread(
+                target=self._run_refill, name="account-pool-refill"
+            )
+            self._refill_thread.daemon = True
+            self._refill_thread.start()
+        self._cond.notify_all()
+
+    def _run_refill(self):
+        while True:
+            with self._cond:
+                while not self._closed and (
+                    len(self._available) >= self.low_water or self._pending
+                ):
+                    self._cond.wait()
+                if self._closed:
+                    return
+            try:
+                self.fill()
+            except Exception as e:
+                log.msg("Failed to refill account pool: %r" % (e,))
+                with self._cond:
+                    if not self._closed:
+                        # Don't spin on a broken server
+                        self._cond.wait(1)
+
+    def lease(self):
+        """
+        Take an account from the pool, registering one on the spot if none
+        are ready.
+
+        Returns:
+            Account
+        """
+        with self._cond:
+            self.leases += 1
+            if self._available:
+                account = self._available.popleft()
+                self.reused += 1
+            else:
+                account = None
+            if len(self._available) < self.low_water:
+                self._start_refill()
+        if account is None:
+            account = self._register()
+            with self._cond:
+                self.on_demand += 1
+        return account
+
+    def release(self, account):
+        """
+        Give a leased account back, unless it has been logged out.
+        """
+        with self._cond:
+            if account.logged_out:
+                self.logged_out += 1
+                if account.persistent:
+                    # It comes back when the IS is reset to its snapshot
+                    self._logged_out.add(account)
+                return
+            if account.generation == self._generation:
+                self._available.append(account)
+                self._cond.notify_all()
+
+    def wait_until_full(self, timeout=None):
+        """
+        Wait for the pool to be refilled to its size.
+
+        Returns:
+            bool: Whether it did in time.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: len(self._available) >= self.size and not self._pending,
+                timeout,
+            )
+
+    def make_persistent(self):
+        """
+        Note that the IS has just been snapshotted, so every account now in
+        the pool or leased survives it being reset.
+        """
+        with self._cond:
+            for account in self._available:
+                if not account.persistent:
+                    account.persistent = True
+                    self._persistent.append(account)
+
+    def state_reset(self):
+        """
+        Note that the IS has been reset to its snapshot: accounts registered
+        since are gone, and persistent accounts that were logged out are
+        usable again.
+        """
+        with self._cond:
+            self._generation += 1
+            available = set(self._available)
+            self._available = deque()
+            for account in self._persistent:
+                account.generation = self._generation
+                if account in self._logged_out:
+                    account.logged_out = False
+                    self._available.append(account)
+                elif account in available:
+                    self._available.append(account)
+            self._logged_out = set()
+            self._cond.notify_all()
+
+    def invalidate(self, base_url=None):
+        """
+        Forget every account, eg. because the IS was relaunched.
+
+        Args:
+            base_url (str|None): The IS's new base URL, if it has moved.
+        """
+        with self._cond:
+            if base_url is not None:
+                self.base_url = base_url
+                self._api = IsApi(base_url, "v2", None)
+            self._generation += 1
+            self._available = deque()
+            self._persistent = []
+            self._logged_out = set()
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Accounts 'registered', 'leases' made, how many of those
+                were 'reused' from the pool and how many registered
+                'on_demand', accounts released 'logged_out', and the number
+                'available' now.
+        """
+        with self._cond:
+            return {
+                "registered": self.registered,
+                "leases": self.leases,
+                "reused": self.reused,
+                "on_demand": self.on_demand,
+                "logged_out": self.logged_out,
+                "available": len(self._available),
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._refill_thread
+        if thread is not None:
+            thread.join(5)
+
+
+def _on_test_is_reset(with_terms, relaunched):
+    with _test_pools_lock:
+        pool = _test_pools.get(with_terms)
+    if pool is None:
+        return
+    if relaunched:
+        from matrix_is_tester.launch_is import get_or_launch_is
+
+        pool.invalidate(get_or_launch_is(with_terms))
+    else:
+        pool.state_reset()
+
+
+def get_test_account_pool(with_terms=False):
+    """
+    Get the account pool for the IS the tests use, making it the first time.
+
+    When the IS's launcher supports snapshots, the pool is filled once with
+    the IS reset, and the IS is snapshotted again so that the accounts survive
+    it being reset before each test. Otherwise accounts are only registered
+    as they are leased, as relaunching the IS would lose them.
+    """
+    global _test_pool_hook_added
+
+    # Imported here, as launching the IS is a side effect of importing
+    # launch_is
+    from matrix_is_tester.fakehs import get_shared_fake_hs
+    from matrix_is_tester.launch_is import (
+        get_launcher_pool,
+        get_or_launch_is,
+        reset_is,
+        supports_snapshots,
+    )
+
+    with _test_pools_lock:
+        pool = _test_pools.get(with_terms)
+        if pool is not None:
+            return pool
+
+        launchers = get_launcher_pool()
+        if not _test_pool_hook_added:
+            launchers.add_reset_hook(_on_test_is_reset)
+            _test_pool_hook_added = True
+
+        snapshots = supports_snapshots(launchers.get(with_terms))
+        if snapshots:
+            # Don't snapshot whatever earlier tests left behind
+            base_url = reset_is(with_terms)
+        else:
+            base_url = get_or_launch_is(with_terms)
+        pool = AccountPool(
+            base_url,
+            get_shared_fake_hs().get_addr(),
+            size=int(os.environ.get(ACCOUNT_POOL_SIZE_ENV, DEFAULT_POOL_SIZE)),
+            low_water=None if snapshots else 0,
+            accept_terms=with_terms,
+            prefix="pooltest",
+        )
+        if snapshots:
+            pool.fill()
+            launchers.update_snapshot(with_terms)
+            pool.make_persistent()
+
+        _test_pools[with_terms] = pool
+        atexit.register(pool.close)
+        return pool
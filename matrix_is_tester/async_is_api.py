@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import random
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from twisted.python import log
+
+from matrix_is_tester.fakehs import hs_addr_list, server_name_for, token_for_random_user
+from matrix_is_tester.instrumentation import get_instrumentation
+from matrix_is_tester.is_api import random_client_secret, token_from_mail
+
+DEFAULT_POOL_SIZE = 100
+
+# event loop -> {(base_url, pool_size): aiohttp.ClientSession}
+_shared_sessions = weakref.WeakKeyDictionary()
+
+
+def get_shared_client_session(base_url, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Get the aiohttp session shared by all AsyncIsApi instances in the running
+    event loop that talk to the given base URL, making it if necessary.
+    Must be called from a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    sessions = _shared_sessions.setdefault(loop, {})
+
+    key = (base_url, pool_size)
+    if key not in sessions or sessions[key].closed:
+        connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size)
+        sessions[key] = aiohttp.ClientSession(connector=connector)
+    return sessions[key]
+
+
+async def close_shared_client_sessions():
+    """
+    Close all the shared sessions belonging to the running event loop. This
+    should be awaited before the loop is closed.
+    """
+    sessions = _shared_sessions.pop(asyncio.get_running_loop(), {})
+    for session in sessions.values():
+        await session.close()
+
+
+class AsyncIsApi(object):
+    """
+    Asyncio wrappers around the IS REST API, for driving many concurrent
+    sessions from one process. Method names and return values match IsApi.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        version,
+        mail_sink,
+        session=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        instrumentation=None,
+    ):
+        """
+        Args:
+            base_url (str): The base URL of the IS API to use
+            version (str): Version of the IS API (eg. 'v1' or 'v2')
+            mail_sink (MailSink): Mail sink object to use for getting email
+                authentication tokens.
+            session (aiohttp.ClientSession|None): Session to send requests
+                with. If None, a session is shared with every other AsyncIsApi
+                in the same event loop using the same base URL.
+            pool_size (int): Maximum number of connections the shared session
+                keeps open.
+            instrumentation (Instrumentation|None): Where to record the timing,
+                status and size of each call. If None, the shared
+                instrumentation is used.
+        """
+        self.headers = None
+        # The AccountPool account in use, if any
+        self.leased_account = None
+
+        if instrumentation is None:
+            instrumentation = get_instrumentation()
+        self.instrumentation = instrumentation
+
+        self.version = version
+        self.base_url = base_url
+        if version == "v1":
+            self.apiRoot = base_url + "/_matrix/identity/api/v1"
+        elif version == "v2":
+            self.apiRoot = base_url + "/_matrix/identity/v2"
+        else:
+            raise Exception("Invalid version: %s" % (version,))
+
+        self.mail_sink = mail_sink
+        self._session = session
+        self._pool_size = pool_size
+
+    @property
+    def session(self):
+        if self._session is None:
+            return get_shared_client_session(self.base_url, self._pool_size)
+        return self._session
+
+    async def _request(self, method, url, raw=False, **kwargs):
+        endpoint = "%s %s" % (method, urlsplit(url).path)
+
+        # Serialise the body here so that its size is known
+        data = b""
+        if "json" in kwargs:
+            data = json.dumps(kwargs.pop("json")).encode("UTF-8")
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers["Content-Type"] = "application/json"
+            kwargs["data"] = data
+            kwargs["headers"] = headers
+
+        start = time.monotonic()
+        ttfb = None
+        try:
+            async with self.session.request(method, url, **kwargs) as resp:
+                ttfb = time.monotonic() - start
+                content = await resp.read()
+        except Exception as e:
+            self.instrumentation.record(
+                endpoint, type(e).__name__, time.monotonic() - start, ttfb, len(data), 0
+            )
+            raise
+
+        self.instrumentation.record(
+            endpoint,
+            resp.status,
+            time.monotonic() - start,
+            ttfb,
+            len(data),
+            len(content),
+        )
+        if raw:
+            return content
+        return json.loads(content)
+
+    async def make_account(self, hs_addr, openid_token=None):
+        if self.version != "v2":
+            raise Exception("Only v2 supports authentication")
+
+        server_name = server_name_for(random.choice(hs_addr_list(hs_addr)))
+        if openid_token is None:
+            openid_token = token_for_random_user(server_name)
+
+        body = await self.register(server_name, openid_token)
+        self.headers = {"Authorization": "Bearer %s" % (body["token"],)}
+        self.leased_account = None
+
+    async def get_token_from_mail(self, address=None, timeout=None, deadline=None):
+        mail = await self.mail_sink.async_wait_for_mail(
+            to=address, timeout=timeout, deadline=deadline
+        )
+        return token_from_mail(mail)
+
+    async def ping(self):
+        return await self._request("GET", self.apiRoot)
+
+    async def request_email_code(self, address, client_secret, send_attempt):
+        if self.mail_sink is not None:
+            self.mail_sink.mail_requested(address)
+        return await self._request(
+            "POST",
+            self.apiRoot + "/validate/email/requestToken",
+            json={
+                "client_secret": client_secret,
+                "email": address,
+                "send_attempt": send_attempt,
+            },
+            headers=self.headers,
+        )
+
+    async def submit_email_token(self, sid, client_secret, token):
+        return await self._request(
+            "POST",
+            self.apiRoot + "/validate/email/submitToken",
+            json={"client_secret": client_secret, "sid": sid, "token": token},
+            headers=self.headers,
+        )
+
+    async def submit_email_token_via_get(self, sid, client_secret, token):
+        return await self._request(
+            "GET",
+            self.apiRoot + "/validate/email/submitToken",
+            raw=True,
+            params={"client_secret": client_secret, "sid": sid, "token": token},
+            headers=self.headers,
+        )
+
+    async def request_and_submit_email_code(self, address):
+        client_secret = random_client_secret()
+        req_response = await self.request_email_code(address, client_secret, 1)
+
+        token = await self.get_token_from_mail(address)
+
+        sid = req_response["sid"]
+        body = await self.submit_email_token(sid, client_secret, token)
+        log.msg("submitToken returned %r" % (body,))
+        if not body["success"]:
+            raise Exception("Submit token failed")
+        return {"sid": sid, "client_secret": client_secret}
+
+    async def bind_email(self, sid, client_secret, mxid):
+        return await self._request(
+            "POST",
+            self.apiRoot + "/3pid/bind",
+            json={"client_secret": client_secret, "sid": sid, "mxid": mxid},
+            headers=self.headers,
+        )
+
+    async def lookupv1(self, medium, address):
+        return await self._request(
+            "GET",
+            self.apiRoot + "/lookup",
+            params={"medium": medium, "address": address},
+            headers=self.headers,
+        )
+
+    async def bulk_lookup(self, threepids):
+        return await self._request(
+            "POST",
+            self.apiRoot + "/bulk_lookup",
+            json={"threepids": threepids},
+            headers=self.headers,
+        )
+
+    async def get_validated_threepid(self, sid, client_secret):
+        return await self._request(
+            "GET",
+            self.apiRoot + "/3pid/getValidated3pid",
+            params={"sid": sid, "client_secret": client_secret},
+            headers=self.headers,
+        )
+
+    async def store_invite(self, params):
+        return await self._request(
+            "POST", self.apiRoot + "/store-invite", json=params, headers=self.headers
+        )
+
+    async def pubkey_is_valid(self, url, pubkey):
+        return await self._request("GET", url, params={"public_key": pubkey})
+
+    async def get_terms(self):
+        return await self._request("GET", self.apiRoot + "/terms")
+
+    async def agree_to_terms(self, user_accepts):
+        return await self._request(
+            "POST",
+            self.apiRoot + "/terms",
+            json={"user_accepts": user_accepts},
+            headers=self.headers,
+        )
+
+    async def get_versions(self):
+        return await self._request("GET", self.base_url + "/versions")
+
+    async def register(self, matrix_server_name, access_token):
+        return await self._request(
+            "POST",
+            self.apiRoot + "/account/register",
+            json={
+                "matrix_server_name": matrix_server_name,
+                "access_token": access_token,
+            },
+        )
+
+    async def account(self):
+        return await self._request(
+            "GET", self.apiRoot + "/account", headers=self.headers
+        )
+
+    def use_account(self, account):
+        """
+        Authenticate as an account leased from an AccountPool.
+        """
+        self.headers = account.headers
+        self.leased_account = account
+
+    async def logout(self):
+        body = await self._request(
+            "POST", self.apiRoot + "/account/logout", headers=self.headers
+        )
+        if self.leased_account is not None and "errcode" not in body:
+            self.leased_account.logged_out = True
+        return body
+
+    async def hash_details(self):
+        return await self._request(
+            "GET", self.apiRoot + "/hash_details", headers=self.headers
+        )
+
+    async def hashed_lookup(self, addresses, alg, pepper):
+        return await self._request(
+            "POST",
+            self.apiRoot + "/lookup",
+            json={"addresses": addresses, "algorithm": alg, "pepper": pepper},
+            headers=self.headers,
+        )
+
+    async def check_terms_signed(self):
+        body = await self.hash_details()
+        if "algorithms" in body:
+            return None
+        return body
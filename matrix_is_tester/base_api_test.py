@@ -16,7 +16,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 
 # These are standard python unit tests, but are generally intended
 # to be run with trial. Trial doesn't capture logging nicely if you
@@ -24,7 +23,7 @@ import json
 from twisted.python import log
 
 from matrix_is_tester.is_api import IsApi
-from matrix_is_tester.launch_is import get_or_launch_is
+from matrix_is_tester.launch_is import reset_is
 from matrix_is_tester.mailsink import get_shared_mailsink
 
 
@@ -35,12 +34,18 @@ class BaseApiTest(object):
     """
 
     def setUp(self):
-        self.baseUrl = get_or_launch_is()
+        # Start each test with a fresh IS where the launcher allows
+        self.baseUrl = reset_is()
 
         self.mailSink = get_shared_mailsink()
+        self.mailSink.clear()
 
         self.api = IsApi(self.baseUrl, self.API_VERSION, self.mailSink)
 
+        # The user that 3PIDs get bound to: v2 only lets the authenticated user
+        # bind to themselves, so subclasses may change this.
+        self.userId = "@some_mxid:fake.test"
+
     def test_ping(self):
         body = self.api.ping()
         self.assertEquals(body, {})
@@ -49,7 +54,7 @@ class BaseApiTest(object):
         body = self.api.request_email_code("fakeemail1@nowhere.test", "sekrit", 1)
         log.msg("Got response %r" % (body,))
         self.assertIn("sid", body)
-        self.mailSink.get_mail()
+        self.mailSink.wait_for_mail(to="fakeemail1@nowhere.test")
 
     def test_reject_invalid_email(self):
         body = self.api.request_email_code(
@@ -66,7 +71,7 @@ class BaseApiTest(object):
         )
         sid = req_response["sid"]
 
-        token = self.api.get_token_from_mail()
+        token = self.api.get_token_from_mail("steve@nowhere.test")
 
         body = self.api.submit_email_token_via_get(sid, "verysekrit", token)
         self.assertEquals(body, b"matrix_is_tester:email_submit_get_response\n")
@@ -80,8 +85,8 @@ class BaseApiTest(object):
         req_code_body = self.api.request_email_code(
             "fakeemail5@nowhere.test", "sekrit", 1
         )
-        # get the mail so we don't leave it in the queue
-        self.mailSink.get_mail()
+        # get the mail so we don't leave it in the sink
+        self.mailSink.wait_for_mail(to="fakeemail5@nowhere.test")
         body = self.api.bind_email(
             req_code_body["sid"], "sekrit", "@commonapitests:127.0.0.1:4490"
         )
@@ -99,9 +104,8 @@ class BaseApiTest(object):
         req_code_body = self.api.request_email_code(
             "fakeemail5@nowhere.test", "sekrit", 1
         )
-        # get the mail, otherwise the next test will get it
-        # instead of the one it was expecting
-        self.mailSink.get_mail()
+        # get the mail so we don't leave it in the sink
+        self.mailSink.wait_for_mail(to="fakeemail5@nowhere.test")
 
         get_val_body = self.api.get_validated_threepid(req_code_body["sid"], "sekrit")
         self.assertEquals(get_val_body["errcode"], "M_SESSION_NOT_VALIDATED")
@@ -125,15 +129,16 @@ class BaseApiTest(object):
         self.assertNotEqual(body["display_name"], "ian@fake.test")
         self.assertGreater(len(body["public_keys"]), 0)
 
+        # Ask the IS every time, rather than trusting a cached answer
         for k in body["public_keys"]:
             is_valid_body = self.api.pubkey_is_valid(
                 k["key_validity_url"], k["public_key"]
             )
             self.assertTrue(is_valid_body["valid"])
 
-        mail = self.mailSink.get_mail()
+        mail = self.mailSink.wait_for_mail(to="ian@fake.test")
         log.msg("Got email (invite): %r" % (mail,))
-        mail_object = json.loads(mail["data"])
+        mail_object = mail["invite"]
         self.assertEquals(mail_object["token"], body["token"])
         self.assertEquals(mail_object["room_alias"], "#alias:fake.test")
         self.assertEquals(mail_object["room_avatar_url"], "mxc://fake.test/roomavatar")
@@ -145,9 +150,7 @@ class BaseApiTest(object):
 
     def test_store_invite_bound_threepid(self):
         params = self.api.request_and_submit_email_code("already_here@fake.test")
-        self.api.bind_email(
-            params["sid"], params["client_secret"], "@some_mxid:fake.test"
-        )
+        self.api.bind_email(params["sid"], params["client_secret"], self.userId)
 
         body = self.api.store_invite(
             {
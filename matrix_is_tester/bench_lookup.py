@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Seeds an identity server with bound 3PIDs and measures how quickly it answers
+v2 /lookup requests as the batch size, hashing algorithm and proportion of
+addresses that are bound vary.
+"""
+
+import asyncio
+import itertools
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from matrix_is_tester.instrumentation import percentile
+from matrix_is_tester.is_api import IsApi, lookup_hashes
+from matrix_is_tester.seed import Seeder
+
+DEFAULT_BATCH_SIZES = (1, 10, 100, 1000)
+DEFAULT_ALGORITHMS = ("none", "sha256")
+DEFAULT_HIT_RATIOS = (0.0, 0.5, 1.0)
+
+
+class LookupDataset(object):
+    """
+    Generates lookup batches from a set of bound 3PIDs, mixed with addresses
+    that are not bound to anything in a given ratio.
+    """
+
+    def __init__(self, bound, medium="email", seed=0):
+        """
+        Args:
+            bound (list[tuple[str, str]]): (address, mxid) of each 3PID bound
+                on the server.
+            medium (str): The medium of the bound 3PIDs.
+            seed (int): Seed for choosing addresses, so that runs with the
+                same dataset send the same batches.
+        """
+        self.bound = list(bound)
+        self.medium = medium
+        self._random = random.Random(seed)
+        self._seed = seed
+        self._misses = itertools.count()
+
+    def batch(self, size, hit_ratio):
+        """
+        Pick a batch of addresses to look up.
+
+        Args:
+            size (int): Number of addresses in the batch.
+            hit_ratio (float): Proportion of the batch that is bound, between
+                0 and 1. Limited by the size of the dataset.
+
+        Returns:
+            list[tuple[str, str|None]]: (address, mxid) pairs in random order,
+                where mxid is None for addresses that aren't bound.
+        """
+        hits = min(int(round(size * hit_ratio)), len(self.bound))
+        entries = self._random.sample(self.bound, hits)
+        for _ in range(size - hits):
+            address = "miss-%d-%d@bench.test" % (self._seed, next(self._misses))
+            entries.append((address, None))
+        self._random.shuffle(entries)
+        return entries
+
+    def query(self, entries, algorithm, pepper):
+        """
+        Turn a batch into the addresses to send to /lookup and the mappings
+        the server should answer with.
+
+        Returns:
+            tuple[list[str], dict[str, str]]
+        """
+        if algorithm == "sha256":
+            addresses = lookup_hashes(
+                [(self.medium, address) for address, _ in entries], pepper
+            )
+        else:
+            addresses = ["%s %s" % (address, self.medium) for address, _ in entries]
+
+        expected = {}
+        for lookup, (_, mxid) in zip(addresses, entries):
+            if mxid is not None:
+                expected[lookup] = mxid
+        return addresses, expected
+
+
+def run_lookups(
+    api,
+    dataset,
+    batch_size,
+    algorithm,
+    hit_ratio,
+    pepper,
+    requests,
+    concurrency,
+    stream=False,
+    chunk_size=None,
+):
+    """
+    Send lookups for one combination of parameters and summarise them.
+
+    Batches are generated and hashed before the clock starts, so only the
+    requests themselves are timed. With `stream`, responses are parsed as
+    they arrive, which keeps memory down for very large batches. With
+    `chunk_size`, each batch is split into requests of that many addresses,
+    sent concurrently. Each of the `concurrency` workers sends only its share
+    of the API's lookup_concurrency chunks at once, so that the requests in
+    flight don't outnumber the connections and the latencies don't include
+    time spent queueing for one.
+
+    Returns:
+        dict: The parameters, throughput, latency percentiles, errors by
+            errcode and the number of responses with wrong mappings.
+    """
+    queries = [
+        dataset.query(dataset.batch(batch_size, hit_ratio), algorithm, pepper)
+        for _ in range(requests)
+    ]
+
+    chunk_concurrency = max(api.lookup_concurrency // concurrency, 1)
+
+    def lookup(query):
+        addresses, expected = query
+        start = time.monotonic()
+        try:
+            body = api.hashed_lookup(
+                addresses,
+                algorithm,
+                pepper,
+                stream=stream,
+                chunk_size=chunk_size,
+                concurrency=chunk_concurrency,
+            )
+        except Exception as e:
+            return time.monotonic() - start, type(e).__name__, False
+        latency = time.monotonic() - start
+        if "errcode" in body:
+            return latency, body["errcode"], False
+        return latency, None, body.get("mappings") != expected
+
+    api.reset_lookup_chunk_stats()
+    start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lookup, queries))
+    duration = time.monotonic() - start
+
+    latencies = sorted(latency for latency, _, _ in results)
+    errors = {}
+    for _, errcode, _ in results:
+        if errcode is not None:
+            errors[errcode] = errors.get(errcode, 0) + 1
+
+    return {
+        "batch_size": batch_size,
+        "algorithm": algorithm,
+        "hit_ratio": hit_ratio,
+        "requests": requests,
+        "duration": duration,
+        "throughput": requests / duration,
+        "addresses_per_second": requests * batch_size / duration,
+        "errors": errors,
+        "wrong_mappings": sum(1 for _, _, wrong in results if wrong),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "chunk_size": chunk_size,
+        "chunk_concurrency": chunk_concurrency if chunk_size else None,
+        "chunk_latency": api.lookup_chunk_stats() if chunk_size else None,
+    }
+
+
+def run_benchmark(
+    base_url,
+    mail_sink,
+    hs_addr,
+    size,
+    batch_sizes=DEFAULT_BATCH_SIZES,
+    algorithms=DEFAULT_ALGORITHMS,
+    hit_ratios=DEFAULT_HIT_RATIOS,
+    requests=200,
+    concurrency=10,
+    seed_concurrency=256,
+    journal=None,
+    seed=None,
+    stream=False,
+    chunk_size=None,
+):
+    """
+    Seed an identity server with bound 3PIDs, then sweep lookups over every
+    combination of batch size, algorithm and hit ratio.
+
+    Args:
+        base_url (str): The base URL of the IS to benchmark.
+        mail_sink (MailSink): The mail sink the IS sends its mail to.
+        hs_addr (tuple|list[tuple]): Host, port of the fake homeserver, or a
+            list of them to spread the accounts over.
+        size (int): How many 3PIDs to bind before looking any up.
+        batch_sizes (list[int]): Addresses per /lookup request.
+        algorithms (list[str]): Lookup algorithms to use.
+        hit_ratios (list[float]): Proportions of each batch that are bound.
+        requests (int): Lookups to send for each combination.
+        concurrency (int): Lookups in flight at once.
+        seed_concurrency (int): Bindings in flight at once while seeding.
+        journal (str|None): Seeding journal, so that bindings made by an
+            earlier run against the same IS are reused.
+        seed (callable|None): Called with `size` to seed the IS instead of
+            using Seeder directly, eg. to use the fixture cache. Must return
+            a report like Seeder.run's.
+        stream (bool): Parse each lookup response as it arrives.
+        chunk_size (int|None): Split each batch into concurrent requests of
+            this many addresses.
+
+    Returns:
+        dict: JSON-serialisable results, including the server's /versions
+            response so that runs against different versions can be told
+            apart.
+    """
+    if seed is None:
+        seeder = Seeder(
+            base_url,
+            mail_sink,
+            hs_addr,
+            prefix="bench",
+            journal=journal,
+            in_flight=seed_concurrency,
+        )
+        seed_report = asyncio.run(seeder.run(size))
+    else:
+        seed_report = seed(size)
+    if seed_report["failed"]:
+        raise Exception("Failed to bind %d 3PIDs" % (seed_report["failed"],))
+    dataset = LookupDataset(seed_report["bindings"])
+
+    api = IsApi(base_url, "v2", mail_sink, pool_size=concurrency)
+    api.make_account(hs_addr)
+    hash_details = api.hash_details()
+    for algorithm in algorithms:
+        if algorithm not in hash_details["algorithms"]:
+            raise Exception(
+                "Server does not support lookup algorithm %s" % (algorithm,)
+            )
+
+    try:
+        versions = api.get_versions()
+    except ValueError:
+        # Not all identity servers serve /versions
+        versions = None
+
+    results = []
+    for batch_size, algorithm, hit_ratio in itertools.product(
+        batch_sizes, algorithms, hit_ratios
+    ):
+        results.append(
+            run_lookups(
+                api,
+                dataset,
+                batch_size,
+                algorithm,
+                hit_ratio,
+                hash_details["lookup_pepper"],
+                requests,
+                concurrency,
+                stream=stream,
+                chunk_size=chunk_size,
+            )
+        )
+
+    return {
+        "timestamp": time.time(),
+        "server": {"base_url": base_url, "versions": versions},
+        "dataset": {
+            "size": size,
+            "seeded": seed_report["bound"],
+            "seed_duration": seed_report["duration"],
+            "seed_rate": seed_report["rate"],
+            "cached": seed_report.get("cached", False),
+        },
+        "concurrency": concurrency,
+        "stream": stream,
+        "chunk_size": chunk_size,
+        "results": results,
+    }
+
+
+def format_results(report):
+    dataset = report["dataset"]
+    if dataset["cached"]:
+        summary = "restored %d bound 3PIDs from the fixture cache in %.1fs" % (
+            dataset["size"],
+            dataset["seed_duration"],
+        )
+    else:
+        summary = "seeded %d of %d bound 3PIDs in %.1fs (%.1f/s)" % (
+            dataset["seeded"],
+            dataset["size"],
+            dataset["seed_duration"],
+            dataset["seed_rate"],
+        )
+    lines = [
+        summary,
+        "",
+        "%6s %-7s %5s %9s %11s %7s %6s %9s %9s %9s"
+        % (
+            "batch",
+            "alg",
+            "hits",
+            "req/s",
+            "addrs/s",
+            "errors",
+            "wrong",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+        ),
+    ]
+    for result in report["results"]:
+        lines.append(
+            "%6d %-7s %4d%% %9.1f %11.1f %7d %6d %9.1f %9.1f %9.1f"
+            % (
+                result["batch_size"],
+                result["algorithm"],
+                result["hit_ratio"] * 100,
+                result["throughput"],
+                result["addresses_per_second"],
+                sum(result["errors"].values()),
+                result["wrong_mappings"],
+                result["p50"] * 1000,
+                result["p95"] * 1000,
+                result["p99"] * 1000,
+            )
+        )
+
+    if report.get("chunk_size"):
+        lines.extend(
+            [
+                "",
+                "split into chunks of up to %d addresses:" % (report["chunk_size"],),
+                "%6s %-7s %5s %6s %7s %9s %9s %9s"
+                % (
+                    "batch",
+                    "alg",
+                    "hits",
+                    "chunk",
+                    "count",
+                    "p50 ms",
+                    "p90 ms",
+                    "p99 ms",
+                ),
+            ]
+        )
+        for result in report["results"]:
+            for size, latency in sorted(result["chunk_latency"].items()):
+                lines.append(
+                    "%6d %-7s %4d%% %6d %7d %9.1f %9.1f %9.1f"
+                    % (
+                        result["batch_size"],
+                        result["algorithm"],
+                        result["hit_ratio"] * 100,
+                        size,
+                        latency["count"],
+                        latency["p50"] * 1000,
+                        latency["p90"] * 1000,
+                        latency["p99"] * 1000,
+                    )
+                )
+    return "\n".join(lines)
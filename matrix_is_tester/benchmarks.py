@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the latency and throughput of each identity server endpoint on its
+own, for comparing against a baseline with matrix_is_tester.regression.
+
+Each benchmark does any set-up its requests need first (eg. validating the
+sessions to bind), then times only the requests to its endpoint.
+"""
+
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from matrix_is_tester.fakehs import hs_addr_list, server_name_for, token_for_user
+from matrix_is_tester.instrumentation import percentile
+from matrix_is_tester.is_api import IsApi, lookup_hashes
+
+LOOKUP_BATCH_SIZE = 10
+
+
+class BenchmarkContext(object):
+    """
+    State shared by the benchmarks of one run.
+    """
+
+    def __init__(self, base_url, mail_sink, hs_addr, concurrency):
+        self.base_url = base_url
+        self.mail_sink = mail_sink
+        self.hs_addr = hs_addr
+        self.server_names = [server_name_for(addr) for addr in hs_addr_list(hs_addr)]
+        self.server_name = self.server_names[0]
+        self.concurrency = concurrency
+        self.run_id = uuid.uuid4().hex[:8]
+
+        self.user_id = self.new_user_id("bench")
+        self.api = IsApi(base_url, "v2", mail_sink, pool_size=concurrency)
+        self.api.make_account(hs_addr_list(hs_addr)[0], token_for_user(self.user_id))
+
+    def new_address(self, name, i):
+        return "bench-%s-%s-%d@bench.test" % (self.run_id, name, i)
+
+    def new_user_id(self, name, i=0, server_name=None):
+        if server_name is None:
+            server_name = self.server_name
+        return "@bench-%s-%s-%d:%s" % (self.run_id, name, i, server_name)
+
+    def map(self, func, items):
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            return list(pool.map(func, items))
+
+
+def _prepare_ping(ctx, n):
+    return [ctx.api.ping] * n, None
+
+
+def _prepare_register(ctx, n):
+    api = IsApi(ctx.base_url, "v2", ctx.mail_sink)
+
+    def op(i):
+        # Spread over the homeservers, if there are several
+        server_name = ctx.server_names[i % len(ctx.server_names)]
+        return lambda: api.register(
+            server_name, token_for_user(ctx.new_user_id("register", i, server_name))
+        )
+
+    return [op(i) for i in range(n)], None
+
+
+def _prepare_hash_details(ctx, n):
+    return [ctx.api.hash_details] * n, None
+
+
+def _prepare_request_token(ctx, n):
+    def op(i):
+        return lambda: ctx.api.request_email_code(
+            ctx.new_address("request", i), "benchsecret", 1
+        )
+
+    return [op(i) for i in range(n)], ctx.mail_sink.clear
+
+
+def _prepare_submit_token(ctx, n):
+    def prepare(i):
+        address = ctx.new_address("submit", i)
+        body = ctx.api.request_email_code(address, "benchsecret", 1)
+        token = ctx.api.get_token_from_mail(address)
+        return lambda: ctx.api.submit_email_token(body["sid"], "benchsecret", token)
+
+    return ctx.map(prepare, range(n)), None
+
+
+def _prepare_bind(ctx, n):
+    def prepare(i):
+        params = ctx.api.request_and_submit_email_code(ctx.new_address("bind", i))
+        return lambda: ctx.api.bind_email(
+            params["sid"], params["client_secret"], ctx.user_id
+        )
+
+    return ctx.map(prepare, range(n)), None
+
+
+def _prepare_lookup(ctx, n):
+    # Half of each batch is bound
+    bound = [ctx.new_address("lookup", i) for i in range(LOOKUP_BATCH_SIZE // 2)]
+    for address in bound:
+        params = ctx.api.request_and_submit_email_code(address)
+        ctx.api.bind_email(params["sid"], params["client_secret"], ctx.user_id)
+
+    pepper = ctx.api.hash_details()["lookup_pepper"]
+
+    def op(i):
+        addresses = bound + [
+            ctx.new_address("unbound-%d" % (i,), j)
+            for j in range(LOOKUP_BATCH_SIZE - len(bound))
+        ]
+        hashes = lookup_hashes([("email", address) for address in addresses], pepper)
+        return lambda: ctx.api.hashed_lookup(hashes, "sha256", pepper)
+
+    return [op(i) for i in range(n)], None
+
+
+def _prepare_store_invite(ctx, n):
+    def op(i):
+        return lambda: ctx.api.store_invite(
+            {
+                "medium": "email",
+                "address": ctx.new_address("invite", i),
+                "room_id": "!bench:%s" % (ctx.server_name,),
+                "sender": ctx.user_id,
+            }
+        )
+
+    return [op(i) for i in range(n)], ctx.mail_sink.clear
+
+
+# Endpoint, relative to the v2 API root, to the function that prepares its
+# requests. Each returns a list of calls to time, and something to call
+# afterwards to clean up, or None.
+BENCHMARKS = {
+    "/": _prepare_ping,
+    "/account/register": _prepare_register,
+    "/hash_details": _prepare_hash_details,
+    "/validate/email/requestToken": _prepare_request_token,
+    "/validate/email/submitToken": _prepare_submit_token,
+    "/3pid/bind": _prepare_bind,
+    "/lookup": _prepare_lookup,
+    "/store-invite": _prepare_store_invite,
+}
+
+
+def _time_call(call):
+    start = time.monotonic()
+    try:
+        body = call()
+    except Exception as e:
+        return time.monotonic() - start, type(e).__name__
+    latency = time.monotonic() - start
+    if isinstance(body, dict) and "errcode" in body:
+        return latency, body["errcode"]
+    return latency, None
+
+
+def run_benchmark(ctx, endpoint, requests):
+    """
+    Prepare and time `requests` requests to one endpoint.
+
+    Returns:
+        dict: Requests sent, throughput, errors by errcode and latency
+            percentiles.
+    """
+    calls, cleanup = BENCHMARKS[endpoint](ctx, requests)
+
+    start = time.monotonic()
+    results = ctx.map(_time_call, calls)
+    duration = time.monotonic() - start
+
+    if cleanup is not None:
+        cleanup()
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = {}
+    for _, errcode in results:
+        if errcode is not None:
+            errors[errcode] = errors.get(errcode, 0) + 1
+
+    return {
+        "requests": requests,
+        "throughput": requests / duration,
+        "errors": errors,
+        "error_rate": sum(errors.values()) / float(requests),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def run_benchmarks(
+    base_url, mail_sink, hs_addr, endpoints=None, requests=200, concurrency=10
+):
+    """
+    Run the benchmark for each endpoint in turn.
+
+    Args:
+        base_url (str): The base URL of the IS to benchmark.
+        mail_sink (MailSink): The mail sink the IS sends its mail to.
+        hs_addr (tuple|list[tuple]): Host, port of the fake homeserver, or a
+            list of them to spread the /account/register requests over.
+        endpoints (list[str]|None): Endpoints to benchmark, from BENCHMARKS.
+            Defaults to all of them.
+        requests (int): Requests to time for each endpoint.
+        concurrency (int): Requests to have in flight at once.
+
+    Returns:
+        dict: JSON-serialisable results, with an entry in 'endpoints' for
+            each endpoint benchmarked.
+    """
+    if endpoints is None:
+        endpoints = list(BENCHMARKS.keys())
+    for endpoint in endpoints:
+        if endpoint not in BENCHMARKS:
+            raise Exception("No benchmark for endpoint: %s" % (endpoint,))
+
+    ctx = BenchmarkContext(base_url, mail_sink, hs_addr, concurrency)
+    try:
+        versions = ctx.api.get_versions()
+    except ValueError:
+        # Not all identity servers serve /versions
+        versions = None
+
+    return {
+        "timestamp": time.time(),
+        "server": {"base_url": base_url, "versions": versions},
+        "requests": requests,
+        "concurrency": concurrency,
+        "endpoints": dict(
+            (endpoint, run_benchmark(ctx, endpoint, requests)) for endpoint in endpoints
+        ),
+    }
+
+
+def format_results(results):
+    """
+    Format the results of run_benchmarks as a table, one row per endpoint.
+    """
+    lines = [
+        "%-32s %8s %9s %7s %9s %9s %9s"
+        % ("endpoint", "requests", "req/s", "errors", "p50 ms", "p95 ms", "p99 ms")
+    ]
+    for endpoint, stats in sorted(results["endpoints"].items()):
+        lines.append(
+            "%-32s %8d %9.1f %6.1f%% %9.1f %9.1f %9.1f"
+            % (
+                endpoint,
+                stats["requests"],
+                stats["throughput"],
+                stats["error_rate"] * 100,
+                stats["p50"] * 1000,
+                stats["p95"] * 1000,
+                stats["p99"] * 1000,
+            )
+        )
+    return "\n".join(lines)
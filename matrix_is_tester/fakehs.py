@@ -17,23 +17,67 @@
 import atexit
 import base64
 import json
+import math
+import multiprocessing
 import os
 import random
+import socket
 import ssl
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process
 
-from six.moves import BaseHTTPServer, urllib
+from six.moves import BaseHTTPServer, http_client, socketserver, urllib
+
+from matrix_is_tester.workers import port_for_worker
+
+DEFAULT_PORT = 4490
+DEFAULT_SERVER_NAME = "127.0.0.1:%d" % (DEFAULT_PORT,)
+
+BEHAVIOUR_ENV = "MATRIX_IS_TESTER_FAKE_HS_BEHAVIOUR"
+
+# The endpoints the fake homeserver serves, by the name their behaviour is
+# configured under.
+ENDPOINTS = {
+    "userinfo": "/_matrix/federation/v1/openid/userinfo",
+    "version": "/_matrix/federation/v1/version",
+}
+_ENDPOINTS_BY_PATH = dict((path, name) for name, path in ENDPOINTS.items())
+
+# Paths under this are for controlling the fake homeserver itself
+ADMIN_PREFIX = "/_fake/"
+
+# The parameters of each latency distribution, all in seconds except sigma,
+# the standard deviation of the latency's natural logarithm.
+LATENCY_DISTRIBUTIONS = {
+    "fixed": ("value",),
+    "uniform": ("min", "max"),
+    "normal": ("mean", "stddev"),
+    "lognormal": ("median", "sigma"),
+    "exponential": ("mean",),
+}
+
+_DEFAULT_ENDPOINT_BEHAVIOUR = {
+    "latency": None,
+    "error_rate": 0.0,
+    "error_status": 500,
+    "max_concurrency": None,
+}
+
+_MAX_BEHAVIOUR_BYTES = 65536
+_COUNTERS = ("requests", "errors", "in_flight", "peak_in_flight")
 
 shared_fake_hs = None
 
 
-def token_for_random_user():
+def token_for_random_user(server_name=DEFAULT_SERVER_NAME):
     """
     Return an OpenID token as would be obtained from the client/server API.
-    The token will represent a random user account.
+    The token will represent a random user account on the given homeserver.
     """
     num = random.randint(0, 2**32)
-    user_id = "@user%d:127.0.0.1:4490" % (num,)
+    user_id = "@user%d:%s" % (num, server_name)
     return "user:%s" % (base64.b64encode(user_id.encode("UTF-8")).decode("UTF-8"),)
 
 
@@ -45,13 +89,35 @@ def token_for_user(user_id):
     return "user:%s" % (base64.b64encode(user_id.encode("UTF-8")).decode("UTF-8"),)
 
 
+def hs_addr_list(hs_addr):
+    """
+    Returns the homeserver addresses to spread accounts over, from either one
+    (host, port) tuple or a list of them, as from FakeHomeserverPool.get_addrs.
+    """
+    if isinstance(hs_addr, list):
+        return hs_addr
+    return [hs_addr]
+
+
+def server_name_for(hs_addr):
+    """
+    Returns the server name of the homeserver at a (host, port) address.
+    """
+    return ":".join([str(x) for x in hs_addr])
+
+
 def get_shared_fake_hs():
     """
     Get the shared fake homeserver object, instantiating it if necessary.
     """
     global shared_fake_hs
     if shared_fake_hs is None:
-        shared_fake_hs = FakeHomeserver()
+        behaviour = None
+        if os.environ.get(BEHAVIOUR_ENV):
+            behaviour = json.loads(os.environ[BEHAVIOUR_ENV])
+        shared_fake_hs = FakeHomeserver(
+            port=port_for_worker(DEFAULT_PORT), behaviour=behaviour
+        )
         shared_fake_hs.launch()
         atexit.register(_destroy_shared)
     return shared_fake_hs
@@ -61,77 +127,655 @@ def _destroy_shared():
     shared_fake_hs.tearDown()
 
 
+def _check_number(value, what, minimum=0.0, maximum=None):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("%s must be a number, not %r" % (what, value))
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValueError("%s is out of range: %r" % (what, value))
+    return value
+
+
+def _validate_latency(latency, endpoint):
+    if latency is None:
+        return None
+    if not isinstance(latency, dict):
+        raise ValueError("Latency for %s must be an object" % (endpoint,))
+
+    distribution = latency.get("distribution")
+    if distribution not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(
+            "Unknown latency distribution for %s: %r" % (endpoint, distribution)
+        )
+    params = LATENCY_DISTRIBUTIONS[distribution]
+    unknown = set(latency) - set(params) - {"distribution"}
+    if unknown:
+        raise ValueError(
+            "Unknown %s latency parameters for %s: %s"
+            % (distribution, endpoint, ", ".join(sorted(unknown)))
+        )
+
+    validated = {"distribution": distribution}
+    for param in params:
+        if param not in latency:
+            raise ValueError(
+                "%s latency for %s needs %s" % (distribution, endpoint, param)
+            )
+        validated[param] = _check_number(
+            latency[param], "%s latency %s" % (endpoint, param)
+        )
+    if distribution == "uniform" and validated["min"] > validated["max"]:
+        raise ValueError("Uniform latency for %s has min > max" % (endpoint,))
+    if distribution in ("lognormal", "exponential") and not validated[params[0]]:
+        raise ValueError(
+            "%s latency for %s needs a positive %s"
+            % (distribution, endpoint, params[0])
+        )
+    return validated
+
+
+def validate_behaviour(behaviour):
+    """
+    Check a behaviour for the fake homeserver, filling in the defaults.
+
+    Args:
+        behaviour (dict): Endpoint name (from ENDPOINTS) to an object with
+            any of:
+            'latency': How long to wait before responding, as an object with
+                a 'distribution' from LATENCY_DISTRIBUTIONS and its
+                parameters, or null for no delay.
+            'error_rate': Proportion of requests to fail, from 0 to 1.
+            'error_status': The HTTP status to fail them with (default 500).
+            'max_concurrency': Most requests to serve at once, across all the
+                worker processes, or null for no limit. Requests over the
+                limit wait for a slot, as on an overloaded server. The
+                latency is spent holding the slot.
+            Endpoints left out get the default: no delay, errors or limit.
+
+    Returns:
+        dict: The behaviour, with an entry for every endpoint.
+
+    Raises:
+        ValueError: If the behaviour isn't valid.
+    """
+    if not isinstance(behaviour, dict):
+        raise ValueError("Behaviour must be an object")
+    unknown = set(behaviour) - set(ENDPOINTS)
+    if unknown:
+        raise ValueError("Unknown endpoints: %s" % (", ".join(sorted(unknown)),))
+
+    validated = {}
+    for endpoint in ENDPOINTS:
+        given = behaviour.get(endpoint) or {}
+        if not isinstance(given, dict):
+            raise ValueError("Behaviour for %s must be an object" % (endpoint,))
+        unknown = set(given) - set(_DEFAULT_ENDPOINT_BEHAVIOUR)
+        if unknown:
+            raise ValueError(
+                "Unknown settings for %s: %s" % (endpoint, ", ".join(sorted(unknown)))
+            )
+
+        endpoint_behaviour = dict(_DEFAULT_ENDPOINT_BEHAVIOUR)
+        endpoint_behaviour.update(given)
+        endpoint_behaviour["latency"] = _validate_latency(
+            endpoint_behaviour["latency"], endpoint
+        )
+        _check_number(
+            endpoint_behaviour["error_rate"], "%s error_rate" % (endpoint,), 0, 1
+        )
+        status = endpoint_behaviour["error_status"]
+        if not isinstance(status, int) or not 400 <= status <= 599:
+            raise ValueError(
+                "%s error_status must be an HTTP error status, not %r"
+                % (endpoint, status)
+            )
+        limit = endpoint_behaviour["max_concurrency"]
+        if limit is not None and (not isinstance(limit, int) or limit < 1):
+            raise ValueError(
+                "%s max_concurrency must be a positive integer, not %r"
+                % (endpoint, limit)
+            )
+        validated[endpoint] = endpoint_behaviour
+    return validated
+
+
+def sample_latency(latency, rng=random):
+    """
+    Pick a latency, in seconds, from a validated latency distribution.
+    """
+    if latency is None:
+        return 0.0
+
+    distribution = latency["distribution"]
+    if distribution == "fixed":
+        value = latency["value"]
+    elif distribution == "uniform":
+        value = rng.uniform(latency["min"], latency["max"])
+    elif distribution == "normal":
+        value = rng.gauss(latency["mean"], latency["stddev"])
+    elif distribution == "lognormal":
+        value = rng.lognormvariate(math.log(latency["median"]), latency["sigma"])
+    else:
+        value = rng.expovariate(1.0 / latency["mean"])
+    return max(value, 0.0)
+
+
+class _SharedState(object):
+    """
+    The behaviour of a fake homeserver and its request counters, in shared
+    memory so that they apply across all of its worker processes, and can be
+    changed while it runs.
+    """
+
+    def __init__(self):
+        self._behaviour_lock = multiprocessing.Lock()
+        self._behaviour_data = multiprocessing.RawArray("c", _MAX_BEHAVIOUR_BYTES)
+        self._behaviour_size = multiprocessing.RawValue("i", 0)
+        self._behaviour_version = multiprocessing.RawValue("i", 0)
+
+        # Guards the counters, and is waited on for concurrency slots
+        self._slots = multiprocessing.Condition(multiprocessing.Lock())
+        self._counters = multiprocessing.RawArray("l", len(ENDPOINTS) * len(_COUNTERS))
+        self._endpoint_index = dict(
+            (endpoint, i) for i, endpoint in enumerate(sorted(ENDPOINTS))
+        )
+
+        # Each process's parsed copy of the behaviour
+        self._cached_version = None
+        self._cached = None
+
+        self.set_behaviour({})
+
+    def set_behaviour(self, behaviour):
+        behaviour = validate_behaviour(behaviour)
+        data = json.dumps(behaviour).encode("UTF-8")
+        if len(data) > _MAX_BEHAVIOUR_BYTES:
+            raise ValueError("Behaviour is too large")
+
+        with self._behaviour_lock:
+            self._behaviour_data[: len(data)] = data
+            self._behaviour_size.value = len(data)
+            self._behaviour_version.value += 1
+
+        # A limit may have gone up: let waiting requests re-check it
+        with self._slots:
+            self._slots.notify_all()
+        return behaviour
+
+    def get_behaviour(self):
+        # Reading the version without the lock is fine: a stale version only
+        # means the behaviour is re-read next time.
+        if self._cached_version != self._behaviour_version.value:
+            with self._behaviour_lock:
+                self._cached_version = self._behaviour_version.value
+                data = self._behaviour_data[: self._behaviour_size.value]
+            self._cached = json.loads(data.decode("UTF-8"))
+        return self._cached
+
+    def _counter(self, endpoint, name):
+        return self._endpoint_index[endpoint] * len(_COUNTERS) + _COUNTERS.index(name)
+
+    def acquire(self, endpoint):
+        """
+        Wait for a free concurrency slot for the endpoint, and take it.
+        """
+        in_flight = self._counter(endpoint, "in_flight")
+        peak = self._counter(endpoint, "peak_in_flight")
+        with self._slots:
+            while True:
+                limit = self.get_behaviour()[endpoint]["max_concurrency"]
+                if limit is None or self._counters[in_flight] < limit:
+                    break
+                self._slots.wait()
+            self._counters[in_flight] += 1
+            self._counters[peak] = max(self._counters[peak], self._counters[in_flight])
+
+    def release(self, endpoint, failed):
+        """
+        Give back a concurrency slot taken by acquire, counting the request.
+        """
+        with self._slots:
+            self._counters[self._counter(endpoint, "in_flight")] -= 1
+            self._counters[self._counter(endpoint, "requests")] += 1
+            if failed:
+                self._counters[self._counter(endpoint, "errors")] += 1
+            self._slots.notify_all()
+
+    def get_stats(self):
+        with self._slots:
+            return dict(
+                (
+                    endpoint,
+                    dict(
+                        (name, self._counters[self._counter(endpoint, name)])
+                        for name in _COUNTERS
+                    ),
+                )
+                for endpoint in ENDPOINTS
+            )
+
+    def reset_stats(self):
+        with self._slots:
+            for endpoint in ENDPOINTS:
+                in_flight = self._counters[self._counter(endpoint, "in_flight")]
+                for name in _COUNTERS:
+                    self._counters[self._counter(endpoint, name)] = 0
+                self._counters[self._counter(endpoint, "in_flight")] = in_flight
+                self._counters[self._counter(endpoint, "peak_in_flight")] = in_flight
+
+
 class _FakeHomeserverRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+    # The headers and body are written separately: don't let the body wait
+    # for the client to ACK the headers.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # The TLS handshake is done here, on the request's own thread, rather
+        # than by accept() on the thread serving the listening socket.
+        self.request.do_handshake()
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
     def do_GET(self):
-        if self.path.startswith("/_matrix/federation/v1/openid/userinfo"):
-            parsed = urllib.parse.urlparse(self.path)
-            params = urllib.parse.parse_qs(parsed.query)
+        self._dispatch("GET")
 
-            token = params["access_token"][0]
+    def do_PUT(self):
+        self._dispatch("PUT")
 
-            if token.startswith("user:"):
-                userid = base64.b64decode(token.split(":")[1])
-            else:
-                resp = json.dumps(
-                    {
-                        "errcode": "M_UNKNOWN_TOKEN",
-                        "error": "Not a valid token: try again.",
-                    }
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        parsed = urllib.parse.urlparse(self.path)
+        if parsed.path.startswith(ADMIN_PREFIX):
+            self._handle_admin(method, parsed.path.replace(ADMIN_PREFIX, "", 1))
+            return
+
+        endpoint = _ENDPOINTS_BY_PATH.get(parsed.path)
+        if endpoint is None or method != "GET":
+            self._send_json(404, {"errcode": "M_UNRECOGNIZED", "error": "Not found"})
+            return
+
+        state = self.server.state
+        behaviour = state.get_behaviour()[endpoint]
+        state.acquire(endpoint)
+        failed = False
+        try:
+            delay = sample_latency(behaviour["latency"])
+            if delay:
+                time.sleep(delay)
+
+            if behaviour["error_rate"] and random.random() < behaviour["error_rate"]:
+                failed = True
+                self._send_json(
+                    behaviour["error_status"],
+                    {"errcode": "M_UNKNOWN", "error": "Injected error"},
                 )
-                self.send_response(401)
-                self.send_header("Content-Length", len(resp))
-                self.end_headers()
+            else:
+                getattr(self, "_do_" + endpoint)(parsed)
+        finally:
+            state.release(endpoint, failed)
+
+    def _do_userinfo(self, parsed):
+        params = urllib.parse.parse_qs(parsed.query)
 
-                self.wfile.write(resp)
+        token = params["access_token"][0]
+
+        if token.startswith("user:"):
+            userid = base64.b64decode(token.split(":")[1])
+        else:
+            self._send_json(
+                401,
+                {
+                    "errcode": "M_UNKNOWN_TOKEN",
+                    "error": "Not a valid token: try again.",
+                },
+            )
+            return
 
-            resp = json.dumps({"sub": userid.decode("UTF-8")}).encode("UTF-8")
+        self._send_json(200, {"sub": userid.decode("UTF-8")})
 
-            self.send_response(200)
-            self.send_header("Content-Length", len(resp))
-            self.end_headers()
+    def _do_version(self, parsed):
+        self._send_json(200, {"server": {"name": "matrix-is-tester fakehs"}})
 
-            self.wfile.write(resp)
+    def _handle_admin(self, method, name):
+        state = self.server.state
+        if name == "behaviour" and method == "GET":
+            self._send_json(200, state.get_behaviour())
+        elif name == "behaviour" and method == "PUT":
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                behaviour = state.set_behaviour(json.loads(self.rfile.read(length)))
+            except ValueError as e:
+                self._send_json(400, {"errcode": "M_INVALID_PARAM", "error": str(e)})
+                return
+            self._send_json(200, behaviour)
+        elif name == "stats" and method == "GET":
+            self._send_json(200, state.get_stats())
+        elif name == "stats" and method == "DELETE":
+            state.reset_stats()
+            self._send_json(200, {})
         else:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write("Not found")
+            self._send_json(404, {"errcode": "M_UNRECOGNIZED", "error": "Not found"})
+
+    def _send_json(self, code, body):
+        resp = json.dumps(body).encode("UTF-8")
+
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(resp)))
+        self.end_headers()
+
+        self.wfile.write(resp)
 
     def log_message(self, fmt, *args):
         # don't print to stdout: it screws up the test output (and we don't really care)
         return
 
 
-def _run_http_server():
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-handshake or on idle keep-alive connections is
+        # business as usual.
+        if isinstance(sys.exc_info()[1], (ssl.SSLError, ConnectionError)):
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+def _make_ssl_context():
     cert_file = os.path.join(os.path.dirname(__file__), "fakehs.pem")
 
-    httpd = BaseHTTPServer.HTTPServer(
-        ("127.0.00.1", 4490), _FakeHomeserverRequestHandler
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file)
+    # Let clients resume TLS sessions with tickets rather than doing a full
+    # handshake for each new connection.
+    context.options &= ~ssl.OP_NO_TICKET
+    return context
+
+
+def _run_http_server(listen_socket, state, ssl_context=None):
+    if ssl_context is None:
+        ssl_context = _make_ssl_context()
+
+    httpd = _ThreadingHTTPServer(
+        listen_socket.getsockname(),
+        _FakeHomeserverRequestHandler,
+        bind_and_activate=False,
+    )
+    httpd.state = state
+    httpd.socket = ssl_context.wrap_socket(
+        listen_socket, server_side=True, do_handshake_on_connect=False
     )
-    httpd.socket = ssl.wrap_socket(httpd.socket, certfile=cert_file, server_side=True)
     httpd.serve_forever()
 
 
 class FakeHomeserver(object):
     """
     A class that spawns an HTTP server that looks like a Matrix Homeserver.
-    Currently just implements the federation OpenID endpoint to validate OpenID tokens.
+    Currently just implements the federation OpenID endpoint to validate OpenID
+    tokens, and the federation version endpoint.
+
+    Each endpoint can be made slow, flaky or limited in how many requests it
+    serves at once, while the server runs: see validate_behaviour. This can be
+    set from the test process with set_behaviour, or over HTTP through
+    /_fake/behaviour (GET or PUT). /_fake/stats counts the requests to each
+    endpoint, how many failed and how many were in flight at once, and
+    DELETE /_fake/stats resets the counts.
     """
 
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, workers=1, behaviour=None):
+        """
+        Args:
+            host (str): Address to listen on.
+            port (int): Port to listen on, or 0 to pick a free one.
+            workers (int): Number of processes to serve requests from. Each
+                serves many connections at once on separate threads.
+            behaviour (dict|None): How each endpoint behaves, as for
+                validate_behaviour. Defaults to serving every request at once,
+                without errors.
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self._state = _SharedState()
+        if behaviour is not None:
+            self._state.set_behaviour(behaviour)
+
     def launch(self):
-        self.process = Process(target=_run_http_server)
-        self.process.start()
+        # Listen before starting the workers so that nobody gets turned away
+        # while they start up: they all accept connections from this socket.
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listen_socket.bind((self.host, self.port))
+        listen_socket.listen(128)
+        self.port = listen_socket.getsockname()[1]
+
+        # Forked workers can share one SSL context, and so its session ticket
+        # keys: then a client can resume its TLS session with any of them.
+        ssl_context = None
+        if multiprocessing.get_start_method() == "fork":
+            ssl_context = _make_ssl_context()
+
+        self.processes = []
+        for _ in range(self.workers):
+            process = Process(
+                target=_run_http_server, args=(listen_socket, self._state, ssl_context)
+            )
+            process.start()
+            self.processes.append(process)
+        listen_socket.close()
 
     def get_addr(self):
         """
         Returns a host, port tuple representing the address on which the fake homeserver
         is listening for requests.
         """
-        return ("127.0.0.1", 4490)
+        return (self.host, self.port)
+
+    def get_server_name(self):
+        """
+        Returns the server name of the fake homeserver, as used in its user IDs.
+        """
+        return "%s:%d" % self.get_addr()
+
+    def set_behaviour(self, behaviour):
+        """
+        Change how the endpoints behave, taking effect for requests that
+        arrive from now on. Endpoints left out go back to the default.
+
+        Args:
+            behaviour (dict): As for validate_behaviour.
+
+        Returns:
+            dict: The behaviour, with the defaults filled in.
+
+        Raises:
+            ValueError: If the behaviour isn't valid.
+        """
+        return self._state.set_behaviour(behaviour)
+
+    def get_behaviour(self):
+        return self._state.get_behaviour()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Endpoint name to its counts of 'requests', 'errors'
+                injected, 'in_flight' now and 'peak_in_flight'.
+        """
+        return self._state.get_stats()
+
+    def reset_stats(self):
+        self._state.reset_stats()
+
+    def tearDown(self):
+        for process in self.processes:
+            process.terminate()
+
+
+class FakeHomeserverPool(object):
+    """
+    Several fake homeservers, each on its own port and so with its own server
+    name, for spreading accounts over many homeservers. Pass the list from
+    get_addrs wherever a single homeserver's address is expected.
+    """
+
+    def __init__(self, count, hosts=("127.0.0.1",), workers=1, behaviour=None):
+        """
+        Args:
+            count (int): Number of homeservers.
+            hosts (list[str]): Addresses to listen on, used in turn. On Linux,
+                any address in 127.0.0.0/8 can be used to give the homeservers
+                distinct hosts as well as ports.
+            workers (int): Processes each homeserver serves requests from.
+            behaviour (dict|None): How the endpoints of every homeserver
+                behave, as for validate_behaviour.
+        """
+        self.homeservers = [
+            FakeHomeserver(
+                host=hosts[i % len(hosts)], port=0, workers=workers, behaviour=behaviour
+            )
+            for i in range(count)
+        ]
+
+    def launch(self):
+        for fake_hs in self.homeservers:
+            fake_hs.launch()
+
+    def __len__(self):
+        return len(self.homeservers)
+
+    def __iter__(self):
+        return iter(self.homeservers)
+
+    def get_addrs(self):
+        return [fake_hs.get_addr() for fake_hs in self.homeservers]
+
+    def get_server_names(self):
+        return [fake_hs.get_server_name() for fake_hs in self.homeservers]
+
+    def set_behaviour(self, behaviour):
+        """
+        Change how the endpoints of every homeserver behave.
+        """
+        for fake_hs in self.homeservers:
+            behaviour = fake_hs.set_behaviour(behaviour)
+        return behaviour
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Server name to that homeserver's stats, as from
+                FakeHomeserver.get_stats.
+        """
+        return dict(
+            (fake_hs.get_server_name(), fake_hs.get_stats())
+            for fake_hs in self.homeservers
+        )
 
     def tearDown(self):
-        self.process.terminate()
+        for fake_hs in self.homeservers:
+            fake_hs.tearDown()
+
+
+def benchmark(fake_hs, requests=10000, concurrency=16, keepalive=True):
+    """
+    Measure how many OpenID userinfo requests per second a launched fake
+    homeserver serves.
+
+    Args:
+        fake_hs (FakeHomeserver): The launched fake homeserver.
+        requests (int): Total number of requests to make.
+        concurrency (int): Number of threads to make them from.
+        keepalive (bool): Whether each thread reuses its connection between
+            requests. If not, each request is made on a new connection, which
+            resumes the TLS session of the previous one.
+
+    Returns:
+        (float, int): Requests per second, and how many new connections
+            resumed a TLS session.
+    """
+    host, port = fake_hs.get_addr()
+    path = "/_matrix/federation/v1/openid/userinfo?" + urllib.parse.urlencode(
+        {"access_token": token_for_random_user()}
+    )
+    # Don't verify the fake homeserver's self-signed certificate
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    per_thread = [requests // concurrency] * concurrency
+    per_thread[0] += requests - sum(per_thread)
+
+    def run(count):
+        resumed = 0
+        conn = None
+        tls_session = None
+        for _ in range(count):
+            if conn is None:
+                conn = http_client.HTTPConnection(host, port)
+                conn.sock = context.wrap_socket(
+                    socket.create_connection((host, port)),
+                    session=tls_session,
+                )
+                if conn.sock.session_reused:
+                    resumed += 1
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                raise Exception("Fake homeserver returned %d" % (resp.status,))
+            if not keepalive:
+                tls_session = conn.sock.session
+                conn.close()
+                conn = None
+        return resumed
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as executor:
+        resumed = sum(executor.map(run, per_thread))
+    return requests / (time.monotonic() - start), resumed
 
 
 if __name__ == "__main__":
-    fakehs = FakeHomeserver()
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Run a fake homeserver, optionally benchmarking it"
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--behaviour",
+        type=json.loads,
+        help="JSON describing each endpoint's latency, errors and concurrency limit",
+    )
+    parser.add_argument("--bench", action="store_true", help="Benchmark the server")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--no-keepalive",
+        action="store_true",
+        help="Use a new connection for each benchmark request",
+    )
+    args = parser.parse_args()
+
+    fakehs = FakeHomeserver(
+        port=args.port, workers=args.workers, behaviour=args.behaviour
+    )
     fakehs.launch()
+    if args.bench:
+        try:
+            rate, resumed = benchmark(
+                fakehs, args.requests, args.concurrency, not args.no_keepalive
+            )
+            print(
+                "%d userinfo requests from %d threads to %d workers: %.0f requests/s"
+                % (args.requests, args.concurrency, args.workers, rate)
+            )
+            if args.no_keepalive:
+                print("%d connections resumed a TLS session" % (resumed,))
+        finally:
+            fakehs.tearDown()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keeps snapshots of seeded identity servers on disk, so that a dataset only
+has to be seeded once per launcher, server version and dataset spec.
+
+This needs a launcher that implements the snapshot protocol (see launch_is),
+and whose snapshots can be pickled and restored into a later launch of the
+same server.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+from twisted.python import log
+
+from matrix_is_tester.fakehs import hs_addr_list, server_name_for
+from matrix_is_tester.is_api import IsApi
+
+CACHE_DIR_ENV = "MATRIX_IS_TESTER_CACHE_DIR"
+CACHE_SIZE_ENV = "MATRIX_IS_TESTER_CACHE_SIZE"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+_SUFFIX = ".fixture"
+
+
+def _default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "matrix-is-tester", "fixtures")
+
+
+class FixtureCache(object):
+    """
+    A directory of pickled fixtures, evicting the least recently used once
+    their total size goes over a limit.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        """
+        Args:
+            directory (str|None): Where to keep the fixtures. Defaults to
+                $MATRIX_IS_TESTER_CACHE_DIR, or
+                ~/.cache/matrix-is-tester/fixtures.
+            max_bytes (int|None): Total size to keep the cache under. Defaults
+                to $MATRIX_IS_TESTER_CACHE_SIZE, or 1GiB.
+        """
+        if directory is None:
+            directory = os.environ.get(CACHE_DIR_ENV) or _default_cache_dir()
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_MAX_BYTES))
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Make a cache key from JSON-serialisable parts.
+        """
+        return hashlib.sha256(
+            json.dumps(parts, sort_keys=True).encode("UTF-8")
+        ).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, key):
+        """
+        Get a cached fixture, marking it as recently used.
+
+        Returns:
+            The fixture, or None if it isn't cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                fixture = pickle.load(f)
+        except (
+            OSError,
+            EOFError,
+            pickle.UnpicklingError,
+            # Pickled with classes that have since moved or gone
+            AttributeError,
+            ImportError,
+        ):
+            return None
+
+        # The modification time doubles as the last-used time for eviction
+        os.utime(path, None)
+        return fixture
+
+    def put(self, key, fixture):
+        """
+        Store a fixture, then evict others until the cache fits its limit.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Write then rename, so that readers never see half a fixture
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(fixture, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        Returns:
+            list[tuple[float, int, str]]: (last used, size, key) of each
+                fixture, least recently used first.
+        """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(_SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name[: -len(_SUFFIX)]))
+        entries.sort()
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Delete the least recently used fixtures until the total size is
+        within the limit. The fixture with key `keep` is never deleted.
+
+        Returns:
+            list[str]: The keys evicted.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                continue
+            total -= size
+            evicted.append(key)
+        return evicted
+
+
+def _launcher_name(launcher):
+    cls = type(launcher)
+    return "%s.%s" % (cls.__module__, cls.__qualname__)
+
+
+def seed_with_cache(
+    launcher, mail_sink, hs_addr, size, prefix="seed", cache=None, **seeder_kwargs
+):
+    """
+    Make sure the launched IS has `size` bindings from Seeder, restoring it
+    from a cached snapshot if there is one for this launcher, server version
+    and dataset, and otherwise seeding it and caching a snapshot.
+
+    Args:
+        launcher: A launcher for a running IS that supports snapshots.
+        mail_sink (MailSink): The mail sink the IS sends its mail to.
+        hs_addr (tuple|list[tuple]): Host, port of the fake homeserver, or a
+            list of them to spread the accounts over.
+        size (int): Number of bindings.
+        prefix (str): Prefix of the addresses bound.
+        cache (FixtureCache|None): The cache to use, or None for the default
+            one.
+        **seeder_kwargs: Passed on to Seeder.
+
+    Returns:
+        dict: A seeding report as from Seeder.run, with 'cached' set to
+            whether the dataset was restored from the cache. A restored
+            dataset's user IDs keep the server names they were seeded with,
+            which may differ from this run's if the fake homeservers listen
+            on ephemeral ports: its 'server_names' maps them to this run's.
+    """
+    if cache is None:
+        cache = FixtureCache()
+    base_url = launcher.get_base_url()
+
+    try:
+        versions = IsApi(base_url, "v2", mail_sink).get_versions()
+    except ValueError:
+        # Not all identity servers serve /versions
+        versions = None
+
+    # Not the server names themselves, which include the fake homeservers'
+    # ports and so may change from run to run
+    server_names = [server_name_for(addr) for addr in hs_addr_list(hs_addr)]
+    spec = {
+        "size": size,
+        "prefix": prefix,
+        "accounts": seeder_kwargs.get("accounts", 10),
+        "servers": len(server_names),
+    }
+    key = cache.make_key(_launcher_name(launcher), versions, spec)
+
+    start = time.monotonic()
+    fixture = cache.get(key)
+    if fixture is not None:
+        launcher.restore(fixture["snapshot"])
+        duration = time.monotonic() - start
+        log.msg("Restored %d bindings from fixture %s in %.2fs" % (size, key, duration))
+        return {
+            "count": size,
+            "skipped": size,
+            "bound": 0,
+            "failed": 0,
+            "duration": duration,
+            "rate": None,
+            "errors": {},
+            "endpoints": {},
+            "waits": {},
+            "bindings": fixture["bindings"],
+            "server_names": dict(zip(fixture["server_names"], server_names)),
+            "cached": True,
+        }
+
+    # Imported here, as seeding needs aiohttp but the cache itself doesn't
+    from matrix_is_tester.seed import Seeder
+
+    seeder = Seeder(base_url, mail_sink, hs_addr, prefix=prefix, **seeder_kwargs)
+    report = asyncio.run(seeder.run(size))
+    if not report["failed"]:
+        cache.put(
+            key,
+            {
+                "launcher": _launcher_name(launcher),
+                "versions": versions,
+                "spec": spec,
+                "created": time.time(),
+                "snapshot": launcher.snapshot(),
+                "bindings": report["bindings"],
+                "server_names": server_names,
+            },
+        )
+    report["server_names"] = dict((name, name) for name in server_names)
+    report["cached"] = False
+    return report
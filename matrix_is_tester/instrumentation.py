@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Records the wall time, time to first byte, status code and request and
+response sizes of every call the API wrappers make, per endpoint.
+
+Set MATRIX_IS_TESTER_METRICS to a file name to have the shared instrumentation
+written out when the test run exits: as Prometheus text if the name ends in
+.prom, or as JSON lines otherwise.
+"""
+
+import atexit
+import json
+import math
+import os
+import threading
+import time
+
+from matrix_is_tester.workers import get_worker_id
+
+METRICS_ENV = "MATRIX_IS_TESTER_METRICS"
+
+# Values are kept to within 1 part in 2 ** (_SUB_BUCKET_BITS - 1)
+_SUB_BUCKET_BITS = 11
+
+_shared_instrumentation = None
+_shared_instrumentation_lock = threading.Lock()
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class Histogram(object):
+    """
+    A sparse log-linear histogram in the style of HdrHistogram: values are
+    recorded in microseconds, exactly below 2048us and otherwise to about
+    three significant figures, so recording is O(1) and memory stays small
+    however many values are recorded.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def _bucket(value):
+        shift = value.bit_length() - _SUB_BUCKET_BITS
+        if shift <= 0:
+            return value
+        return (value >> shift) << shift
+
+    def record(self, seconds):
+        """
+        Record a duration, in seconds.
+        """
+        value = max(int(seconds * 1000000), 0)
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Add the values recorded by another histogram to this one.
+        """
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, pct):
+        """
+        The value, in seconds, that pct percent of recorded values are at or
+        below, or None if nothing has been recorded.
+        """
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(pct / 100.0 * self.count)), 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                # Report the highest value that falls in the bucket, as
+                # HdrHistogram does
+                shift = max(bucket.bit_length() - _SUB_BUCKET_BITS, 0)
+                highest = bucket + (1 << shift) - 1
+                return min(highest, self.max) / 1000000.0
+        return self.max / 1000000.0
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / float(self.count) / 1000000.0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "min": None if self.min is None else self.min / 1000000.0,
+            "max": None if self.max is None else self.max / 1000000.0,
+            "mean": self.mean(),
+            "sum": self.total / 1000000.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+        }
+
+
+class EndpointStats(object):
+    """
+    Everything recorded against one endpoint.
+    """
+
+    def __init__(self):
+        self.wall_time = Histogram()
+        self.ttfb = Histogram()
+        self.statuses = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def to_dict(self):
+        return {
+            "wall_time": self.wall_time.to_dict(),
+            "ttfb": self.ttfb.to_dict(),
+            "statuses": dict(
+                (str(status), count) for status, count in self.statuses.items()
+            ),
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+        }
+
+
+class Instrumentation(object):
+    """
+    Collects per-endpoint statistics about API calls. Safe to share between
+    threads.
+
+    Hooks can be added to see each call as it is recorded: they are called
+    with the same arguments as `record`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, endpoint, status, wall_time, ttfb, request_bytes, response_bytes):
+        """
+        Record one API call.
+
+        Args:
+            endpoint (str): The method and path of the call, eg.
+                'POST /_matrix/identity/v2/lookup'.
+            status (int|str): HTTP status code, or the name of the exception
+                raised if there was no response.
+            wall_time (float): Seconds from sending the request to having read
+                the whole response.
+            ttfb (float|None): Seconds from sending the request to receiving
+                the response headers.
+            request_bytes (int): Size of the request body.
+            response_bytes (int): Size of the response body.
+        """
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.wall_time.record(wall_time)
+            if ttfb is not None:
+                stats.ttfb.record(ttfb)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+
+        for hook in self.hooks:
+            hook(endpoint, status, wall_time, ttfb, request_bytes, response_bytes)
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+
+    def to_dict(self):
+        with self._lock:
+            return dict(
+                (endpoint, stats.to_dict())
+                for endpoint, stats in sorted(self.endpoints.items())
+            )
+
+    def write_jsonl(self, f):
+        """
+        Write one JSON object per endpoint to a file object.
+        """
+        timestamp = time.time()
+        worker = get_worker_id()
+        for endpoint, stats in self.to_dict().items():
+            stats["endpoint"] = endpoint
+            stats["timestamp"] = timestamp
+            stats["worker"] = worker
+            f.write(json.dumps(stats, sort_keys=True) + "\n")
+
+    def write_prometheus(self, f):
+        """
+        Write the statistics in the Prometheus text exposition format to a
+        file object.
+        """
+        lines = []
+        stats = self.to_dict()
+
+        for name, key, help_text in (
+            (
+                "matrix_is_tester_request_duration_seconds",
+                "wall_time",
+                "Time from sending a request to reading the whole response",
+            ),
+            (
+                "matrix_is_tester_request_ttfb_seconds",
+                "ttfb",
+                "Time from sending a request to receiving the response headers",
+            ),
+        ):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s summary" % (name,))
+            for endpoint, endpoint_stats in stats.items():
+                histogram = endpoint_stats[key]
+                labels = 'endpoint="%s"' % (_escape_label(endpoint),)
+                for quantile, field in (
+                    ("0.5", "p50"),
+                    ("0.9", "p90"),
+                    ("0.99", "p99"),
+                ):
+                    if histogram[field] is not None:
+                        lines.append(
+                            '%s{%s,quantile="%s"} %r'
+                            % (name, labels, quantile, histogram[field])
+                        )
+                lines.append("%s_sum{%s} %r" % (name, labels, histogram["sum"]))
+                lines.append("%s_count{%s} %d" % (name, labels, histogram["count"]))
+
+        name = "matrix_is_tester_requests_total"
+        lines.append("# HELP %s Requests sent, by response status" % (name,))
+        lines.append("# TYPE %s counter" % (name,))
+        for endpoint, endpoint_stats in stats.items():
+            for status, count in sorted(endpoint_stats["statuses"].items()):
+                lines.append(
+                    '%s{endpoint="%s",status="%s"} %d'
+                    % (name, _escape_label(endpoint), _escape_label(status), count)
+                )
+
+        for name, key, help_text in (
+            (
+                "matrix_is_tester_request_bytes_total",
+                "request_bytes",
+                "Bytes of request bodies sent",
+            ),
+            (
+                "matrix_is_tester_response_bytes_total",
+                "response_bytes",
+                "Bytes of response bodies received",
+            ),
+        ):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s counter" % (name,))
+            for endpoint, endpoint_stats in stats.items():
+                lines.append(
+                    '%s{endpoint="%s"} %d'
+                    % (name, _escape_label(endpoint), endpoint_stats[key])
+                )
+
+        f.write("\n".join(lines) + "\n")
+
+    def export(self, path):
+        """
+        Write the statistics to a file: Prometheus text if its name ends in
+        .prom, otherwise JSON lines.
+        """
+        with open(path, "w") as f:
+            if path.endswith(".prom"):
+                self.write_prometheus(f)
+            else:
+                self.write_jsonl(f)
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _export_path(path):
+    # Parallel workers each write their own file
+    worker_id = get_worker_id()
+    if worker_id is None:
+        return path
+    base, ext = os.path.splitext(path)
+    return "%s.%s%s" % (base, worker_id, ext)
+
+
+def get_instrumentation():
+    """
+    Get the Instrumentation shared by every API wrapper that isn't given its
+    own, making it if necessary. If MATRIX_IS_TESTER_METRICS is set, it is
+    exported to that file when the process exits.
+    """
+    global _shared_instrumentation
+
+    with _shared_instrumentation_lock:
+        if _shared_instrumentation is None:
+            _shared_instrumentation = Instrumentation()
+            path = os.environ.get(METRICS_ENV)
+            if path:
+                atexit.register(_shared_instrumentation.export, _export_path(path))
+        return _shared_instrumentation
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fires a burst of /store-invite requests at an identity server, as when a large
+room invites many people by email at once, and follows each invite through to
+its mail arriving at the mail sink.
+"""
+
+import asyncio
+import time
+import uuid
+from queue import Empty
+
+from matrix_is_tester.async_is_api import AsyncIsApi, close_shared_client_sessions
+from matrix_is_tester.fakehs import hs_addr_list, server_name_for, token_for_user
+from matrix_is_tester.key_validity import get_key_validity_cache
+from matrix_is_tester.load import LoadStats
+
+MAIL_LATENCY = "invite to mail"
+
+
+class InviteStorm(object):
+    """
+    Stores invites to `addresses` email addresses from `senders` accounts into
+    `rooms` rooms, all at once.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        mail_sink,
+        hs_addr,
+        addresses=None,
+        rooms=10,
+        senders=10,
+        concurrency=100,
+        mail_timeout=30,
+        key_cache=None,
+    ):
+        """
+        Args:
+            base_url (str): The base URL of the IS to invite through.
+            mail_sink (MailSink): The mail sink the IS sends its mail to.
+            hs_addr (tuple|list[tuple]): Host, port of the fake homeserver, or
+                a list of them to spread the senders over.
+            addresses (int|None): Number of distinct addresses to invite. If
+                fewer than the invites, some addresses get several invites.
+                Defaults to one address per invite.
+            rooms (int): Number of rooms to invite to.
+            senders (int): Number of accounts to send the invites from.
+            concurrency (int): Most /store-invite requests in flight at once.
+            mail_timeout (float): Seconds to wait for each invite's mail once
+                the invite has been stored.
+            key_cache (KeyValidityCache|None): The cache to check the public
+                keys returned with the invites through. Defaults to the shared
+                one (see key_validity.get_key_validity_cache).
+        """
+        self.base_url = base_url
+        self.mail_sink = mail_sink
+        self.hs_addrs = hs_addr_list(hs_addr)
+        self.addresses = addresses
+        self.rooms = rooms
+        self.senders = senders
+        self.concurrency = concurrency
+        self.mail_timeout = mail_timeout
+        if key_cache is None:
+            key_cache = get_key_validity_cache()
+        self.key_cache = key_cache
+        self.run_id = uuid.uuid4().hex[:8]
+
+        self.stats = LoadStats()
+        self.failed = 0
+        self.invalid_keys = 0
+        self.missing = 0
+        # (address, token, time sent) of each invite stored
+        self.stored = []
+        # (address, mail) of each mail received
+        self.mails = []
+
+    def address(self, index):
+        return "storm-%s-%d@invite.test" % (self.run_id, index)
+
+    async def _make_senders(self):
+        senders = []
+        for i in range(self.senders):
+            hs_addr = self.hs_addrs[i % len(self.hs_addrs)]
+            mxid = "@storm-%s-%d:%s" % (self.run_id, i, server_name_for(hs_addr))
+            api = AsyncIsApi(self.base_url, "v2", self.mail_sink)
+            await api.make_account(hs_addr, token_for_user(mxid))
+            senders.append((api, mxid))
+        return senders
+
+    async def _invite(self, index, address, sender, slots):
+        api, mxid = sender
+        room_id = "!storm-%s-%d:%s" % (
+            self.run_id,
+            index % self.rooms,
+            mxid.split(":", 1)[1],
+        )
+
+        async with slots:
+            sent = time.time()
+            try:
+                body = await self.stats.call(
+                    "/store-invite",
+                    api.store_invite(
+                        {
+                            "medium": "email",
+                            "address": address,
+                            "room_id": room_id,
+                            "sender": mxid,
+                            "room_name": "Invite storm %d" % (index % self.rooms,),
+                            "sender_display_name": "Storm sender",
+                        }
+                    ),
+                )
+            except Exception:
+                self.failed += 1
+                return
+            if "token" not in body:
+                self.failed += 1
+                return
+            self.stored.append((address, body["token"], sent))
+
+            for key in body.get("public_keys", []):
+                try:
+                    valid = await self.key_cache.async_is_valid(
+                        api, key["key_validity_url"], key["public_key"]
+                    )
+                except Exception:
+                    valid = False
+                if not valid:
+                    self.invalid_keys += 1
+
+        # Wait outside the slot, so that slow mail doesn't hold up invites
+        try:
+            mail = await self.mail_sink.async_wait_for_mail(
+                to=address, timeout=self.mail_timeout
+            )
+        except Empty:
+            self.missing += 1
+            return
+        self.mails.append((address, mail))
+
+    def _match_mails(self):
+        """
+        Match each mail to the invite whose token it contains, recording the
+        time from sending the invite to the mail arriving.
+
+        Returns:
+            int: The number of mails that matched no invite.
+        """
+        pending = {}
+        for address, token, sent in self.stored:
+            pending.setdefault(address, {})[token] = sent
+
+        unmatched = 0
+        for address, mail in self.mails:
+            sent = pending.get(address, {}).pop(mail["token"], None)
+            if sent is None:
+                unmatched += 1
+            else:
+                self.stats.record(MAIL_LATENCY, mail["received"] - sent, wait=True)
+        return unmatched
+
+    async def run(self, invites):
+        """
+        Store `invites` invites as fast as the concurrency allows, then wait
+        for their mail.
+
+        Returns:
+            dict: A report of the storm: how many invites were stored, failed
+                and had their mail delivered, the key validity cache's stats
+                as from KeyValidityCache.stats, and latencies per endpoint as
+                for LoadStats.report. The time from sending each invite to its
+                mail arriving is under "waits", apart from the endpoints.
+        """
+        addresses = self.addresses or invites
+        try:
+            senders = await self._make_senders()
+            self.key_cache.reset_stats()
+            slots = asyncio.Semaphore(self.concurrency)
+
+            self.stats.start = time.monotonic()
+            await asyncio.gather(
+                *[
+                    self._invite(
+                        i,
+                        self.address(i % addresses),
+                        senders[i % len(senders)],
+                        slots,
+                    )
+                    for i in range(invites)
+                ]
+            )
+            self.stats.end = time.monotonic()
+        finally:
+            await close_shared_client_sessions()
+
+        unmatched = self._match_mails()
+        report = self.stats.report()
+        return {
+            "invites": invites,
+            "addresses": addresses,
+            "stored": len(self.stored),
+            "failed": self.failed,
+            "delivered": len(self.mails) - unmatched,
+            "missing": self.missing,
+            "unmatched": unmatched,
+            "invalid_keys": self.invalid_keys,
+            "key_checks": self.key_cache.stats(),
+            "duration": report["duration"],
+            "errors": report["errors"],
+            "endpoints": report["endpoints"],
+            "waits": report["waits"],
+        }
+
+
+def problems(report):
+    """
+    Returns:
+        list[str]: What went wrong in an invite storm, if anything.
+    """
+    found = []
+    if report["failed"]:
+        found.append("%d invites failed to store" % (report["failed"],))
+    if report["missing"]:
+        found.append("%d invite mails never arrived" % (report["missing"],))
+    if report["unmatched"]:
+        found.append("%d mails matched no invite" % (report["unmatched"],))
+    if report["invalid_keys"]:
+        found.append("%d public keys were not valid" % (report["invalid_keys"],))
+    return found
+
+
+def format_report(report):
+    lines = [
+        "stored %d of %d invites to %d addresses in %.1fs, %d failed"
+        % (
+            report["stored"],
+            report["invites"],
+            report["addresses"],
+            report["duration"],
+            report["failed"],
+        ),
+        "%d mails delivered, %d missing, %d unmatched"
+        % (report["delivered"], report["missing"], report["unmatched"]),
+        "%d key validity requests, %d answered from the cache, %d keys invalid"
+        % (
+            report["key_checks"]["requests"],
+            report["key_checks"]["hits"] + report["key_checks"]["coalesced"],
+            report["invalid_keys"],
+        ),
+        "key validity requests: p50 %.1fms, p99 %.1fms"
+        % (
+            (report["key_checks"]["latency"]["p50"] or 0) * 1000,
+            (report["key_checks"]["latency"]["p99"] or 0) * 1000,
+        ),
+    ]
+    for heading, rows in (
+        ("endpoint", report["endpoints"]),
+        ("wait", report.get("waits", {})),
+    ):
+        if not rows:
+            continue
+        lines.append("")
+        lines.append(
+            "%-40s %8s %9s %9s %9s" % (heading, "count", "p50 ms", "p95 ms", "p99 ms")
+        )
+        for name, stats in rows.items():
+            lines.append(
+                "%-40s %8d %9.1f %9.1f %9.1f"
+                % (
+                    name,
+                    stats["requests"],
+                    stats["p50"] * 1000,
+                    stats["p95"] * 1000,
+                    stats["p99"] * 1000,
+                )
+            )
+    if report["errors"]:
+        lines.append("")
+        lines.append("errors:")
+        for errcode, count in sorted(report["errors"].items()):
+            lines.append("  %-38s %d" % (errcode, count))
+    return "\n".join(lines)
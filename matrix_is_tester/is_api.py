@@ -16,15 +16,164 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import binascii
+import hashlib
+import itertools
+import multiprocessing
 import random
-import re
 import string
-
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 from twisted.python import log
 
-from matrix_is_tester.fakehs import token_for_random_user
+from matrix_is_tester.fakehs import hs_addr_list, server_name_for, token_for_random_user
+from matrix_is_tester.instrumentation import Histogram, get_instrumentation
+from matrix_is_tester.json_stream import parse_lookup_response
+from matrix_is_tester.session_pool import DEFAULT_POOL_SIZE, get_shared_session
+
+_URLSAFE_B64 = bytes.maketrans(b"+/", b"-_")
+
+# Bytes to read at a time when parsing a response as it arrives
+_STREAM_CHUNK_SIZE = 65536
+
+
+def token_from_mail(mail):
+    """
+    Get the validation token from a mail received by the mail sink.
+
+    Raises:
+        Exception: If the mail has no token.
+    """
+    log.msg("Got email: %r" % (mail,))
+    token = mail.get("token")
+    if not token:
+        raise Exception(
+            "No validation token in mail to %s (subject %r)"
+            % (", ".join(mail.get("rctpto", [])), mail.get("subject"))
+        )
+    return token
+
+
+def lookup_hash(address, medium, pepper):
+    """
+    Hash a 3PID for the v2 /lookup API's sha256 algorithm.
+
+    Args:
+        address (str): The 3PID address, eg. an email address
+        medium (str): The 3PID medium, eg. 'email'
+        pepper (str): The lookup pepper from /hash_details
+
+    Returns:
+        str: The unpadded URL-safe base64 sha256 hash of
+            "<address> <medium> <pepper>".
+    """
+    return _hash_chunk(([(medium, address)], pepper))
+
+
+def _hash_chunk(chunk_and_pepper):
+    threepids, pepper = chunk_and_pepper
+    sha256 = hashlib.sha256
+    b2a_base64 = binascii.b2a_base64
+
+    # A 32 byte digest is 43 base64 characters plus one of padding. Encode
+    # each digest, then make the whole chunk URL-safe in one go rather than
+    # translating every hash separately.
+    encoded = b"\n".join(
+        [
+            b2a_base64(
+                sha256(
+                    ("%s %s %s" % (address, medium, pepper)).encode("UTF-8")
+                ).digest(),
+                newline=False,
+            )[:43]
+            for medium, address in threepids
+        ]
+    )
+    # Hand back one string rather than a list, which is much cheaper to send
+    # back from a worker process.
+    return encoded.translate(_URLSAFE_B64).decode("ascii")
+
+
+def lookup_hashes(threepids, pepper, chunk_size=10000, processes=None):
+    """
+    Hash many 3PIDs for the v2 /lookup API's sha256 algorithm.
+
+    Args:
+        threepids (iterable[tuple[str, str]]): (medium, address) pairs, in
+            the same order as the 3PIDs of the /bulk_lookup API.
+        pepper (str): The lookup pepper from /hash_details
+        chunk_size (int): How many 3PIDs to hash at once, and to hand to each
+            worker process.
+        processes (int|None): If given, spread the chunks over a pool of this
+            many processes. Only worthwhile for hundreds of thousands of
+            3PIDs.
+
+    Returns:
+        list[str]: The lookup hashes, in the same order as the 3PIDs.
+    """
+    threepids = iter(threepids)
+
+    def chunks():
+        while True:
+            chunk = list(itertools.islice(threepids, chunk_size))
+            if not chunk:
+                return
+            yield chunk, pepper
+
+    hashes = []
+    if processes:
+        with multiprocessing.Pool(processes) as pool:
+            for chunk_hashes in pool.imap(_hash_chunk, chunks()):
+                hashes.extend(chunk_hashes.split("\n"))
+    else:
+        for chunk in chunks():
+            hashes.extend(_hash_chunk(chunk).split("\n"))
+    return hashes
+
+
+class _CountingChunks(object):
+    """
+    Passes chunks of a response body through, counting their bytes.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.count = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self.count += len(chunk)
+            yield chunk
+
+
+def _merge_lookups(bodies):
+    """
+    Merge the responses to the chunks of a lookup into one, as if it had been
+    sent as a single request.
+
+    Returns:
+        dict: The merged response, or the first error response if any chunk
+            failed.
+    """
+    merged = {}
+    for body in bodies:
+        if "errcode" in body:
+            return body
+        for key, value in body.items():
+            if key not in merged:
+                merged[key] = value
+            elif isinstance(value, dict):
+                merged[key].update(value)
+            elif isinstance(value, list):
+                merged[key].extend(value)
+    return merged
+
+
+def random_client_secret():
+    return "".join([random.choice(string.digits) for _ in range(16)])
 
 
 class IsApi(object):
@@ -32,7 +181,18 @@ class IsApi(object):
     Wrappers around the IS REST API
     """
 
-    def __init__(self, base_url, version, mail_sink):
+    def __init__(
+        self,
+        base_url,
+        version,
+        mail_sink,
+        session=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        max_retries=0,
+        instrumentation=None,
+        lookup_chunk_size=None,
+        lookup_concurrency=None,
+    ):
         """
         Args:
             base_url (str): The base URL of the IS API to use
@@ -41,8 +201,32 @@ class IsApi(object):
                 to use the right one.
             mail_sink (MailSink): Mail sink object to use for getting email
                 authentication tokens.
+            session (requests.Session|None): Session to send requests with. If
+                None, a keep-alive session is shared with every other IsApi
+                using the same base URL and pool settings.
+            pool_size (int): Maximum number of connections to keep open to each
+                host when using the shared session.
+            max_retries (int): How many times the shared session retries
+                requests that failed to connect.
+            instrumentation (Instrumentation|None): Where to record the timing,
+                status and size of each call. If None, the shared
+                instrumentation is used.
+            lookup_chunk_size (int|None): Split lookups of more than this many
+                3PIDs into several requests. If None, lookups are never split.
+            lookup_concurrency (int|None): How many chunks of a split lookup
+                to send at once. Defaults to pool_size.
         """
         self.headers = None
+        # The AccountPool account in use, if any
+        self.leased_account = None
+
+        if instrumentation is None:
+            instrumentation = get_instrumentation()
+        self.instrumentation = instrumentation
+
+        if session is None:
+            session = get_shared_session(base_url, pool_size, max_retries)
+        self.session = session
 
         self.version = version
         self.base_url = base_url
@@ -55,41 +239,163 @@ class IsApi(object):
 
         self.mail_sink = mail_sink
 
+        self.lookup_chunk_size = lookup_chunk_size
+        if lookup_concurrency is None:
+            lookup_concurrency = pool_size
+        self.lookup_concurrency = lookup_concurrency
+        self._chunk_latency_lock = threading.Lock()
+        self.reset_lookup_chunk_stats()
+
+    @property
+    def connection_stats(self):
+        """
+        The ConnectionStats of this API's session, or None if the session was
+        not made by session_pool.
+        """
+        return getattr(self.session, "connection_stats", None)
+
+    def reset_lookup_chunk_stats(self):
+        with self._chunk_latency_lock:
+            # Number of 3PIDs to the latency of lookups of that many
+            self._chunk_latency = {}
+
+    def lookup_chunk_stats(self):
+        """
+        The latency of each lookup request this API has sent, by the number of
+        3PIDs in it, for finding the batch size a server handles best. A
+        lookup that was split counts once for each chunk.
+
+        Returns:
+            dict[int, dict]: Chunk size to latency histogram summary.
+        """
+        with self._chunk_latency_lock:
+            return dict(
+                (size, histogram.to_dict())
+                for size, histogram in sorted(self._chunk_latency.items())
+            )
+
+    def _lookup(self, path, key, items, params, stream, chunk_size, concurrency):
+        """
+        Send a lookup, split into chunks of `chunk_size` 3PIDs sent
+        concurrently if there are more than that, and merge the responses.
+
+        Args:
+            path (str): The lookup endpoint, relative to the API root.
+            key (str): The key in the request body to put the 3PIDs under.
+            items (list): The 3PIDs to look up.
+            params (dict): The rest of the request body.
+        """
+        if chunk_size is None:
+            chunk_size = self.lookup_chunk_size
+        if concurrency is None:
+            concurrency = self.lookup_concurrency
+
+        def send(chunk):
+            content = dict(params)
+            content[key] = chunk
+            start = time.monotonic()
+            body = self._request(
+                "POST",
+                self.apiRoot + path,
+                json=content,
+                headers=self.headers,
+                parse=parse_lookup_response if stream else None,
+            )
+            latency = time.monotonic() - start
+            with self._chunk_latency_lock:
+                histogram = self._chunk_latency.get(len(chunk))
+                if histogram is None:
+                    histogram = self._chunk_latency[len(chunk)] = Histogram()
+                histogram.record(latency)
+            return body
+
+        if not chunk_size or len(items) <= chunk_size:
+            return send(items)
+
+        chunks = []
+        for start in range(0, len(items), chunk_size):
+            end = start + chunk_size
+            chunks.append(items[start:end])
+        with ThreadPoolExecutor(max(min(concurrency, len(chunks)), 1)) as pool:
+            return _merge_lookups(pool.map(send, chunks))
+
+    def _request(self, method, url, raw=False, parse=None, **kwargs):
+        """
+        Send a request, recording it with the instrumentation.
+
+        Args:
+            raw (bool): Return the body as bytes rather than parsing it as
+                JSON.
+            parse (callable|None): Parse the body with this as it is
+                downloaded, rather than reading it all first. It is passed an
+                iterable of byte chunks.
+        """
+        endpoint = "%s %s" % (method, urlsplit(url).path)
+        start = time.monotonic()
+        try:
+            resp = self.session.request(method, url, stream=parse is not None, **kwargs)
+            if parse is None:
+                content = resp.content
+                response_bytes = len(content)
+            else:
+                chunks = _CountingChunks(resp.iter_content(_STREAM_CHUNK_SIZE))
+                with resp:
+                    body = parse(chunks)
+                response_bytes = chunks.count
+        except Exception as e:
+            self.instrumentation.record(
+                endpoint, type(e).__name__, time.monotonic() - start, None, 0, 0
+            )
+            raise
+
+        self.instrumentation.record(
+            endpoint,
+            resp.status_code,
+            time.monotonic() - start,
+            resp.elapsed.total_seconds(),
+            len(resp.request.body or b""),
+            response_bytes,
+        )
+        if parse is not None:
+            return body
+        if raw:
+            return content
+        return resp.json()
+
     # Uses the /register API to create an account. This account will
     # be used for all subsequent API calls that requrie auth.
+    # Given a list of homeserver addresses, the account is made on one of
+    # them at random.
     def make_account(self, hs_addr, openid_token=None):
         if self.version != "v2":
             raise Exception("Only v2 supports authentication")
 
+        server_name = server_name_for(random.choice(hs_addr_list(hs_addr)))
         if openid_token is None:
-            openid_token = token_for_random_user()
+            openid_token = token_for_random_user(server_name)
 
-        body = self.register(":".join([str(x) for x in hs_addr]), openid_token)
+        body = self.register(server_name, openid_token)
         self.headers = {"Authorization": "Bearer %s" % (body["token"],)}
+        self.leased_account = None
 
-    def get_token_from_mail(self):
-        mail = self.mail_sink.get_mail()
-
-        log.msg("Got email: %r" % (mail,))
-        if "data" not in mail:
-            raise Exception("Mail has no 'data'")
-
-        data = mail["data"]
-        if isinstance(data, bytes):
-            data = data.decode("UTF-8")
-
-        matches = re.match(r"<<<(.*)>>>", data)
-        if not matches.group(1):
-            raise Exception("Failed to match token from mail")
-
-        return matches.group(1)
+    def get_token_from_mail(self, address=None, timeout=None, deadline=None):
+        """
+        Get the token from the next mail sent to the given address, or the
+        next mail of any kind if no address is given. The timeout and
+        deadline are as for MailSink.wait_for_mail.
+        """
+        return token_from_mail(
+            self.mail_sink.wait_for_mail(to=address, timeout=timeout, deadline=deadline)
+        )
 
     def ping(self):
-        resp = requests.get(self.apiRoot)
-        return resp.json()
+        return self._request("GET", self.apiRoot)
 
     def request_email_code(self, address, client_secret, send_attempt):
-        resp = requests.post(
+        if self.mail_sink is not None:
+            self.mail_sink.mail_requested(address)
+        return self._request(
+            "POST",
             self.apiRoot + "/validate/email/requestToken",
             json={
                 "client_secret": client_secret,
@@ -98,121 +404,152 @@ class IsApi(object):
             },
             headers=self.headers,
         )
-        return resp.json()
+
+    def submit_email_token(self, sid, client_secret, token):
+        return self._request(
+            "POST",
+            self.apiRoot + "/validate/email/submitToken",
+            json={"client_secret": client_secret, "sid": sid, "token": token},
+            headers=self.headers,
+        )
 
     def submit_email_token_via_get(self, sid, client_secret, token):
-        resp = requests.get(
+        return self._request(
+            "GET",
             self.apiRoot + "/validate/email/submitToken",
             params={"client_secret": client_secret, "sid": sid, "token": token},
             headers=self.headers,
+            raw=True,
         )
-        return resp.content
 
     def request_and_submit_email_code(self, address):
-        client_secret = "".join([random.choice(string.digits) for _ in range(16)])
+        client_secret = random_client_secret()
         req_response = self.request_email_code(address, client_secret, 1)
 
-        token = self.get_token_from_mail()
+        token = self.get_token_from_mail(address)
 
         sid = req_response["sid"]
-        resp = requests.post(
-            self.apiRoot + "/validate/email/submitToken",
-            json={"client_secret": client_secret, "sid": sid, "token": token},
-            headers=self.headers,
-        )
-        body = resp.json()
+        body = self.submit_email_token(sid, client_secret, token)
         log.msg("submitToken returned %r" % (body,))
         if not body["success"]:
             raise Exception("Submit token failed")
         return {"sid": sid, "client_secret": client_secret}
 
     def bind_email(self, sid, client_secret, mxid):
-        resp = requests.post(
+        return self._request(
+            "POST",
             self.apiRoot + "/3pid/bind",
             json={"client_secret": client_secret, "sid": sid, "mxid": mxid},
             headers=self.headers,
         )
-        return resp.json()
 
     def lookupv1(self, medium, address):
-        resp = requests.get(
+        return self._request(
+            "GET",
             self.apiRoot + "/lookup",
             params={"medium": medium, "address": address},
             headers=self.headers,
         )
-        return resp.json()
 
-    def bulk_lookup(self, threepids):
-        resp = requests.post(
-            self.apiRoot + "/bulk_lookup",
-            json={"threepids": threepids},
-            headers=self.headers,
+    def bulk_lookup(self, threepids, stream=False, chunk_size=None, concurrency=None):
+        """
+        Args:
+            threepids (list[tuple[str, str]]): (medium, address) of each 3PID.
+            stream (bool): Parse the response as it arrives, returning
+                'threepids' as a dict of (medium, address) to mxid rather
+                than a list. See json_stream.parse_lookup_response.
+            chunk_size (int|None): Overrides lookup_chunk_size.
+            concurrency (int|None): Overrides lookup_concurrency.
+        """
+        return self._lookup(
+            "/bulk_lookup", "threepids", threepids, {}, stream, chunk_size, concurrency
         )
-        return resp.json()
 
     def get_validated_threepid(self, sid, client_secret):
-        resp = requests.get(
+        return self._request(
+            "GET",
             self.apiRoot + "/3pid/getValidated3pid",
             params={"sid": sid, "client_secret": client_secret},
             headers=self.headers,
         )
-        return resp.json()
 
     def store_invite(self, params):
-        resp = requests.post(
-            self.apiRoot + "/store-invite", json=params, headers=self.headers
+        return self._request(
+            "POST", self.apiRoot + "/store-invite", json=params, headers=self.headers
         )
-        return resp.json()
 
     def pubkey_is_valid(self, url, pubkey):
-        resp = requests.get(url, params={"public_key": pubkey})
-        return resp.json()
+        return self._request("GET", url, params={"public_key": pubkey})
 
     def get_terms(self):
-        resp = requests.get(self.apiRoot + "/terms")
-        return resp.json()
+        return self._request("GET", self.apiRoot + "/terms")
 
     def agree_to_terms(self, user_accepts):
-        resp = requests.post(
+        return self._request(
+            "POST",
             self.apiRoot + "/terms",
             json={"user_accepts": user_accepts},
             headers=self.headers,
         )
-        return resp.json()
 
     def get_versions(self):
-        resp = requests.get(self.base_url + "/versions")
-        return resp.json()
+        return self._request("GET", self.base_url + "/versions")
 
     def register(self, matrix_server_name, access_token):
-        resp = requests.post(
+        return self._request(
+            "POST",
             self.apiRoot + "/account/register",
             json={
                 "matrix_server_name": matrix_server_name,
                 "access_token": access_token,
             },
         )
-        return resp.json()
 
     def account(self):
-        resp = requests.get(self.apiRoot + "/account", headers=self.headers)
-        return resp.json()
+        return self._request("GET", self.apiRoot + "/account", headers=self.headers)
+
+    def use_account(self, account):
+        """
+        Authenticate as an account leased from an AccountPool.
+        """
+        self.headers = account.headers
+        self.leased_account = account
 
     def logout(self):
-        resp = requests.post(self.apiRoot + "/account/logout", headers=self.headers)
-        return resp.json()
+        body = self._request(
+            "POST", self.apiRoot + "/account/logout", headers=self.headers
+        )
+        if self.leased_account is not None and "errcode" not in body:
+            self.leased_account.logged_out = True
+        return body
 
     def hash_details(self):
-        resp = requests.get(self.apiRoot + "/hash_details", headers=self.headers)
-        return resp.json()
+        return self._request(
+            "GET", self.apiRoot + "/hash_details", headers=self.headers
+        )
 
-    def hashed_lookup(self, addresses, alg, pepper):
-        resp = requests.post(
-            self.apiRoot + "/lookup",
-            json={"addresses": addresses, "algorithm": alg, "pepper": pepper},
-            headers=self.headers,
+    def hashed_lookup(
+        self, addresses, alg, pepper, stream=False, chunk_size=None, concurrency=None
+    ):
+        """
+        Args:
+            addresses (list[str]): The lookups, hashed or not.
+            alg (str): The hashing algorithm used.
+            pepper (str): The pepper from /hash_details.
+            stream (bool): Parse the response as it arrives, to keep memory
+                down for very large lookups. The result is the same.
+            chunk_size (int|None): Overrides lookup_chunk_size.
+            concurrency (int|None): Overrides lookup_concurrency.
+        """
+        return self._lookup(
+            "/lookup",
+            "addresses",
+            addresses,
+            {"algorithm": alg, "pepper": pepper},
+            stream,
+            chunk_size,
+            concurrency,
         )
-        return resp.json()
 
     def check_terms_signed(self):
         body = self.hash_details()
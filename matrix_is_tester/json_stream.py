@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Parses JSON responses as they are downloaded, handing the members of their big
+arrays and objects over one at a time rather than building the whole document,
+so that lookups with millions of results can be checked in bounded memory.
+"""
+
+import codecs
+import json
+import re
+import sys
+from json.decoder import scanstring
+
+_WHITESPACE = " \t\n\r"
+_SKIP_WHITESPACE = re.compile(r"[ \t\n\r]*").match
+
+_decoder = json.JSONDecoder()
+
+# Characters that can't follow a complete value, but can carry on a number
+_NUMBER_CONTINUES = ".eE+-"
+
+
+def _may_continue(buf, end):
+    """
+    Whether a value parsed up to `end` may be a number cut off by the end of
+    the buffer, eg. "12" of "12.5" or "1" of "1e5".
+    """
+    return end == len(buf) or buf[end] in _NUMBER_CONTINUES
+
+
+class _NeedMore(Exception):
+    pass
+
+
+class _Reader(object):
+    """
+    JSON text read from an iterable of byte chunks, parsed a value at a time.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("UTF-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """
+        Read another chunk into the buffer.
+
+        Returns:
+            bool: False if there was nothing left to read.
+        """
+        if self.eof:
+            return False
+
+        for chunk in self._chunks:
+            if chunk:
+                # Drop what has already been parsed
+                pos = self.pos
+                self.buf = self.buf[pos:] + self._utf8.decode(chunk)
+                self.pos = 0
+                return True
+        self.buf += self._utf8.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        """
+        Skip whitespace, returning the next character, or '' at the end.
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars):
+        """
+        Consume the next character, which must be one of `chars`.
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                "Expected one of %r, got %r at %d" % (chars, char, self.pos)
+            )
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Parse the next complete JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # Most likely cut off at the end of the buffer
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may carry on in the next chunk
+            if _may_continue(self.buf, end) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _stream_container(reader, handler):
+    opener = reader.expect("[{")
+    closer = "]" if opener == "[" else "}"
+    if reader.peek() == closer:
+        reader.pos += 1
+        return
+
+    is_object = opener == "{"
+    skip = _SKIP_WHITESPACE
+    decode = _decoder.raw_decode
+    key = None
+    while True:
+        buf = reader.buf
+        end = len(buf)
+        try:
+            pos = skip(buf, reader.pos).end()
+            if is_object:
+                if pos >= end:
+                    raise _NeedMore()
+                if buf[pos] != '"':
+                    raise ValueError("Expected a key at %d" % (pos,))
+                key, pos = scanstring(buf, pos + 1)
+                pos = skip(buf, pos).end()
+                if pos >= end:
+                    raise _NeedMore()
+                if buf[pos] != ":":
+                    raise ValueError("Expected ':' at %d" % (pos,))
+                pos = skip(buf, pos + 1).end()
+            value, pos = decode(buf, pos)
+            # Don't take a number before the rest of it arrives
+            if _may_continue(buf, pos):
+                raise _NeedMore()
+            pos = skip(buf, pos).end()
+            if pos >= end:
+                raise _NeedMore()
+        except (_NeedMore, ValueError) as e:
+            # Cut off at the end of the buffer, or really invalid: read more
+            # and try the member again to find out which.
+            if reader._fill():
+                continue
+            if isinstance(e, ValueError):
+                raise
+            raise ValueError("Unexpected end of JSON at %d" % (reader.pos,))
+
+        if is_object:
+            handler(key, value)
+        else:
+            handler(value)
+
+        reader.pos = pos + 1
+        if buf[pos] == closer:
+            return
+        if buf[pos] != ",":
+            raise ValueError("Expected ',' or %r at %d" % (closer, pos))
+
+
+def parse_streamed(chunks, handlers):
+    """
+    Parse a JSON object from an iterable of byte chunks, passing the members
+    of some of its values to handlers as they are parsed instead of keeping
+    them.
+
+    Args:
+        chunks (iterable[bytes]): The UTF-8 encoded JSON document.
+        handlers (dict[str, callable]): Top-level key to the handler for its
+            value's members. Arrays' elements are passed as one argument, and
+            objects' keys and values as two.
+
+    Returns:
+        dict: The document's other top-level keys and values. Keys that were
+            streamed to a handler are included with a value of None.
+
+    Raises:
+        ValueError: If the document isn't a JSON object.
+    """
+    reader = _Reader(chunks)
+    result = {}
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            if key in handlers and reader.peek() in ("[", "{"):
+                _stream_container(reader, handlers[key])
+                result[key] = None
+            else:
+                result[key] = reader.value()
+            if reader.expect(",}") == "}":
+                break
+
+    if reader.peek():
+        raise ValueError("Extra data after JSON object at %d" % (reader.pos,))
+    return result
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def parse_lookup_response(chunks):
+    """
+    Parse a v1 /bulk_lookup or v2 /lookup response as it is downloaded,
+    indexing the results as they arrive.
+
+    Returns:
+        dict: The response, with 'mappings' as a dict of lookup to mxid as
+            usual, and 'threepids' as a dict of (medium, address) to mxid
+            rather than a list. The mxids are interned, as many addresses are
+            usually bound to the same few users.
+    """
+    mappings = {}
+    threepids = {}
+
+    def add_mapping(lookup, mxid):
+        mappings[lookup] = _intern(mxid)
+
+    def add_threepid(threepid):
+        try:
+            medium, address, mxid = threepid
+        except (TypeError, ValueError):
+            raise ValueError("Not a [medium, address, mxid] list: %r" % (threepid,))
+        threepids[(medium, address)] = _intern(mxid)
+
+    body = parse_streamed(chunks, {"mappings": add_mapping, "threepids": add_threepid})
+    if "mappings" in body:
+        body["mappings"] = mappings
+    if "threepids" in body:
+        body["threepids"] = threepids
+    return body
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Caches the answers to public key validity checks, so that checking the keys
+returned with many invites only asks the identity server about each key once.
+
+Set MATRIX_IS_TESTER_KEY_VALIDITY_CACHE=bypass to make the shared cache send
+every check to the identity server, to measure the validity endpoint itself.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from matrix_is_tester.instrumentation import Histogram
+
+KEY_VALIDITY_CACHE_ENV = "MATRIX_IS_TESTER_KEY_VALIDITY_CACHE"
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_SIZE = 10000
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def _key_of(key):
+    # A public key as returned by /store-invite, or a (url, public key) tuple
+    if isinstance(key, dict):
+        return key["key_validity_url"], key["public_key"]
+    return tuple(key)
+
+
+def _valid_from_body(body):
+    if not isinstance(body, dict) or "valid" not in body:
+        raise Exception("Unexpected key validity response: %r" % (body,))
+    return bool(body["valid"])
+
+
+class KeyValidityCache(object):
+    """
+    The validity of public keys, by key_validity_url and public key. Answers
+    expire after a while, as ephemeral keys stop being valid once their
+    invite has been accepted, and the least recently used are evicted once
+    there are too many.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, bypass=False):
+        """
+        Args:
+            ttl (float): Seconds to keep each answer for.
+            max_size (int): Most answers to keep.
+            bypass (bool): Send every check to the identity server, without
+                caching anything.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.bypass = bypass
+
+        self._lock = threading.Lock()
+        # (url, public key) to (valid, expiry time), least recently used first
+        self._entries = OrderedDict()
+        # Checks in flight from async_is_valid, to share with other callers
+        self._in_flight = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.coalesced = 0
+            self.misses = 0
+            self.expired = 0
+            self.evictions = 0
+            self.bypassed = 0
+            self.request_latency = Histogram()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Counts of checks answered from the cache ('hits'), by
+                waiting for the same check already in flight ('coalesced'),
+                and by asking the identity server ('requests', made up of
+                'misses' and 'bypassed'), and the 'latency' of those requests.
+                Also 'expired' answers, answers evicted for space
+                ('evictions'), the current 'size' and the 'hit_rate'.
+        """
+        with self._lock:
+            requests = self.misses + self.bypassed
+            total = self.hits + self.coalesced + requests
+            return {
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "requests": requests,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "latency": self.request_latency.to_dict(),
+                "size": len(self._entries),
+                "hit_rate": (
+                    (self.hits + self.coalesced) / float(total) if total else None
+                ),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, url, public_key):
+        """
+        Look up a cached answer, counting a hit or a miss.
+
+        Returns:
+            bool|None: Whether the key is valid, or None if it isn't cached.
+        """
+        key = (url, public_key)
+        with self._lock:
+            if self.bypass:
+                self.bypassed += 1
+                return None
+
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, url, public_key, valid):
+        if self.bypass:
+            return
+        key = (url, public_key)
+        with self._lock:
+            self._entries[key] = (valid, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def is_valid(self, api, url, public_key):
+        """
+        Check a public key, asking the identity server through `api` (an
+        IsApi) if the answer isn't cached.
+
+        Returns:
+            bool: Whether the key is valid.
+        """
+        valid = self.get(url, public_key)
+        if valid is None:
+            start = time.monotonic()
+            body = api.pubkey_is_valid(url, public_key)
+            self._record_latency(time.monotonic() - start)
+            valid = _valid_from_body(body)
+            self.put(url, public_key, valid)
+        return valid
+
+    def _record_latency(self, latency):
+        with self._lock:
+            self.request_latency.record(latency)
+
+    async def async_is_valid(self, api, url, public_key):
+        """
+        As is_valid, with an AsyncIsApi. Concurrent checks of the same key
+        share one request.
+        """
+        key = (url, public_key)
+        check = self._in_flight.get(key)
+        if check is not None and not self.bypass:
+            with self._lock:
+                self.coalesced += 1
+            # Don't let one caller giving up cancel the check for the others
+            return _valid_from_body(await asyncio.shield(check))
+
+        valid = self.get(url, public_key)
+        if valid is not None:
+            return valid
+
+        start = time.monotonic()
+        check = asyncio.ensure_future(api.pubkey_is_valid(url, public_key))
+        if not self.bypass:
+            self._in_flight[key] = check
+        try:
+            body = await asyncio.shield(check)
+        finally:
+            self._in_flight.pop(key, None)
+        self._record_latency(time.monotonic() - start)
+        valid = _valid_from_body(body)
+        self.put(url, public_key, valid)
+        return valid
+
+    def validate_keys(self, api, keys, concurrency=10):
+        """
+        Check many public keys, concurrently.
+
+        Args:
+            api (IsApi): The API to check uncached keys with.
+            keys (list[dict|tuple]): Public keys as returned by /store-invite,
+                or (key_validity_url, public key) tuples.
+            concurrency (int): Most checks to send at once.
+
+        Returns:
+            list[bool]: Whether each key is valid.
+        """
+        keys = [_key_of(key) for key in keys]
+        unique = list(OrderedDict.fromkeys(keys))
+        with ThreadPoolExecutor(max(min(concurrency, len(unique)), 1)) as pool:
+            results = dict(
+                zip(unique, pool.map(lambda key: self.is_valid(api, *key), unique))
+            )
+        return [results[key] for key in keys]
+
+    async def async_validate_keys(self, api, keys, concurrency=10):
+        """
+        As validate_keys, with an AsyncIsApi.
+        """
+        keys = [_key_of(key) for key in keys]
+        slots = asyncio.Semaphore(concurrency)
+
+        async def check(key):
+            async with slots:
+                return await self.async_is_valid(api, *key)
+
+        return list(await asyncio.gather(*[check(key) for key in keys]))
+
+
+def get_key_validity_cache():
+    """
+    Get the shared KeyValidityCache, making it if necessary.
+    """
+    global _shared_cache
+
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = KeyValidityCache(
+                bypass=os.environ.get(KEY_VALIDITY_CACHE_ENV) == "bypass"
+            )
+        return _shared_cache
@@ -17,6 +17,17 @@
 # limitations under the License.
 
 import atexit
+import inspect
+import os
+import threading
+import time
+
+import requests
+
+from twisted.python import log
+
+from matrix_is_tester.mailsink import get_shared_mailsink
+from matrix_is_tester.workers import get_worker_id
 
 try:
     from matrix_is_test.launcher import MatrixIsTestLauncher
@@ -30,26 +41,338 @@ except ImportError:
 
     raise
 
-launchers = {}
+DEFAULT_READY_TIMEOUT = 60.0
+READY_TIMEOUT_ENV = "MATRIX_IS_TESTER_READY_TIMEOUT"
+PREWARM_ENV = "MATRIX_IS_TESTER_PREWARM"
+ISOLATION_ENV = "MATRIX_IS_TESTER_ISOLATION"
 
+_launcher_pool = None
+_launcher_pool_lock = threading.Lock()
 
-def get_or_launch_is(with_terms=False):
-    global launchers
 
-    key = "withTerms" if with_terms else "noTerms"
+def _launcher_accepts(arg):
+    try:
+        params = inspect.signature(MatrixIsTestLauncher).parameters
+    except (TypeError, ValueError):
+        return False
+    return arg in params or any(
+        p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values()
+    )
 
-    if key not in launchers:
-        if not launchers:
-            atexit.register(destroy_all)
 
-        launchers[key] = MatrixIsTestLauncher(with_terms)
-        launchers[key].launch()
+def _make_launcher(with_terms):
+    """
+    Make a launcher for an IS that sends its mail to this process's mail sink.
 
-    return launchers[key].get_base_url()
+    Launchers that accept an `smtp_port` keyword argument are told which port
+    the mail sink is on. Others must send mail to the mail sink's default port,
+    which means only one set of tests can run at a time.
+    """
+    if _launcher_accepts("smtp_port"):
+        return MatrixIsTestLauncher(
+            with_terms, smtp_port=get_shared_mailsink().get_addr()[1]
+        )
 
+    if get_worker_id() is not None:
+        raise Exception(
+            "Running tests in parallel needs a MatrixIsTestLauncher that accepts "
+            "an 'smtp_port' argument"
+        )
+    return MatrixIsTestLauncher(with_terms)
 
-def destroy_all():
-    global launchers
 
-    for launcher in launchers.values():
+def supports_snapshots(launcher):
+    """
+    Whether a launcher implements the optional snapshot protocol:
+
+        snapshot(): Capture the IS's state (its database, etc.) and return an
+            opaque object representing it.
+        restore(state): Put the IS back into a state returned by snapshot(),
+            returning once it is ready to serve requests again.
+    """
+    return callable(getattr(launcher, "snapshot", None)) and callable(
+        getattr(launcher, "restore", None)
+    )
+
+
+def wait_until_ready(base_url, timeout, interval=0.05):
+    """
+    Poll an IS's v2 status endpoint until it responds.
+
+    Args:
+        base_url (str): The base URL of the IS.
+        timeout (float): Seconds to keep trying for.
+        interval (float): Seconds to wait between attempts.
+
+    Raises:
+        Exception if the IS hasn't responded successfully within the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    url = base_url + "/_matrix/identity/v2"
+    while True:
+        try:
+            resp = requests.get(url, timeout=max(interval, 1.0))
+            if resp.status_code < 500:
+                return
+            error = "status %d" % (resp.status_code,)
+        except requests.RequestException as e:
+            error = str(e)
+
+        if time.monotonic() >= deadline:
+            raise Exception(
+                "Identity server at %s not ready after %.1fs: %s"
+                % (base_url, timeout, error)
+            )
+        time.sleep(interval)
+
+
+class _PoolEntry(object):
+    def __init__(self, launcher):
+        self.launcher = launcher
+        self.ready = threading.Event()
+        self.error = None
+        self.thread = None
+        self.launch_time = None
+        self.ready_time = None
+        self.snapshot = None
+
+
+class LauncherPool(object):
+    """
+    Launches identity servers in the background, one per configuration, and
+    hands them out once they answer requests.
+    """
+
+    def __init__(self, ready_timeout=None):
+        """
+        Args:
+            ready_timeout (float|None): Seconds to wait for a server to launch
+                and become ready. Defaults to $MATRIX_IS_TESTER_READY_TIMEOUT,
+                or 60.
+        """
+        if ready_timeout is None:
+            ready_timeout = float(
+                os.environ.get(READY_TIMEOUT_ENV, DEFAULT_READY_TIMEOUT)
+            )
+        self.ready_timeout = ready_timeout
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._reset_hooks = []
+
+    def add_reset_hook(self, hook):
+        """
+        Have `hook(with_terms, relaunched)` called whenever reset puts an IS
+        back into its initial state, by restoring a snapshot or (if
+        `relaunched`) by launching it again.
+        """
+        self._reset_hooks.append(hook)
+
+    def start(self, with_terms):
+        """
+        Start launching the IS for the given configuration, if it isn't
+        already, without waiting for it.
+        """
+        key = "withTerms" if with_terms else "noTerms"
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+
+            # Made here rather than on the launch thread so that the mail sink
+            # is started from this thread.
+            entry = _PoolEntry(_make_launcher(with_terms))
+            entry.thread = threading.Thread(
+                target=self._launch,
+                args=(key, entry),
+                name="launch-is-%s" % (key,),
+                daemon=True,
+            )
+            self._entries[key] = entry
+            entry.thread.start()
+            return entry
+
+    def _launch(self, key, entry):
+        start = time.monotonic()
+        try:
+            entry.launcher.launch()
+            entry.launch_time = time.monotonic() - start
+            wait_until_ready(entry.launcher.get_base_url(), self.ready_timeout)
+            entry.ready_time = time.monotonic() - start
+            if supports_snapshots(entry.launcher):
+                entry.snapshot = entry.launcher.snapshot()
+            log.msg(
+                "IS %s ready in %.2fs (launch() took %.2fs)"
+                % (key, entry.ready_time, entry.launch_time)
+            )
+        except Exception as e:
+            entry.error = e
+        finally:
+            entry.ready.set()
+
+    def get(self, with_terms):
+        """
+        Get a ready launcher for the given configuration, launching it if it
+        hasn't been started.
+
+        Raises:
+            Exception if the IS failed to launch or didn't become ready in time.
+        """
+        entry = self.start(with_terms)
+        # Allow for launch() itself as well as the readiness probe
+        if not entry.ready.wait(self.ready_timeout * 2):
+            raise Exception(
+                "Timed out waiting for identity server to launch after %.1fs"
+                % (self.ready_timeout * 2,)
+            )
+        if entry.error is not None:
+            raise entry.error
+        return entry.launcher
+
+    def reset(self, with_terms, relaunch=False):
+        """
+        Get a ready launcher for the given configuration whose IS is in the
+        state it was in when it first became ready.
+
+        Launchers that support snapshots are restored to the snapshot taken
+        then. Others are torn down and launched again if `relaunch` is set,
+        and otherwise left as they are.
+
+        Returns:
+            The launcher, which is a new one if the IS was relaunched.
+        """
+        launcher = self.get(with_terms)
+        key = "withTerms" if with_terms else "noTerms"
+
+        if supports_snapshots(launcher):
+            start = time.monotonic()
+            launcher.restore(self._entries[key].snapshot)
+            log.msg("Restored IS %s in %.3fs" % (key, time.monotonic() - start))
+            for hook in self._reset_hooks:
+                hook(with_terms, False)
+            return launcher
+
+        if not relaunch:
+            return launcher
+
+        with self._lock:
+            if self._entries.get(key) is not None:
+                del self._entries[key]
         launcher.tearDown()
+        launcher = self.get(with_terms)
+        for hook in self._reset_hooks:
+            hook(with_terms, True)
+        return launcher
+
+    def update_snapshot(self, with_terms):
+        """
+        Snapshot the IS again, so that resetting it keeps the state it has
+        now, eg. accounts registered ahead of time.
+
+        Returns:
+            bool: False if the launcher doesn't support snapshots.
+        """
+        launcher = self.get(with_terms)
+        if not supports_snapshots(launcher):
+            return False
+        key = "withTerms" if with_terms else "noTerms"
+        self._entries[key].snapshot = launcher.snapshot()
+        return True
+
+    def prewarm(self):
+        """
+        Start launching both the terms and no-terms servers.
+        """
+        self.start(False)
+        self.start(True)
+
+    def startup_times(self):
+        """
+        Returns:
+            dict[str, dict]: For each configuration that has become ready,
+                the seconds its launch() call took and until it was ready.
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+        return dict(
+            (key, {"launch": entry.launch_time, "ready": entry.ready_time})
+            for key, entry in entries
+            if entry.ready_time is not None
+        )
+
+    def destroy_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries = {}
+
+        for entry in entries:
+            entry.ready.wait(self.ready_timeout * 2)
+            try:
+                # Even if launch() failed partway, as it may have left a
+                # process or files behind
+                entry.launcher.tearDown()
+            except Exception as e:
+                log.msg("Failed to tear down identity server: %r" % (e,))
+
+
+def get_launcher_pool():
+    """
+    Get the LauncherPool used by get_or_launch_is, making it if necessary.
+
+    When it is made, both the terms and no-terms servers start launching, so
+    that they launch concurrently and while other tests are running, unless
+    $MATRIX_IS_TESTER_PREWARM is 0.
+    """
+    global _launcher_pool
+
+    with _launcher_pool_lock:
+        if _launcher_pool is None:
+            _launcher_pool = LauncherPool()
+            atexit.register(_launcher_pool.destroy_all)
+            if os.environ.get(PREWARM_ENV, "1") != "0":
+                _launcher_pool.prewarm()
+        return _launcher_pool
+
+
+def get_or_launch_is(with_terms=False):
+    return get_launcher_pool().get(with_terms).get_base_url()
+
+
+def get_is_pid(with_terms=False):
+    """
+    Get the process ID of the launched IS, if its launcher implements the
+    optional `get_pid()` method, or None otherwise.
+    """
+    launcher = get_launcher_pool().get(with_terms)
+    if not callable(getattr(launcher, "get_pid", None)):
+        return None
+    return launcher.get_pid()
+
+
+def reset_is(with_terms=False):
+    """
+    Get the base URL of an IS that is in the state it was when launched,
+    according to $MATRIX_IS_TESTER_ISOLATION:
+
+        snapshot (the default): Restore the IS from a snapshot if its launcher
+            supports them, and otherwise carry on with it as it is.
+        relaunch: As above, but relaunch the IS if its launcher doesn't
+            support snapshots. This gives isolation with any launcher, but
+            costs a full launch per test.
+        off: Carry on with the IS as it is.
+    """
+    mode = os.environ.get(ISOLATION_ENV, "snapshot")
+    if mode == "off":
+        return get_or_launch_is(with_terms)
+    if mode not in ("snapshot", "relaunch"):
+        raise Exception("Unknown %s: %s" % (ISOLATION_ENV, mode))
+
+    launcher = get_launcher_pool().reset(with_terms, relaunch=(mode == "relaunch"))
+    return launcher.get_base_url()
+
+
+def destroy_all():
+    # Without making the pool, which would start launching servers
+    with _launcher_pool_lock:
+        pool = _launcher_pool
+    if pool is not None:
+        pool.destroy_all()
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Drives sustained traffic at an identity server by replaying the flows the tests
+use as weighted scenarios, and reports throughput, errors and latencies.
+"""
+
+import asyncio
+import itertools
+import random
+import time
+import uuid
+
+from matrix_is_tester.async_is_api import AsyncIsApi, close_shared_client_sessions
+from matrix_is_tester.fakehs import hs_addr_list, server_name_for, token_for_user
+from matrix_is_tester.instrumentation import percentile
+from matrix_is_tester.is_api import random_client_secret, token_from_mail
+from matrix_is_tester.mailsink import MAIL_DELIVERY
+
+
+class RequestFailed(Exception):
+    """
+    A request made through LoadStats.call failed. The failure has already
+    been recorded against its endpoint.
+    """
+
+
+class LoadStats(object):
+    """
+    Collects latencies and errors for each endpoint hit during a load run.
+
+    Waits for something other than the IS, eg. for mail to arrive, are
+    recorded the same way but reported apart from the endpoints, so that they
+    don't count towards the IS's requests and throughput.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.waits = set()
+        # Exceptions that weren't from a request, by type, eg. bugs in a
+        # scenario
+        self.exceptions = {}
+        self.iterations = 0
+        self.missed = 0
+        self.start = None
+        self.end = None
+
+    async def call(self, endpoint, coro, wait=False):
+        """
+        Await a request, recording its latency and any errcode against the
+        given endpoint. Exceptions are recorded and re-raised as
+        RequestFailed.
+
+        Args:
+            endpoint (str): What to record the request against.
+            coro (awaitable): The request.
+            wait (bool): Whether this is a wait rather than a request.
+        """
+        start = time.monotonic()
+        try:
+            body = await coro
+        except Exception as e:
+            self.record(endpoint, time.monotonic() - start, type(e).__name__, wait)
+            raise RequestFailed("%s failed: %r" % (endpoint, e)) from e
+
+        errcode = None
+        if isinstance(body, dict) and "errcode" in body:
+            errcode = body["errcode"]
+        self.record(endpoint, time.monotonic() - start, errcode, wait)
+        return body
+
+    def record(self, endpoint, latency, errcode=None, wait=False):
+        """
+        Record something that was timed other than by call.
+        """
+        if wait:
+            self.waits.add(endpoint)
+        self.latencies.setdefault(endpoint, []).append(latency)
+        if errcode is not None:
+            errors = self.errors.setdefault(endpoint, {})
+            errors[errcode] = errors.get(errcode, 0) + 1
+
+    def record_exception(self, e):
+        """
+        Count an exception that didn't come from a request.
+        """
+        name = type(e).__name__
+        self.exceptions[name] = self.exceptions.get(name, 0) + 1
+
+    def request_latencies(self):
+        """
+        Returns:
+            list[float]: The latency of every request, not including waits.
+        """
+        return [
+            latency
+            for endpoint, latencies in self.latencies.items()
+            if endpoint not in self.waits
+            for latency in latencies
+        ]
+
+    def report(self):
+        """
+        Summarise the run as a JSON-serialisable dict.
+        """
+        duration = (self.end or time.monotonic()) - self.start
+        endpoints = {}
+        waits = {}
+        total_requests = 0
+        total_errors = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            errors = self.errors.get(endpoint, {})
+            summary = {
+                "requests": len(latencies),
+                "throughput": len(latencies) / duration,
+                "error_rate": sum(errors.values()) / float(len(latencies)),
+                "errors": errors,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+            }
+            if endpoint in self.waits:
+                waits[endpoint] = summary
+                continue
+
+            endpoints[endpoint] = summary
+            total_requests += len(latencies)
+            for errcode, count in errors.items():
+                total_errors[errcode] = total_errors.get(errcode, 0) + count
+
+        for name, count in self.exceptions.items():
+            total_errors["exception:" + name] = count
+
+        return {
+            "duration": duration,
+            "iterations": self.iterations,
+            "missed_iterations": self.missed,
+            "requests": total_requests,
+            "throughput": total_requests / duration,
+            "errors": total_errors,
+            "endpoints": endpoints,
+            "waits": waits,
+        }
+
+
+def _format_rows(rows):
+    lines = []
+    for name, stats in rows.items():
+        lines.append(
+            "%-40s %8d %9.1f %6.1f%% %9.1f %9.1f %9.1f"
+            % (
+                name,
+                stats["requests"],
+                stats["throughput"],
+                stats["error_rate"] * 100,
+                stats["p50"] * 1000,
+                stats["p95"] * 1000,
+                stats["p99"] * 1000,
+            )
+        )
+    return lines
+
+
+def format_report(report):
+    lines = [
+        "%d requests in %.1fs (%.1f req/s), %d iterations, %d missed"
+        % (
+            report["requests"],
+            report["duration"],
+            report["throughput"],
+            report["iterations"],
+            report["missed_iterations"],
+        ),
+        "",
+        "%-40s %8s %9s %7s %9s %9s %9s"
+        % ("endpoint", "requests", "req/s", "errors", "p50 ms", "p95 ms", "p99 ms"),
+    ]
+    lines.extend(_format_rows(report["endpoints"]))
+    if report.get("waits"):
+        lines.append("")
+        lines.append(
+            "%-40s %8s %9s %7s %9s %9s %9s"
+            % ("wait", "waits", "per s", "errors", "p50 ms", "p95 ms", "p99 ms")
+        )
+        lines.extend(_format_rows(report["waits"]))
+    if report["errors"]:
+        lines.append("")
+        lines.append("errors by errcode:")
+        for errcode, count in sorted(report["errors"].items()):
+            lines.append("  %-38s %d" % (errcode, count))
+    return "\n".join(lines)
+
+
+class LoadContext(object):
+    """
+    State shared by the scenarios of one load run.
+    """
+
+    def __init__(self, base_url, mail_sink, hs_addr, stats, mail_timeout=None):
+        self.base_url = base_url
+        self.mail_sink = mail_sink
+        self.hs_addr = hs_addr
+        self.server_names = [server_name_for(addr) for addr in hs_addr_list(hs_addr)]
+        self.stats = stats
+        self.mail_timeout = mail_timeout
+        self.run_id = uuid.uuid4().hex[:8]
+        self.bound_addresses = []
+        self.accounts = []
+
+        self._counter = itertools.count()
+
+    def new_address(self):
+        return "load-%s-%d@load.test" % (self.run_id, next(self._counter))
+
+    def new_user_id(self, server_name=None):
+        if server_name is None:
+            server_name = random.choice(self.server_names)
+        return "@load-%s-%d:%s" % (self.run_id, next(self._counter), server_name)
+
+    async def new_account(self):
+        """
+        Register a new account, returning an authenticated AsyncIsApi and the
+        user ID it is registered as.
+        """
+        api = AsyncIsApi(self.base_url, "v2", self.mail_sink)
+        server_name = random.choice(self.server_names)
+        user_id = self.new_user_id(server_name)
+        body = await self.stats.call(
+            "/account/register", api.register(server_name, token_for_user(user_id))
+        )
+        api.headers = {"Authorization": "Bearer %s" % (body["token"],)}
+        return api, user_id
+
+    async def lease_account(self, account_pool):
+        """
+        As new_account, but leasing an account from an AccountPool.
+        """
+        # Leasing may have to register an account, so keep it off the loop
+        loop = asyncio.get_running_loop()
+        account = await loop.run_in_executor(None, account_pool.lease)
+        api = AsyncIsApi(self.base_url, "v2", self.mail_sink)
+        api.use_account(account)
+        return api, account.user_id
+
+    def account(self):
+        return random.choice(self.accounts)
+
+    async def _wait_for_token(self, address):
+        mail = await self.mail_sink.async_wait_for_mail(
+            to=address, timeout=self.mail_timeout
+        )
+        return token_from_mail(mail)
+
+    async def validate(self, api, address):
+        client_secret = random_client_secret()
+        body = await self.stats.call(
+            "/validate/email/requestToken",
+            api.request_email_code(address, client_secret, 1),
+        )
+        sid = body["sid"]
+        # Timed out waits and mail without a token are recorded as errors
+        # against the wait
+        token = await self.stats.call(
+            MAIL_DELIVERY, self._wait_for_token(address), wait=True
+        )
+        body = await self.stats.call(
+            "/validate/email/submitToken",
+            api.submit_email_token(sid, client_secret, token),
+        )
+        if not body.get("success"):
+            raise RequestFailed("Submit token failed: %r" % (body,))
+        return sid, client_secret
+
+
+async def scenario_ping(ctx):
+    api, _ = ctx.account()
+    await ctx.stats.call("/", api.ping())
+
+
+async def scenario_register(ctx):
+    await ctx.new_account()
+
+
+async def scenario_validate(ctx):
+    api, _ = ctx.account()
+    await ctx.validate(api, ctx.new_address())
+
+
+async def scenario_bind(ctx):
+    api, user_id = ctx.account()
+    address = ctx.new_address()
+    sid, client_secret = await ctx.validate(api, address)
+    await ctx.stats.call("/3pid/bind", api.bind_email(sid, client_secret, user_id))
+    ctx.bound_addresses.append(address)
+
+
+async def scenario_lookup(ctx, batch_size=10):
+    api, _ = ctx.account()
+    details = await ctx.stats.call("/hash_details", api.hash_details())
+
+    addresses = random.sample(
+        ctx.bound_addresses, min(batch_size, len(ctx.bound_addresses))
+    )
+    while len(addresses) < batch_size:
+        addresses.append(ctx.new_address())
+
+    await ctx.stats.call(
+        "/lookup",
+        api.hashed_lookup(
+            ["%s email" % (address,) for address in addresses],
+            "none",
+            details["lookup_pepper"],
+        ),
+    )
+
+
+SCENARIOS = {
+    "ping": scenario_ping,
+    "register": scenario_register,
+    "validate": scenario_validate,
+    "bind": scenario_bind,
+    "lookup": scenario_lookup,
+}
+
+
+async def _run_iteration(ctx, names, weights):
+    name = random.choices(names, weights)[0]
+    try:
+        await SCENARIOS[name](ctx)
+    except RequestFailed:
+        # Already recorded against its endpoint
+        pass
+    except Exception as e:
+        ctx.stats.record_exception(e)
+    ctx.stats.iterations += 1
+
+
+async def run_load(
+    base_url,
+    mail_sink,
+    hs_addr,
+    scenarios,
+    duration,
+    concurrency=10,
+    rate=None,
+    accounts=10,
+    account_pool=None,
+):
+    """
+    Run weighted scenarios against an identity server for a fixed duration.
+
+    Args:
+        base_url (str): The base URL of the IS to load.
+        mail_sink (MailSink): The mail sink the IS sends its mail to.
+        hs_addr (tuple|list[tuple]): Host, port of the fake homeserver, or a
+            list of them to spread the accounts over.
+        scenarios (dict[str, float]): Scenario name to relative weight.
+        duration (float): How long to run for, in seconds.
+        concurrency (int): Without a rate, the number of scenarios run
+            back-to-back in parallel. With a rate, the maximum number of
+            scenarios in flight; iterations that would exceed it are counted
+            as missed.
+        rate (float|None): Target scenario iterations per second, or None to
+            run as fast as the concurrency allows.
+        accounts (int): How many accounts to register up front and share
+            between the scenarios that need one.
+        account_pool (AccountPool|None): Lease the shared accounts from this
+            pool instead of registering them, and release them afterwards.
+
+    Returns:
+        dict: The report from LoadStats.report.
+    """
+    for name in scenarios:
+        if name not in SCENARIOS:
+            raise Exception("Unknown scenario: %s" % (name,))
+    if accounts < 1:
+        raise ValueError("Need at least one account, not %d" % (accounts,))
+    names = list(scenarios.keys())
+    weights = [scenarios[name] for name in names]
+
+    ctx = LoadContext(base_url, mail_sink, hs_addr, LoadStats())
+    try:
+        if account_pool is None:
+            ctx.accounts = await asyncio.gather(
+                *[ctx.new_account() for _ in range(accounts)]
+            )
+        else:
+            ctx.accounts = await asyncio.gather(
+                *[ctx.lease_account(account_pool) for _ in range(accounts)]
+            )
+
+        # Don't count the set-up in the results
+        stats = ctx.stats = LoadStats()
+        stats.start = time.monotonic()
+        deadline = stats.start + duration
+
+        if rate is None:
+
+            async def worker():
+                while time.monotonic() < deadline:
+                    await _run_iteration(ctx, names, weights)
+
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+        else:
+            in_flight = set()
+            interval = 1.0 / rate
+            next_start = stats.start
+            while next_start < deadline:
+                delay = next_start - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if len(in_flight) >= concurrency:
+                    stats.missed += 1
+                else:
+                    task = asyncio.ensure_future(_run_iteration(ctx, names, weights))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+                next_start += interval
+            if in_flight:
+                await asyncio.wait(in_flight)
+
+        stats.end = time.monotonic()
+        return stats.report()
+    finally:
+        if account_pool is not None:
+            for api, _ in ctx.accounts:
+                account_pool.release(api.leased_account)
+        await close_shared_client_sessions()
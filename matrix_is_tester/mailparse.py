@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Parses the mail an identity server sends into the fields the tests need: the
+validation token, the session IDs of any validation links and, for invite
+mail, the invite. The mail sink parses each message once as it arrives.
+
+Messages may be bare bodies, as the test templates send, or full MIME
+messages with headers, including multipart HTML and text alternatives.
+"""
+
+import email
+import email.policy
+import json
+import re
+from urllib.parse import unquote
+
+TOKEN_START = "<<<"
+TOKEN_END = ">>>"
+
+# A header field name, then a colon
+_HEADER_RE = re.compile(rb"[A-Za-z0-9-]+:")
+_PARAM_VALUE = re.compile(r"[^&\s\"'<>]+").match
+
+
+def _looks_like_headers(data):
+    end = data.find(b"\n")
+    first_line = data if end < 0 else data[:end]
+    return _HEADER_RE.match(first_line) is not None
+
+
+def _text_parts(data):
+    """
+    Returns:
+        tuple[str|None, list[str]]: The subject, if the message has headers,
+            and the text of each of its text parts.
+    """
+    if not _looks_like_headers(data):
+        return None, [data.decode("UTF-8", "replace")]
+
+    message = email.message_from_bytes(data, policy=email.policy.default)
+    texts = []
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_maintype() != "text":
+            continue
+        if part.get_content_disposition() == "attachment":
+            continue
+        try:
+            texts.append(part.get_content())
+        except (LookupError, ValueError):
+            # An unknown or wrong charset
+            payload = part.get_payload(decode=True) or b""
+            texts.append(payload.decode("UTF-8", "replace"))
+    return message.get("Subject"), texts
+
+
+def _find_token(text):
+    start = text.find(TOKEN_START)
+    if start < 0:
+        return None
+    start += len(TOKEN_START)
+    end = text.find(TOKEN_END, start)
+    if end <= start:
+        return None
+    return text[start:end]
+
+
+def _query_params(text, name):
+    """
+    Find the values of a query string parameter in every link in some text,
+    without scanning all of it with a regex.
+
+    Returns:
+        list[str]: The values, URL-decoded, in the order they appear.
+    """
+    needle = name + "="
+    values = []
+    pos = text.find(needle)
+    while pos >= 0:
+        start = pos + len(needle)
+        # After '?' or '&', or '&amp;' in HTML
+        if pos > 0 and text[pos - 1] in "?&;":
+            match = _PARAM_VALUE(text, start)
+            if match:
+                values.append(unquote(match.group(0)))
+        pos = text.find(needle, start)
+    return values
+
+
+def _find_invite(text):
+    text = text.strip()
+    if not text.startswith("{"):
+        return None
+    try:
+        invite = json.loads(text)
+    except ValueError:
+        return None
+    return invite if isinstance(invite, dict) else None
+
+
+def parse_mail(data):
+    """
+    Parse a received message.
+
+    Args:
+        data (bytes): The message, as received over SMTP.
+
+    Returns:
+        dict: The 'subject' (or None), the validation 'token' (or None),
+            the validation session IDs in its links as 'sids', the 'invite'
+            (or None) if the body is an invite as JSON, and its 'size' in
+            bytes.
+    """
+    subject, texts = _text_parts(data)
+
+    token = None
+    sids = []
+    invite = None
+    for text in texts:
+        if token is None:
+            token = _find_token(text)
+        if token is None:
+            tokens = _query_params(text, "token")
+            if tokens:
+                token = tokens[0]
+        for sid in _query_params(text, "sid"):
+            if sid not in sids:
+                sids.append(sid)
+        if invite is None:
+            invite = _find_invite(text)
+
+    if token is None and invite is not None and isinstance(invite.get("token"), str):
+        token = invite["token"]
+
+    return {
+        "subject": subject,
+        "token": token,
+        "sids": sids,
+        "invite": invite,
+        "size": len(data),
+    }
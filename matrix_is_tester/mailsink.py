@@ -14,10 +14,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import asyncore
+import asyncio
 import atexit
-import smtpd
-from multiprocessing import Process, Queue
+import concurrent.futures
+import os
+import threading
+import time
+from collections import deque
+from multiprocessing import Event, Process, Queue, Value
+from queue import Empty
+
+from matrix_is_tester.instrumentation import get_instrumentation
+from matrix_is_tester.mailparse import parse_mail
+from matrix_is_tester.workers import port_for_worker
+
+DEFAULT_PORT = 9925
+MAX_LINE_LENGTH = 4096
+MAX_MESSAGE_SIZE = 10 * 1024 * 1024
+
+MAIL_TIMEOUT_ENV = "MATRIX_IS_TESTER_MAIL_TIMEOUT"
+# Waits return as soon as the mail arrives, so this only matters when it
+# doesn't: it is generous so that a slow IS on a loaded machine isn't a failure
+DEFAULT_MAIL_TIMEOUT = 10.0
+
+# Mail nobody asks for, and token requests whose mail never arrives, are
+# forgotten after this many seconds, or once there are this many of them, so
+# that long runs don't grow without bound
+DEFAULT_UNCLAIMED_TTL = 600.0
+DEFAULT_MAX_UNCLAIMED = 100000
+
+# The pseudo-endpoint that the time from requesting a validation token to its
+# mail arriving is recorded against in the instrumentation
+MAIL_DELIVERY = "MAIL requestToken"
 
 shared_instance = None
 
@@ -25,7 +53,7 @@ shared_instance = None
 def get_shared_mailsink():
     global shared_instance
     if shared_instance is None:
-        shared_instance = MailSink()
+        shared_instance = MailSink(port=port_for_worker(DEFAULT_PORT))
         shared_instance.launch()
         atexit.register(destroy_shared)
     return shared_instance
@@ -36,37 +64,675 @@ def destroy_shared():
     shared_instance.tearDown()
 
 
-class MailSinkSmtpServer(smtpd.SMTPServer):
-    def __init__(self, localaddr, remoteaddr, q):
-        smtpd.SMTPServer.__init__(self, localaddr, remoteaddr)
-        self.queue = q
+class _SmtpSinkProtocol(asyncio.Protocol):
+    """
+    A minimal SMTP server that accepts every message, parses it and passes
+    it to a callback. Commands may be pipelined: every complete command in a
+    read is handled and the replies are written back together.
+    """
 
-    def process_message(self, peer, mailfrom, rctpto, data, **kwargs):
-        self.queue.put(
-            {"peer": peer, "mailfrom": mailfrom, "rctpto": rctpto, "data": data}
-        )
+    def __init__(self, deliver, max_message_size=MAX_MESSAGE_SIZE, keep_data=False):
+        self._deliver = deliver
+        self._max_message_size = max_message_size
+        self._keep_data = keep_data
+        self._buffer = b""
+        self._in_data = False
+        self._searched = 0
+        self._reset()
+
+    def _reset(self):
+        self._mailfrom = None
+        self._rcpttos = []
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._peer = transport.get_extra_info("peername")
+        transport.write(b"220 matrix_is_tester mail sink ESMTP\r\n")
+
+    def data_received(self, data):
+        buf = self._buffer + data
+        pos = 0
+        replies = []
+        closing = False
+        while not closing:
+            if self._in_data:
+                if buf.startswith(b".\r\n", pos):
+                    body = b""
+                    pos += 3
+                else:
+                    # The terminator may straddle reads, so back up a little
+                    # when searching again.
+                    end = buf.find(b"\r\n.\r\n", max(pos, self._searched - 4))
+                    if end < 0:
+                        self._searched = len(buf)
+                        if len(buf) - pos > self._max_message_size:
+                            replies.append(b"552 Message too big")
+                            closing = True
+                        break
+                    body = buf[pos:end]
+                    pos = end + 5
+                self._in_data = False
+                replies.append(self._handle_message(body))
+            else:
+                end = buf.find(b"\r\n", pos)
+                if end < 0:
+                    if len(buf) - pos > MAX_LINE_LENGTH:
+                        replies.append(b"500 Line too long")
+                        closing = True
+                    break
+                reply, closing = self._handle_command(buf[pos:end])
+                pos = end + 2
+                replies.append(reply)
+
+        self._buffer = buf[pos:]
+        self._searched -= pos
+        if replies:
+            self._transport.write(b"\r\n".join(replies) + b"\r\n")
+        if closing:
+            self._transport.close()
+
+    def _handle_command(self, line):
+        command, _, arg = line.partition(b" ")
+        command = command.upper()
+
+        if command == b"EHLO":
+            self._reset()
+            return (
+                b"250-matrix_is_tester\r\n250-PIPELINING\r\n250-8BITMIME\r\n"
+                b"250 SIZE %d" % (self._max_message_size,),
+                False,
+            )
+        elif command == b"HELO":
+            self._reset()
+            return b"250 matrix_is_tester", False
+        elif command == b"MAIL":
+            self._reset()
+            self._mailfrom = _smtp_address(arg)
+            return b"250 OK", False
+        elif command == b"RCPT":
+            if self._mailfrom is None:
+                return b"503 Need MAIL first", False
+            self._rcpttos.append(_smtp_address(arg))
+            return b"250 OK", False
+        elif command == b"DATA":
+            if not self._rcpttos:
+                return b"503 Need RCPT first", False
+            self._in_data = True
+            self._searched = 0
+            return b"354 End data with <CR><LF>.<CR><LF>", False
+        elif command == b"RSET":
+            self._reset()
+            return b"250 OK", False
+        elif command == b"NOOP":
+            return b"250 OK", False
+        elif command == b"QUIT":
+            return b"221 Bye", True
+        return b"502 Command not implemented", False
+
+    def _handle_message(self, body):
+        # Undo the dot-stuffing of lines beginning with '.', and use the same
+        # line endings as smtpd did.
+        lines = body.split(b"\r\n")
+        data = b"\n".join([line[1:] if line[:1] == b"." else line for line in lines])
+
+        mail = {
+            "peer": self._peer,
+            "mailfrom": self._mailfrom,
+            "rctpto": self._rcpttos,
+            # So that tests can tell how long the mail took to arrive
+            "received": time.time(),
+        }
+        # Parse it once, here, rather than every time something looks at it,
+        # and only keep the whole message if asked to.
+        mail.update(parse_mail(data))
+        if self._keep_data:
+            mail["data"] = data
+
+        self._deliver(mail)
+        self._reset()
+        return b"250 OK"
+
+
+def _smtp_address(arg):
+    # eg. 'FROM:<someone@example.com> SIZE=123'
+    _, _, address = arg.partition(b":")
+    address = address.strip().split(b" ")[0]
+    return address.strip(b"<>").decode("UTF-8", "replace")
+
+
+async def _start_smtp_server(deliver, host, port, keep_data=False):
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(
+        lambda: _SmtpSinkProtocol(deliver, keep_data=keep_data),
+        host,
+        port,
+        reuse_address=True,
+    )
+
+
+def run_mail_sink(q, host, port, bound_port, ready, keep_data=False):
+    """
+    Run the SMTP server in a separate process, putting each mail on the given
+    queue.
+    """
+
+    async def serve():
+        server = await _start_smtp_server(q.put, host, port, keep_data)
+        bound_port.value = server.sockets[0].getsockname()[1]
+        ready.set()
+        await server.serve_forever()
 
+    asyncio.run(serve())
 
-def run_mail_sink(q):
-    MailSinkSmtpServer(("127.0.0.1", 9925), None, q)
-    asyncore.loop()
+
+class _Waiter(object):
+    __slots__ = ("mail", "notify")
+
+    def __init__(self, notify):
+        self.mail = None
+        self.notify = notify
 
 
 class MailSink(object):
+    """
+    Receives mail from the IS and indexes it by recipient address (and by
+    validation session ID, where the mail contains a link with one) so that
+    concurrent flows can each wait for their own mail.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=DEFAULT_PORT,
+        in_process=True,
+        timeout=None,
+        instrumentation=None,
+        keep_data=False,
+        unclaimed_ttl=DEFAULT_UNCLAIMED_TTL,
+        max_unclaimed=DEFAULT_MAX_UNCLAIMED,
+    ):
+        """
+        Args:
+            host (str): Address to listen for SMTP on.
+            port (int): Port to listen for SMTP on, or 0 to pick a free one.
+            in_process (bool): Whether to run the SMTP server on a thread in
+                this process and index mail as it is received, rather than in
+                a separate process that passes each mail over a queue.
+            timeout (float|None): How long to wait for mail by default, in
+                seconds. Defaults to $MATRIX_IS_TESTER_MAIL_TIMEOUT, or 10.
+            instrumentation (Instrumentation|None): Where to record how long
+                mail took to arrive. If None, the shared instrumentation is
+                used.
+            keep_data (bool): Keep each whole message as 'data', as well as
+                the fields parsed from it (see mailparse.parse_mail).
+            unclaimed_ttl (float): Seconds to keep mail that nobody has asked
+                for, and to remember token requests whose mail hasn't
+                arrived.
+            max_unclaimed (int): Most mails nobody has asked for, and token
+                requests whose mail hasn't arrived, to keep. The oldest are
+                dropped first.
+        """
+        if timeout is None:
+            timeout = float(os.environ.get(MAIL_TIMEOUT_ENV, DEFAULT_MAIL_TIMEOUT))
+        if instrumentation is None:
+            instrumentation = get_instrumentation()
+        self.host = host
+        self.port = port
+        self.in_process = in_process
+        self.timeout = timeout
+        self.instrumentation = instrumentation
+        self.keep_data = keep_data
+        self.unclaimed_ttl = unclaimed_ttl
+        self.max_unclaimed = max_unclaimed
+        self.delivered = 0
+        # Mails dropped without anybody asking for them
+        self.expired = 0
+
     def launch(self):
+        self._lock = threading.Lock()
+        # Mail nobody has asked for yet, oldest first, by index key. The same
+        # entry appears under each of its keys, so it is marked taken rather
+        # than removed from all of them.
+        self._unclaimed = {}
+        self._unclaimed_count = 0
+        # Waiters that haven't got their mail yet, by index key.
+        self._waiters = {}
+        # When a validation token was last requested for each address whose
+        # mail hasn't arrived yet, by index key, oldest first.
+        self._requested = {}
+
+        if self.in_process:
+            self._launch_thread()
+        else:
+            self._launch_process()
+
+    def _launch_thread(self):
+        self._loop = asyncio.new_event_loop()
+        started = concurrent.futures.Future()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._server = self._loop.run_until_complete(
+                    _start_smtp_server(
+                        self._deliver, self.host, self.port, self.keep_data
+                    )
+                )
+            except Exception as e:
+                started.set_exception(e)
+                return
+            started.set_result(self._server.sockets[0].getsockname()[1])
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="mailsink")
+        self._thread.daemon = True
+        self._thread.start()
+        self.port = started.result()
+
+    def _launch_process(self):
+        bound_port = Value("i", 0)
+        ready = Event()
+
         self.queue = Queue()
-        self.process = Process(target=run_mail_sink, args=(self.queue,))
+        self.process = Process(
+            target=run_mail_sink,
+            args=(self.queue, self.host, self.port, bound_port, ready, self.keep_data),
+        )
         self.process.start()
+        if not ready.wait(10):
+            self.process.terminate()
+            raise Exception("Mail sink failed to start")
+        self.port = bound_port.value
+
+        self._pump = threading.Thread(target=self._run_pump, name="mailsink-pump")
+        self._pump.daemon = True
+        self._pump.start()
+
+    def get_addr(self):
+        """
+        Returns a host, port tuple representing the address on which the mail
+        sink is listening for SMTP.
+        """
+        return (self.host, self.port)
+
+    def _run_pump(self):
+        while True:
+            try:
+                mail = self.queue.get()
+            except (EOFError, OSError):
+                return
+            self._deliver(mail)
+
+    def mail_requested(self, address):
+        """
+        Note that a validation token has just been requested for `address`, so
+        that how long its mail takes to arrive is recorded.
+        """
+        key = _lookup_key(address, None)
+        now = time.time()
+        with self._lock:
+            # Moved to the end, so that the oldest are first
+            self._requested.pop(key, None)
+            self._requested[key] = now
+
+            cutoff = now - self.unclaimed_ttl
+            while self._requested:
+                oldest = next(iter(self._requested))
+                if (
+                    self._requested[oldest] >= cutoff
+                    and len(self._requested) <= self.max_unclaimed
+                ):
+                    break
+                del self._requested[oldest]
+
+    def _deliver(self, mail):
+        keys = _index_keys(mail)
+        with self._lock:
+            requested = None
+            for key in keys:
+                requested = self._requested.pop(key, requested)
+
+        # Before handing the mail over, so that whoever was waiting for it
+        # sees it recorded
+        if requested is not None:
+            self.instrumentation.record(
+                MAIL_DELIVERY,
+                "delivered",
+                max(mail["received"] - requested, 0),
+                None,
+                0,
+                mail["size"],
+            )
+
+        with self._lock:
+            self.delivered += 1
+            self._hand_over(mail, keys)
+
+    def _hand_over(self, mail, keys):
+        # Give the mail to the first thread waiting for it, or keep it for
+        # whoever asks later
+        for key in keys + [None]:
+            waiters = self._waiters.get(key)
+            if waiters:
+                waiter = waiters.popleft()
+                if not waiters:
+                    del self._waiters[key]
+                waiter.mail = mail
+                waiter.notify()
+                return
+
+        entry = [mail]
+        for key in keys + [None]:
+            self._unclaimed.setdefault(key, deque()).append(entry)
+        self._unclaimed_count += 1
+        self._expire_unclaimed()
+        self._maybe_compact()
+
+    def _expire_unclaimed(self):
+        # Drop the oldest unclaimed mail while it is too old or there is too
+        # much of it. It is the oldest under each of its keys too, so it and
+        # any taken entries in front of it come off the front of each.
+        everything = self._unclaimed[None]
+        cutoff = time.time() - self.unclaimed_ttl
+        while everything:
+            entry = everything[0]
+            if entry:
+                if (
+                    entry[0]["received"] >= cutoff
+                    and self._unclaimed_count <= self.max_unclaimed
+                ):
+                    return
+                mail = entry.pop()
+                self._unclaimed_count -= 1
+                self.expired += 1
+                for key in _index_keys(mail):
+                    entries = self._unclaimed.get(key)
+                    while entries and not entries[0]:
+                        entries.popleft()
+                    if entries is not None and not entries:
+                        del self._unclaimed[key]
+            everything.popleft()
+        del self._unclaimed[None]
+
+    def _maybe_compact(self):
+        # Entries taken under one key stay behind, empty, under the others until
+        # they reach the front: once they outnumber the real ones, sweep them.
+        everything = self._unclaimed.get(None, ())
+        if len(everything) > 1024 and len(everything) > 2 * self._unclaimed_count:
+            for key in list(self._unclaimed.keys()):
+                entries = deque(e for e in self._unclaimed[key] if e)
+                if entries:
+                    self._unclaimed[key] = entries
+                else:
+                    del self._unclaimed[key]
+
+    def clear(self):
+        """
+        Throw away all mail that nobody has asked for yet, so that it can't
+        be mistaken for mail sent later. Threads waiting for mail carry on
+        waiting.
+
+        Returns:
+            int: The number of mails thrown away.
+        """
+        with self._lock:
+            count = self._unclaimed_count
+            self._unclaimed = {}
+            self._unclaimed_count = 0
+            self._requested = {}
+        return count
+
+    def _take_unclaimed(self, key):
+        entries = self._unclaimed.get(key)
+        while entries:
+            entry = entries.popleft()
+            if entry:
+                mail = entry.pop()
+                self._unclaimed_count -= 1
+                break
+        else:
+            mail = None
+        if entries is not None and not entries:
+            del self._unclaimed[key]
+        return mail
+
+    def _add_waiter(self, key, notify):
+        waiter = _Waiter(notify)
+        self._waiters.setdefault(key, deque()).append(waiter)
+        return waiter
+
+    def _remove_waiter(self, key, waiter):
+        waiters = self._waiters.get(key)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[key]
+
+    def _wait_time(self, timeout, deadline):
+        if timeout is None:
+            timeout = self.timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        return max(timeout, 0)
+
+    def wait_for_mail(self, to=None, sid=None, timeout=None, deadline=None):
+        """
+        Wait for the next mail sent to the given address or for the given
+        validation session, or the next mail of any kind if neither is given.
+        Returns as soon as the mail arrives.
+
+        Args:
+            to (str|None): Recipient address.
+            sid (str|None): Validation session ID.
+            timeout (float|None): How long to wait, in seconds. Defaults to
+                the sink's timeout.
+            deadline (float|None): time.monotonic() value to give up at, if
+                that is sooner, so that a multi-step flow can share one time
+                limit.
+
+        Returns:
+            dict: The mail.
+
+        Raises:
+            queue.Empty if no mail arrived in time.
+        """
+        key = _lookup_key(to, sid)
+        wait = self._wait_time(timeout, deadline)
+        event = threading.Event()
+        with self._lock:
+            mail = self._take_unclaimed(key)
+            if mail is not None:
+                return mail
+            waiter = self._add_waiter(key, event.set)
+
+        event.wait(wait)
+
+        with self._lock:
+            if waiter.mail is None:
+                self._remove_waiter(key, waiter)
+                raise Empty(_no_mail_message(to, sid, wait))
+            return waiter.mail
+
+    async def async_wait_for_mail(self, to=None, sid=None, timeout=None, deadline=None):
+        """
+        As wait_for_mail, but waits in the running asyncio event loop rather
+        than blocking the calling thread.
+        """
+        key = _lookup_key(to, sid)
+        wait = self._wait_time(timeout, deadline)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(_set_future_done, future)
+
+        with self._lock:
+            mail = self._take_unclaimed(key)
+            if mail is not None:
+                return mail
+            waiter = self._add_waiter(key, notify)
+
+        try:
+            await asyncio.wait_for(future, wait)
+        except asyncio.TimeoutError:
+            pass
+
+        with self._lock:
+            if waiter.mail is None:
+                self._remove_waiter(key, waiter)
+                raise Empty(_no_mail_message(to, sid, wait))
+            return waiter.mail
 
     def get_mail(self):
-        return self.queue.get(timeout=0.5)
+        return self.wait_for_mail()
 
     def tearDown(self):
-        self.process.terminate()
+        if self.in_process:
+
+            def stop():
+                self._server.close()
+                self._loop.stop()
+
+            self._loop.call_soon_threadsafe(stop)
+            self._thread.join(5)
+        else:
+            self.process.terminate()
+
+
+def _set_future_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _no_mail_message(to, sid, wait):
+    if to is not None:
+        what = "to %s" % (to,)
+    elif sid is not None:
+        what = "for session %s" % (sid,)
+    else:
+        what = "at all"
+    return "No mail %s within %.1fs" % (what, wait)
+
+
+def _lookup_key(to, sid):
+    if to is not None:
+        return ("to", to.lower())
+    if sid is not None:
+        return ("sid", sid)
+    return None
+
+
+def _index_keys(mail):
+    """
+    Returns the keys a received mail can be looked up by.
+    """
+    keys = [("to", address.lower()) for address in mail["rctpto"]]
+    keys.extend(("sid", sid) for sid in mail["sids"])
+    return keys
+
+
+async def _send_benchmark_mail(host, port, count, pipeline, body):
+    reader, writer = await asyncio.open_connection(host, port)
+    await reader.readline()
+    writer.write(b"EHLO benchmark\r\n")
+    while not (await reader.readline()).startswith(b"250 "):
+        pass
+
+    sent = 0
+    while sent < count:
+        batch = min(pipeline, count - sent)
+        for i in range(sent, sent + batch):
+            writer.write(
+                b"MAIL FROM:<benchmark@sink.test>\r\n"
+                b"RCPT TO:<benchmark%d@sink.test>\r\n"
+                b"DATA\r\n%s\r\n.\r\n" % (i, body)
+            )
+        await writer.drain()
+        # 250 (MAIL), 250 (RCPT), 354 (DATA), 250 (message)
+        for _ in range(batch * 4):
+            await reader.readline()
+        sent += batch
+
+    writer.write(b"QUIT\r\n")
+    await reader.readline()
+    writer.close()
+
+
+def benchmark(sink, messages=10000, connections=4, pipeline=100, size=512):
+    """
+    Measure how many messages per second a launched mail sink absorbs: that
+    is, until they are indexed and ready for wait_for_mail.
+
+    Args:
+        sink (MailSink): The launched sink to send mail to.
+        messages (int): Total number of messages to send.
+        connections (int): Number of SMTP connections to send them over.
+        pipeline (int): Number of transactions each connection sends before
+            reading the replies.
+        size (int): Size of each message body, in bytes.
+
+    Returns:
+        float: Messages per second.
+    """
+    body = b"<<<%s>>>" % (b"x" * max(size - 6, 0),)
+    per_connection = [messages // connections] * connections
+    per_connection[0] += messages - sum(per_connection)
+
+    async def send_all():
+        await asyncio.gather(
+            *[
+                _send_benchmark_mail(sink.host, sink.port, count, pipeline, body)
+                for count in per_connection
+            ]
+        )
+
+    target = sink.delivered + messages
+    start = time.monotonic()
+    asyncio.run(send_all())
+    while sink.delivered < target:
+        time.sleep(0.001)
+    return messages / (time.monotonic() - start)
 
 
 if __name__ == "__main__":
-    ms = MailSink()
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Run the mail sink and print the first mail it gets, or benchmark it"
+        )
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--process",
+        action="store_true",
+        help="Run the SMTP server in a separate process",
+    )
+    parser.add_argument("--bench", action="store_true", help="Benchmark the sink")
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--pipeline", type=int, default=100)
+    parser.add_argument("--size", type=int, default=512)
+    args = parser.parse_args()
+
+    ms = MailSink(port=args.port, in_process=not args.process)
     ms.launch()
-    print("%r" % (ms.get_mail(),))
-    ms.tearDown()
+    try:
+        if args.bench:
+            rate = benchmark(
+                ms, args.messages, args.connections, args.pipeline, args.size
+            )
+            print(
+                "%d messages of %d bytes over %d connections: %.0f messages/s"
+                % (args.messages, args.size, args.connections, rate)
+            )
+        else:
+            while True:
+                try:
+                    print("%r" % (ms.wait_for_mail(timeout=60),))
+                    break
+                except Empty:
+                    pass
+    finally:
+        ms.tearDown()
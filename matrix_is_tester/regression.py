@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares benchmark results against a baseline, to catch endpoints that have
+got slower.
+"""
+
+import json
+
+# How much worse each metric may get, as a proportion of the baseline, before
+# it counts as a regression. Latencies may go up; throughput may go down.
+DEFAULT_TOLERANCES = {
+    "p50": 0.25,
+    "p95": 0.5,
+    "p99": 1.0,
+    "throughput": 0.25,
+    # Absolute rather than a proportion, as the baseline is usually 0
+    "error_rate": 0.01,
+}
+
+# Latency increases smaller than this, in seconds, are put down to noise
+DEFAULT_MIN_LATENCY_DELTA = 0.002
+
+_LATENCY_METRICS = ("p50", "p95", "p99")
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def parse_tolerance(spec):
+    """
+    Parse a tolerance given as METRIC=VALUE or ENDPOINT:METRIC=VALUE.
+
+    Returns:
+        tuple[str|None, str, float]: Endpoint (or None for all endpoints),
+            metric and tolerance.
+    """
+    name, _, value = spec.rpartition("=")
+    endpoint, _, metric = name.rpartition(":")
+    if metric not in DEFAULT_TOLERANCES:
+        raise ValueError("Unknown metric in tolerance %r: %s" % (spec, metric))
+    return endpoint or None, metric, float(value)
+
+
+def compare(
+    results,
+    baseline,
+    tolerances=None,
+    endpoint_tolerances=None,
+    min_latency_delta=DEFAULT_MIN_LATENCY_DELTA,
+):
+    """
+    Compare each endpoint's metrics in two sets of benchmark results.
+
+    Args:
+        results (dict): The results being checked, from
+            benchmarks.run_benchmarks.
+        baseline (dict): The results to compare against.
+        tolerances (dict[str, float]|None): Overrides for DEFAULT_TOLERANCES.
+        endpoint_tolerances (dict[str, dict[str, float]]|None): Overrides for
+            particular endpoints.
+        min_latency_delta (float): Latency increases below this many seconds
+            are never regressions.
+
+    Returns:
+        list[dict]: A row per endpoint and metric in the baseline, with the
+            baseline and current values, the change as a proportion of the
+            baseline and whether it counts as a regression. Endpoints in the
+            baseline that are missing from the results are regressions.
+    """
+    default = dict(DEFAULT_TOLERANCES)
+    default.update(tolerances or {})
+    endpoint_tolerances = endpoint_tolerances or {}
+
+    rows = []
+    for endpoint, expected in sorted(baseline["endpoints"].items()):
+        actual = results["endpoints"].get(endpoint)
+        if actual is None:
+            rows.append(
+                {
+                    "endpoint": endpoint,
+                    "metric": None,
+                    "baseline": None,
+                    "current": None,
+                    "change": None,
+                    "tolerance": None,
+                    "regressed": True,
+                }
+            )
+            continue
+
+        endpoint_tolerance = dict(default)
+        endpoint_tolerance.update(endpoint_tolerances.get(endpoint, {}))
+
+        for metric, tolerance in sorted(endpoint_tolerance.items()):
+            before = expected.get(metric)
+            after = actual.get(metric)
+            if before is None or after is None:
+                continue
+
+            change = (after - before) / before if before else None
+            if metric == "error_rate":
+                regressed = after - before > tolerance
+            elif metric == "throughput":
+                regressed = after < before * (1 - tolerance)
+            else:
+                regressed = (
+                    after > before * (1 + tolerance)
+                    and after - before >= min_latency_delta
+                )
+
+            rows.append(
+                {
+                    "endpoint": endpoint,
+                    "metric": metric,
+                    "baseline": before,
+                    "current": after,
+                    "change": change,
+                    "tolerance": tolerance,
+                    "regressed": regressed,
+                }
+            )
+    return rows
+
+
+def regressions(rows):
+    return [row for row in rows if row["regressed"]]
+
+
+def _format_value(metric, value):
+    if value is None:
+        return "-"
+    if metric in _LATENCY_METRICS:
+        return "%.1fms" % (value * 1000,)
+    if metric == "throughput":
+        return "%.1f/s" % (value,)
+    return "%.2f%%" % (value * 100,)
+
+
+def format_comparison(rows, only_regressions=False):
+    """
+    Format comparison rows as a table, marking regressions.
+    """
+    lines = [
+        "  %-32s %-11s %11s %11s %9s %9s"
+        % ("endpoint", "metric", "baseline", "current", "change", "allowed")
+    ]
+    for row in rows:
+        if only_regressions and not row["regressed"]:
+            continue
+        marker = "!" if row["regressed"] else " "
+        if row["metric"] is None:
+            lines.append("%s %-32s missing from results" % (marker, row["endpoint"]))
+            continue
+
+        change = "-" if row["change"] is None else "%+.1f%%" % (row["change"] * 100,)
+        if row["metric"] == "error_rate":
+            allowed = "+%.2f%%" % (row["tolerance"] * 100,)
+        elif row["metric"] == "throughput":
+            allowed = "-%.0f%%" % (row["tolerance"] * 100,)
+        else:
+            allowed = "+%.0f%%" % (row["tolerance"] * 100,)
+
+        lines.append(
+            "%s %-32s %-11s %11s %11s %9s %9s"
+            % (
+                marker,
+                row["endpoint"],
+                row["metric"],
+                _format_value(row["metric"], row["baseline"]),
+                _format_value(row["metric"], row["current"]),
+                change,
+                allowed,
+            )
+        )
+    return "\n".join(lines)
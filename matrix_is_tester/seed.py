@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Populates an identity server with many bound 3PIDs quickly.
+
+Each binding takes four steps: requestToken, waiting for the mail, submitToken
+and bind. These run as separate pipeline stages connected by bounded queues, so
+that many bindings are at different steps at once. If the mail sink falls
+behind, the stages before it stall rather than piling up more sessions.
+Bindings are journalled as they complete, so an interrupted run can be
+resumed.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from matrix_is_tester.async_is_api import AsyncIsApi, close_shared_client_sessions
+from matrix_is_tester.fakehs import hs_addr_list, server_name_for, token_for_user
+from matrix_is_tester.is_api import random_client_secret, token_from_mail
+from matrix_is_tester.load import LoadStats
+from matrix_is_tester.mailsink import MAIL_DELIVERY
+
+DEFAULT_IN_FLIGHT = 256
+DEFAULT_STAGE_WORKERS = 32
+DEFAULT_MAIL_SLOTS = 128
+
+
+def seed_address(prefix, index):
+    return "%s-%d@seed.test" % (prefix, index)
+
+
+def seed_user_id(prefix, index, server_name):
+    return "@%s-%d:%s" % (prefix, index, server_name)
+
+
+def read_journal(path):
+    """
+    Read the bindings recorded in a seeding journal.
+
+    Returns:
+        dict[int, tuple[str, str]]: Index to (address, mxid) of each binding.
+            Empty if the journal doesn't exist.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short when the last run was interrupted
+                continue
+            done[entry["index"]] = (entry["address"], entry["mxid"])
+    return done
+
+
+class _Item(object):
+    __slots__ = ("index", "address", "api", "mxid", "client_secret", "sid", "token")
+
+    def __init__(self, index, address, api, mxid):
+        self.index = index
+        self.address = address
+        self.api = api
+        self.mxid = mxid
+        self.client_secret = random_client_secret()
+        self.sid = None
+        self.token = None
+
+
+class Seeder(object):
+    """
+    Binds email addresses `<prefix>-<index>@seed.test` for a range of indices,
+    spreading them over a few accounts.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        mail_sink,
+        hs_addr,
+        prefix="seed",
+        accounts=10,
+        journal=None,
+        in_flight=DEFAULT_IN_FLIGHT,
+        stage_workers=DEFAULT_STAGE_WORKERS,
+        mail_slots=DEFAULT_MAIL_SLOTS,
+        mail_timeout=None,
+    ):
+        """
+        Args:
+            base_url (str): The base URL of the IS to seed.
+            mail_sink (MailSink): The mail sink the IS sends its mail to.
+            hs_addr (tuple|list[tuple]): Host, port of the fake homeserver,
+                or a list of them to spread the accounts over.
+            prefix (str): Prefix of the addresses and user IDs to bind, so that
+                different datasets don't overlap.
+            accounts (int): Number of accounts to bind the addresses to.
+            journal (str|None): File to record each binding in as it
+                completes. Bindings already in it are skipped.
+            in_flight (int): Most bindings to have in progress at once.
+            stage_workers (int): Requests each HTTP stage sends in parallel.
+            mail_slots (int): Most sessions to have waiting for their mail at
+                once. If the mail sink falls behind, the earlier stages stall
+                once this many are waiting.
+            mail_timeout (float|None): Seconds to wait for each mail. Defaults
+                to the mail sink's timeout.
+        """
+        self.base_url = base_url
+        self.mail_sink = mail_sink
+        self.hs_addrs = hs_addr_list(hs_addr)
+        self.prefix = prefix
+        self.accounts = accounts
+        self.journal = journal
+        self.in_flight = in_flight
+        self.stage_workers = stage_workers
+        self.mail_slots = mail_slots
+        self.mail_timeout = mail_timeout
+
+        self.stats = LoadStats()
+        self.bound = 0
+        self.failed = 0
+        self.results = {}
+        self._journal_file = None
+
+    async def _make_apis(self):
+        apis = []
+        for i in range(self.accounts):
+            api = AsyncIsApi(self.base_url, "v2", self.mail_sink)
+            hs_addr = self.hs_addrs[i % len(self.hs_addrs)]
+            mxid = seed_user_id(self.prefix, i, server_name_for(hs_addr))
+            # Registering again for a user that already has an account just
+            # gives another token, so this also works when resuming.
+            await api.make_account(hs_addr, token_for_user(mxid))
+            apis.append((api, mxid))
+        return apis
+
+    async def _request_stage(self, item):
+        body = await self.stats.call(
+            "/validate/email/requestToken",
+            item.api.request_email_code(item.address, item.client_secret, 1),
+        )
+        item.sid = body["sid"]
+
+    async def _mail_stage(self, item):
+        mail = await self.stats.call(
+            MAIL_DELIVERY,
+            self.mail_sink.async_wait_for_mail(
+                to=item.address, timeout=self.mail_timeout
+            ),
+            wait=True,
+        )
+        item.token = token_from_mail(mail)
+
+    async def _submit_stage(self, item):
+        body = await self.stats.call(
+            "/validate/email/submitToken",
+            item.api.submit_email_token(item.sid, item.client_secret, item.token),
+        )
+        if not body.get("success"):
+            raise Exception("Submit token failed: %r" % (body,))
+
+    async def _bind_stage(self, item):
+        body = await self.stats.call(
+            "/3pid/bind", item.api.bind_email(item.sid, item.client_secret, item.mxid)
+        )
+        if body.get("mxid") != item.mxid:
+            raise Exception("Bind failed: %r" % (body,))
+
+    async def _run_stage(self, stage, inbox, outbox, done):
+        while True:
+            item = await inbox.get()
+            try:
+                await stage(item)
+            except Exception:
+                # Failed requests are recorded by LoadStats. The binding is
+                # left out of the journal, so a resumed run tries it again.
+                self.failed += 1
+                done.release()
+            else:
+                if outbox is not None:
+                    await outbox.put(item)
+                else:
+                    self._record(item)
+                    done.release()
+            finally:
+                inbox.task_done()
+
+    def _record(self, item):
+        self.bound += 1
+        self.results[item.index] = (item.address, item.mxid)
+        if self._journal_file is not None:
+            self._journal_file.write(
+                json.dumps(
+                    {"index": item.index, "address": item.address, "mxid": item.mxid}
+                )
+                + "\n"
+            )
+
+    async def run(self, count, on_progress=None, progress_interval=5):
+        """
+        Bind addresses for indices 0 to count - 1 that aren't already in the
+        journal.
+
+        Args:
+            count (int): Size of the dataset.
+            on_progress (callable|None): Called every progress_interval
+                seconds with a progress report.
+            progress_interval (float): Seconds between progress reports.
+
+        Returns:
+            dict: A report of the run: how many were bound, skipped and
+                failed, the rate, and per-stage latency as for
+                LoadStats.report. Its 'bindings' are the (address, mxid) of
+                every binding in the dataset that has been made, including by
+                earlier runs.
+        """
+        self.results = read_journal(self.journal) if self.journal else {}
+        skipped = len(self.results)
+        todo = [i for i in range(count) if i not in self.results]
+
+        self._journal_file = None
+        if self.journal:
+            self._journal_file = open(self.journal, "a", buffering=1)
+
+        tasks = []
+        try:
+            apis = await self._make_apis()
+
+            self.stats.start = time.monotonic()
+            done = asyncio.Semaphore(self.in_flight)
+            stages = [
+                (self._request_stage, self.stage_workers),
+                (self._mail_stage, self.mail_slots),
+                (self._submit_stage, self.stage_workers),
+                (self._bind_stage, self.stage_workers),
+            ]
+            queues = [asyncio.Queue(maxsize=workers) for _, workers in stages]
+            for i, (stage, workers) in enumerate(stages):
+                outbox = queues[i + 1] if i + 1 < len(queues) else None
+                for _ in range(workers):
+                    tasks.append(
+                        asyncio.ensure_future(
+                            self._run_stage(stage, queues[i], outbox, done)
+                        )
+                    )
+
+            if on_progress is not None:
+                tasks.append(
+                    asyncio.ensure_future(
+                        self._report_progress(
+                            on_progress, progress_interval, len(todo), queues
+                        )
+                    )
+                )
+
+            for index in todo:
+                await done.acquire()
+                api, mxid = apis[index % len(apis)]
+                address = seed_address(self.prefix, index)
+                await queues[0].put(_Item(index, address, api, mxid))
+
+            # Each stage has passed everything on once its queue is drained
+            for queue in queues:
+                await queue.join()
+            self.stats.end = time.monotonic()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._journal_file is not None:
+                self._journal_file.close()
+            await close_shared_client_sessions()
+
+        report = self.stats.report()
+        return {
+            "count": count,
+            "skipped": skipped,
+            "bound": self.bound,
+            "failed": self.failed,
+            "duration": report["duration"],
+            "rate": self.bound / report["duration"],
+            "errors": report["errors"],
+            "endpoints": report["endpoints"],
+            "waits": report["waits"],
+            "bindings": [self.results[i] for i in sorted(self.results)],
+        }
+
+    async def _report_progress(self, on_progress, interval, total, queues):
+        while True:
+            await asyncio.sleep(interval)
+            elapsed = time.monotonic() - self.stats.start
+            on_progress(
+                {
+                    "elapsed": elapsed,
+                    "bound": self.bound,
+                    "failed": self.failed,
+                    "remaining": total - self.bound - self.failed,
+                    "rate": self.bound / elapsed,
+                    "queued": [queue.qsize() for queue in queues],
+                }
+            )
+
+
+def format_progress(progress):
+    return "%6.0fs: %d bound (%.1f/s), %d failed, %d remaining, queued %s" % (
+        progress["elapsed"],
+        progress["bound"],
+        progress["rate"],
+        progress["failed"],
+        progress["remaining"],
+        "/".join(str(size) for size in progress["queued"]),
+    )
+
+
+def format_report(report):
+    lines = [
+        "bound %d of %d in %.1fs (%.1f/s), %d already done, %d failed"
+        % (
+            report["bound"],
+            report["count"],
+            report["duration"],
+            report["rate"],
+            report["skipped"],
+            report["failed"],
+        ),
+        "",
+        "%-40s %8s %9s %9s %9s" % ("stage", "requests", "p50 ms", "p95 ms", "p99 ms"),
+    ]
+    stages = list(report["endpoints"].items()) + list(report["waits"].items())
+    for endpoint, stats in stages:
+        lines.append(
+            "%-40s %8d %9.1f %9.1f %9.1f"
+            % (
+                endpoint,
+                stats["requests"],
+                stats["p50"] * 1000,
+                stats["p95"] * 1000,
+                stats["p99"] * 1000,
+            )
+        )
+    if report["errors"]:
+        lines.append("")
+        lines.append("errors:")
+        for errcode, count in sorted(report["errors"].items()):
+            lines.append("  %-38s %d" % (errcode, count))
+    return "\n".join(lines)
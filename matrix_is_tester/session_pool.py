@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.poolmanager import PoolManager
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 10
+
+_shared_sessions = {}
+_shared_sessions_lock = threading.Lock()
+
+
+class ConnectionStats(object):
+    """
+    Counts the TCP connections opened by a session against the number of
+    requests it has sent, so that connection reuse can be checked.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.requests = 0
+
+    @property
+    def reused(self):
+        """
+        The number of requests that were sent over an already open connection.
+        """
+        return max(self.requests - self.opened, 0)
+
+    def _count_opened(self):
+        with self._lock:
+            self.opened += 1
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def __repr__(self):
+        return "ConnectionStats(opened=%d, reused=%d, requests=%d)" % (
+            self.opened,
+            self.reused,
+            self.requests,
+        )
+
+
+class _CountingHTTPConnection(HTTPConnection):
+    stats = None
+
+    def connect(self):
+        if self.stats is not None:
+            self.stats._count_opened()
+        super(_CountingHTTPConnection, self).connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    stats = None
+
+    def connect(self):
+        if self.stats is not None:
+            self.stats._count_opened()
+        super(_CountingHTTPSConnection, self).connect()
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+    stats = None
+
+    def _new_conn(self):
+        conn = super(_CountingHTTPConnectionPool, self)._new_conn()
+        conn.stats = self.stats
+        return conn
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+    stats = None
+
+    def _new_conn(self):
+        conn = super(_CountingHTTPSConnectionPool, self)._new_conn()
+        conn.stats = self.stats
+        return conn
+
+
+class _CountingPoolManager(PoolManager):
+    def __init__(self, stats, *args, **kwargs):
+        super(_CountingPoolManager, self).__init__(*args, **kwargs)
+        self.stats = stats
+        self.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super(_CountingPoolManager, self)._new_pool(
+            scheme, host, port, request_context
+        )
+        pool.stats = self.stats
+        return pool
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    def __init__(self, stats, **kwargs):
+        # init_poolmanager is called from HTTPAdapter's constructor, so this
+        # has to be set first.
+        self.stats = stats
+        super(_CountingHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+
+        self.poolmanager = _CountingPoolManager(
+            self.stats,
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            **pool_kwargs
+        )
+
+    def send(self, request, **kwargs):
+        self.stats._count_request()
+        return super(_CountingHTTPAdapter, self).send(request, **kwargs)
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE, max_retries=0, retry_backoff=0.1):
+    """
+    Make a requests session that keeps connections alive and counts how
+    often it opens a new one.
+
+    Args:
+        pool_size (int): The maximum number of connections to keep open to
+            each host.
+        max_retries (int): How many times to retry a request that failed to
+            connect or got no response. Requests that reached the server are
+            never retried.
+        retry_backoff (float): Backoff factor between retries, in seconds.
+
+    Returns:
+        requests.Session: The session. Its connection counters are available
+            as its `connection_stats` attribute.
+    """
+    stats = ConnectionStats()
+    retries = Retry(
+        total=max_retries,
+        read=False,
+        status=False,
+        backoff_factor=retry_backoff,
+        raise_on_status=False,
+    )
+    adapter = _CountingHTTPAdapter(
+        stats,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retries,
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.connection_stats = stats
+    return session
+
+
+def get_shared_session(base_url, pool_size=DEFAULT_POOL_SIZE, max_retries=0):
+    """
+    Get the session shared by all API clients talking to the given base URL
+    with the given pool settings, making it if necessary.
+    """
+    key = (base_url, pool_size, max_retries)
+    with _shared_sessions_lock:
+        if key not in _shared_sessions:
+            _shared_sessions[key] = make_session(pool_size, max_retries)
+        return _shared_sessions[key]
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs the load scenarios against one identity server for hours, summarising
+each time window separately and sampling the server process's memory and file
+descriptors, to catch leaks and gradual slowdowns.
+"""
+
+import asyncio
+import os
+import time
+
+from matrix_is_tester.async_is_api import close_shared_client_sessions
+from matrix_is_tester.instrumentation import percentile
+from matrix_is_tester.load import SCENARIOS, LoadContext, LoadStats, _run_iteration
+
+
+def sample_process(pid):
+    """
+    Read a process's resident memory and open file descriptors from /proc.
+
+    Returns:
+        dict|None: 'rss' in bytes and 'fds', or None if the process can't be
+            inspected (eg. it isn't on this machine, or /proc isn't available).
+    """
+    try:
+        with open("/proc/%d/status" % (pid,)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                    break
+            else:
+                return None
+        fds = len(os.listdir("/proc/%d/fd" % (pid,)))
+    except OSError:
+        return None
+    return {"rss": rss, "fds": fds}
+
+
+def _is_growing(values, threshold):
+    # Never goes down, and ends up more than threshold higher than it started
+    never_shrinks = all(b >= a for a, b in zip(values, values[1:]))
+    return never_shrinks and values[-1] > values[0] * (1 + threshold)
+
+
+def analyse_windows(
+    windows,
+    drift_threshold=0.5,
+    growth_threshold=0.1,
+    warmup_windows=1,
+    min_windows=4,
+):
+    """
+    Look for signs of degradation across soak windows.
+
+    Args:
+        windows (list[dict]): Window reports, as made by run_soak.
+        drift_threshold (float): How much a p95 latency may grow between the
+            first and last window, as a proportion, before it is flagged.
+        growth_threshold (float): How much the memory or file descriptors of
+            the IS may grow, as a proportion, before growth in every window
+            is flagged. The IS is expected to grow a little as it stores
+            more sessions and bindings.
+        warmup_windows (int): Windows to ignore at the start while caches
+            fill and connections are opened.
+        min_windows (int): Windows needed after the warm-up before growth
+            is judged.
+
+    Returns:
+        list[str]: Description of each problem found.
+    """
+    windows = windows[warmup_windows:]
+    if len(windows) < min_windows:
+        return []
+
+    flags = []
+    for metric in ("rss", "fds"):
+        values = [w["process"][metric] for w in windows if w.get("process")]
+        if len(values) == len(windows) and _is_growing(values, growth_threshold):
+            flags.append(
+                "%s grew in every window, from %d to %d"
+                % (metric, values[0], values[-1])
+            )
+
+    first, last = windows[0]["endpoints"], windows[-1]["endpoints"]
+    for endpoint in sorted(set(first) & set(last)):
+        before = first[endpoint]["p95"]
+        after = last[endpoint]["p95"]
+        if before and after > before * (1 + drift_threshold):
+            flags.append(
+                "%s p95 latency drifted from %.1fms to %.1fms"
+                % (endpoint, before * 1000, after * 1000)
+            )
+    return flags
+
+
+def _window_report(stats, index, pid):
+    report = stats.report()
+    report["window"] = index
+    report["process"] = sample_process(pid) if pid is not None else None
+
+    # Overall latency, for an at-a-glance trend
+    latencies = sorted(stats.request_latencies())
+    report["p50"] = percentile(latencies, 50)
+    report["p95"] = percentile(latencies, 95)
+    report["p99"] = percentile(latencies, 99)
+    return report
+
+
+async def run_soak(
+    base_url,
+    mail_sink,
+    hs_addr,
+    scenarios,
+    duration,
+    window=60,
+    concurrency=10,
+    accounts=10,
+    pid=None,
+    drift_threshold=0.5,
+    on_window=None,
+):
+    """
+    Run weighted scenarios against an identity server, reporting on each
+    window of time separately.
+
+    Args:
+        base_url (str): The base URL of the IS to soak.
+        mail_sink (MailSink): The mail sink the IS sends its mail to.
+        hs_addr (tuple|list[tuple]): Host, port of the fake homeserver, or a
+            list of them to spread the accounts over.
+        scenarios (dict[str, float]): Scenario name to relative weight.
+        duration (float): How long to run for, in seconds.
+        window (float): Length of each window, in seconds.
+        concurrency (int): Scenarios to run back-to-back in parallel.
+        accounts (int): Accounts to register up front and share.
+        pid (int|None): The IS's process ID, to sample its memory and file
+            descriptors at the end of each window.
+        drift_threshold (float): See analyse_windows.
+        on_window (callable|None): Called with each window's report as soon
+            as the window ends.
+
+    Returns:
+        dict: 'windows', a list of window reports like LoadStats.report with
+            the process sample added, and 'flags', as from analyse_windows.
+    """
+    for name in scenarios:
+        if name not in SCENARIOS:
+            raise Exception("Unknown scenario: %s" % (name,))
+    if accounts < 1:
+        raise ValueError("Need at least one account, not %d" % (accounts,))
+    names = list(scenarios.keys())
+    weights = [scenarios[name] for name in names]
+
+    ctx = LoadContext(base_url, mail_sink, hs_addr, LoadStats())
+    windows = []
+    try:
+        ctx.accounts = await asyncio.gather(
+            *[ctx.new_account() for _ in range(accounts)]
+        )
+
+        start = time.monotonic()
+        deadline = start + duration
+        ctx.stats = LoadStats()
+        ctx.stats.start = start
+
+        async def worker():
+            while time.monotonic() < deadline:
+                await _run_iteration(ctx, names, weights)
+
+        workers = asyncio.gather(*[worker() for _ in range(concurrency)])
+
+        window_end = start
+        while window_end < deadline:
+            window_end = min(window_end + window, deadline)
+            await asyncio.sleep(max(window_end - time.monotonic(), 0))
+
+            # Requests in flight now are recorded against the window they
+            # started in after it has been reported, so are left out.
+            stats, ctx.stats = ctx.stats, LoadStats()
+            stats.end = ctx.stats.start = time.monotonic()
+            report = _window_report(stats, len(windows), pid)
+            windows.append(report)
+            if on_window is not None:
+                on_window(report)
+
+        await workers
+    finally:
+        await close_shared_client_sessions()
+
+    return {
+        "windows": windows,
+        "flags": analyse_windows(windows, drift_threshold=drift_threshold),
+    }
+
+
+def format_window(report):
+    line = "window %3d: %8d requests %9.1f req/s  p50 %7.1fms  p95 %7.1fms" % (
+        report["window"],
+        report["requests"],
+        report["throughput"],
+        (report["p50"] or 0) * 1000,
+        (report["p95"] or 0) * 1000,
+    )
+    if report["errors"]:
+        line += "  errors %d" % (sum(report["errors"].values()),)
+    if report["process"]:
+        line += "  rss %.1fMiB  fds %d" % (
+            report["process"]["rss"] / 1048576.0,
+            report["process"]["fds"],
+        )
+    return line
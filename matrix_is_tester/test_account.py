@@ -31,13 +31,12 @@ class AccountTest(unittest.TestCase):
     def test_account(self):
         base_url = get_or_launch_is(False)
         api = IsApi(base_url, "v2", None)
-        api.make_account(
-            self.fakeHsAddr, token_for_user("@jimmy_account_test:127.0.0.1:4490")
-        )
+        user_id = "@jimmy_account_test:%s" % (self.fakeHs.get_server_name(),)
+        api.make_account(self.fakeHsAddr, token_for_user(user_id))
 
         body = api.account()
 
-        self.assertEqual(body["user_id"], "@jimmy_account_test:127.0.0.1:4490")
+        self.assertEqual(body["user_id"], user_id)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from matrix_is_tester.account_pool import AccountPool, get_test_account_pool
+from matrix_is_tester.fakehs import get_shared_fake_hs
+from matrix_is_tester.is_api import IsApi
+from matrix_is_tester.launch_is import (
+    get_launcher_pool,
+    get_or_launch_is,
+    reset_is,
+    supports_snapshots,
+)
+
+
+class AccountPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.fakeHsAddr = get_shared_fake_hs().get_addr()
+
+    def make_pool(self, with_terms=False, **kwargs):
+        base_url = get_or_launch_is(with_terms)
+        pool = AccountPool(base_url, self.fakeHsAddr, accept_terms=with_terms, **kwargs)
+        self.addCleanup(pool.close)
+        return pool, IsApi(base_url, "v2", None)
+
+    def test_lease_and_release(self):
+        # No background refill to race the counts
+        pool, api = self.make_pool(size=2, low_water=0)
+        pool.fill()
+
+        account = pool.lease()
+        api.use_account(account)
+        self.assertEqual(api.account()["user_id"], account.user_id)
+        pool.release(account)
+
+        leased = [pool.lease(), pool.lease()]
+        self.assertIn(account, leased)
+        stats = pool.stats()
+        self.assertEqual(stats["registered"], 2)
+        self.assertEqual(stats["reused"], 3)
+
+    def test_logged_out_accounts_are_dropped(self):
+        pool, api = self.make_pool(size=1, low_water=0)
+        pool.fill()
+
+        account = pool.lease()
+        api.use_account(account)
+        api.logout()
+        self.assertTrue(account.logged_out)
+        pool.release(account)
+
+        self.assertEqual(pool.stats()["logged_out"], 1)
+        self.assertNotEqual(pool.lease(), account)
+
+    def test_refill(self):
+        pool, _ = self.make_pool(size=4, low_water=3)
+        pool.fill()
+
+        pool.lease()
+        pool.lease()
+        self.assertTrue(pool.wait_until_full(30))
+        self.assertEqual(pool.stats()["registered"], 6)
+
+    def test_accept_terms(self):
+        pool, api = self.make_pool(with_terms=True, size=1)
+
+        api.use_account(pool.lease())
+        self.assertIsNone(api.check_terms_signed())
+
+    def test_test_pool_survives_reset(self):
+        if not supports_snapshots(get_launcher_pool().get(False)):
+            raise unittest.SkipTest("Launcher doesn't support snapshots")
+
+        pool = get_test_account_pool()
+        account = pool.lease()
+        api = IsApi(reset_is(), "v2", None)
+        api.use_account(account)
+        api.logout()
+        pool.release(account)
+
+        # Resetting the IS brings the logged out account back
+        api = IsApi(reset_is(), "v2", None)
+        api.use_account(account)
+        self.assertEqual(api.account()["user_id"], account.user_id)
+        self.assertFalse(account.logged_out)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
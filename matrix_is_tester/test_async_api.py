@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+
+from matrix_is_tester.fakehs import get_shared_fake_hs
+from matrix_is_tester.launch_is import get_or_launch_is
+
+try:
+    from matrix_is_tester.async_is_api import AsyncIsApi, close_shared_client_sessions
+except ImportError:
+    AsyncIsApi = None
+
+
+@unittest.skipIf(AsyncIsApi is None, "aiohttp is not installed")
+class AsyncApiTest(unittest.TestCase):
+    def setUp(self):
+        self.baseUrl = get_or_launch_is(False)
+        self.fakeHsAddr = get_shared_fake_hs().get_addr()
+
+    def _run(self, coro):
+        async def run_and_close():
+            try:
+                return await coro
+            finally:
+                await close_shared_client_sessions()
+
+        return asyncio.run(run_and_close())
+
+    def test_ping(self):
+        api = AsyncIsApi(self.baseUrl, "v2", None)
+        body = self._run(api.ping())
+        self.assertEqual(body, {})
+
+    def test_concurrent_accounts(self):
+        async def make_accounts():
+            apis = [AsyncIsApi(self.baseUrl, "v2", None) for _ in range(20)]
+            await asyncio.gather(*[api.make_account(self.fakeHsAddr) for api in apis])
+            return await asyncio.gather(*[api.account() for api in apis])
+
+        bodies = self._run(make_accounts())
+
+        self.assertEqual(len(bodies), 20)
+        user_ids = set(body["user_id"] for body in bodies)
+        self.assertEqual(len(user_ids), 20)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+import unittest
+
+from twisted.python import log
+
+from matrix_is_tester.is_api import lookup_hashes
+
+try:
+    from matrix_is_tester.bench_lookup import LookupDataset, run_benchmark, run_lookups
+except ImportError:
+    LookupDataset = None
+
+BOUND = [
+    ("bound%d@example.com" % (i,), "@user%d:example.com" % (i,)) for i in range(10)
+]
+
+
+class _FakeLookupApi(object):
+    """
+    Answers lookups with a fixed sequence of outcomes, and remembers the
+    concurrency each lookup was allowed.
+    """
+
+    def __init__(self, outcomes, lookup_concurrency):
+        self.lookup_concurrency = lookup_concurrency
+        self.concurrencies = []
+        self._outcomes = list(outcomes)
+        self._lock = threading.Lock()
+
+    def hashed_lookup(
+        self, addresses, alg, pepper, stream=False, chunk_size=None, concurrency=None
+    ):
+        with self._lock:
+            self.concurrencies.append(concurrency)
+            outcome = self._outcomes.pop()
+        if outcome == "raise":
+            raise ValueError("Bad response")
+        if outcome == "error":
+            return {"errcode": "M_UNKNOWN"}
+        mappings = {}
+        for address in addresses:
+            if address.startswith("bound"):
+                mappings[address] = "@user%s:example.com" % (address[5],)
+        if outcome == "wrong":
+            mappings = {}
+        return {"mappings": mappings}
+
+    def reset_lookup_chunk_stats(self):
+        pass
+
+    def lookup_chunk_stats(self):
+        return {}
+
+
+@unittest.skipIf(LookupDataset is None, "aiohttp is not installed")
+class LookupDatasetTest(unittest.TestCase):
+    def test_hit_ratio(self):
+        dataset = LookupDataset(BOUND)
+
+        for size, ratio, hits in ((8, 0.5, 4), (8, 0.0, 0), (8, 1.0, 8), (3, 0.5, 2)):
+            batch = dataset.batch(size, ratio)
+            self.assertEqual(len(batch), size)
+            self.assertEqual(sum(1 for _, mxid in batch if mxid is not None), hits)
+            self.assertEqual(len(set(address for address, _ in batch)), size)
+
+    def test_hits_limited_by_dataset(self):
+        batch = LookupDataset(BOUND).batch(30, 1.0)
+
+        self.assertEqual(len(batch), 30)
+        self.assertEqual(sum(1 for _, mxid in batch if mxid is not None), 10)
+
+    def test_same_seed_same_batches(self):
+        first = LookupDataset(BOUND, seed=3)
+        second = LookupDataset(BOUND, seed=3)
+
+        for _ in range(3):
+            self.assertEqual(first.batch(6, 0.5), second.batch(6, 0.5))
+
+    def test_query(self):
+        dataset = LookupDataset(BOUND)
+        entries = [BOUND[0], ("miss@example.com", None)]
+
+        addresses, expected = dataset.query(entries, "none", "pepper")
+        self.assertEqual(
+            addresses, ["bound0@example.com email", "miss@example.com email"]
+        )
+        self.assertEqual(expected, {"bound0@example.com email": BOUND[0][1]})
+
+        addresses, expected = dataset.query(entries, "sha256", "pepper")
+        hashes = lookup_hashes(
+            [("email", "bound0@example.com"), ("email", "miss@example.com")],
+            "pepper",
+        )
+        self.assertEqual(addresses, hashes)
+        self.assertEqual(expected, {hashes[0]: BOUND[0][1]})
+
+
+@unittest.skipIf(LookupDataset is None, "aiohttp is not installed")
+class RunLookupsTest(unittest.TestCase):
+    def test_result_counts(self):
+        outcomes = ["ok"] * 5 + ["error"] * 2 + ["raise"] + ["wrong"] * 2
+        api = _FakeLookupApi(outcomes, lookup_concurrency=8)
+
+        result = run_lookups(api, LookupDataset(BOUND), 4, "none", 0.5, "pepper", 10, 2)
+
+        self.assertEqual(result["requests"], 10)
+        self.assertEqual(result["errors"], {"M_UNKNOWN": 2, "ValueError": 1})
+        self.assertEqual(result["wrong_mappings"], 2)
+        self.assertIsNone(result["chunk_latency"])
+
+    def test_chunks_share_connections(self):
+        api = _FakeLookupApi(["ok"] * 6, lookup_concurrency=8)
+
+        result = run_lookups(
+            api, LookupDataset(BOUND), 4, "none", 0.5, "pepper", 6, 3, chunk_size=2
+        )
+
+        self.assertEqual(result["chunk_concurrency"], 2)
+        self.assertEqual(api.concurrencies, [2] * 6)
+
+        api = _FakeLookupApi(["ok"] * 6, lookup_concurrency=2)
+        run_lookups(
+            api, LookupDataset(BOUND), 4, "none", 0.5, "pepper", 6, 3, chunk_size=2
+        )
+        self.assertEqual(api.concurrencies, [1] * 6)
+
+
+@unittest.skipIf(LookupDataset is None, "aiohttp is not installed")
+class BenchLookupTest(unittest.TestCase):
+    def setUp(self):
+        from matrix_is_tester.fakehs import get_shared_fake_hs
+        from matrix_is_tester.launch_is import get_or_launch_is
+
+        self.baseUrl = get_or_launch_is(False)
+        self.fakeHsAddr = get_shared_fake_hs().get_addr()
+
+    def test_small_dataset(self):
+        from matrix_is_tester.mailsink import get_shared_mailsink
+
+        report = run_benchmark(
+            self.baseUrl,
+            get_shared_mailsink(),
+            self.fakeHsAddr,
+            6,
+            batch_sizes=(5,),
+            hit_ratios=(0.0, 0.6),
+            requests=4,
+            concurrency=2,
+            seed_concurrency=4,
+            chunk_size=2,
+        )
+
+        self.assertEqual(report["dataset"]["seeded"], 6)
+        self.assertEqual(len(report["results"]), 4)
+        for result in report["results"]:
+            self.assertEqual(result["requests"], 4)
+            self.assertEqual(result["errors"], {})
+            self.assertEqual(result["wrong_mappings"], 0)
+            self.assertEqual(result["chunk_concurrency"], 1)
+            self.assertEqual(sorted(result["chunk_latency"]), [1, 2])
+
+
+if __name__ == "__main__":
+    log.startLogging(sys.stdout)
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import unittest
+
+from matrix_is_tester.benchmarks import format_results, run_benchmarks
+from matrix_is_tester.fakehs import get_shared_fake_hs
+from matrix_is_tester.launch_is import get_or_launch_is
+from matrix_is_tester.mailsink import get_shared_mailsink
+from matrix_is_tester.regression import (
+    compare,
+    format_comparison,
+    load_results,
+    parse_tolerance,
+    regressions,
+)
+
+BASELINE_ENV = "MATRIX_IS_TESTER_BASELINE"
+RESULTS_ENV = "MATRIX_IS_TESTER_BENCH_RESULTS"
+REQUESTS_ENV = "MATRIX_IS_TESTER_BENCH_REQUESTS"
+
+
+def _results(**endpoints):
+    return {"endpoints": endpoints}
+
+
+def _stats(p50=0.01, p95=0.02, p99=0.03, throughput=100.0, error_rate=0.0):
+    return {
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "throughput": throughput,
+        "error_rate": error_rate,
+    }
+
+
+class RegressionTest(unittest.TestCase):
+    def test_parse_tolerance(self):
+        self.assertEqual(parse_tolerance("p95=0.3"), (None, "p95", 0.3))
+        self.assertEqual(
+            parse_tolerance("/3pid/bind:throughput=0.5"),
+            ("/3pid/bind", "throughput", 0.5),
+        )
+        with self.assertRaises(ValueError):
+            parse_tolerance("p42=0.1")
+
+    def test_compare(self):
+        baseline = _results(lookup=_stats(), ping=_stats(p50=0.001), bind=_stats())
+        results = _results(
+            # p95 over its tolerance, but p99 within its wider one
+            lookup=_stats(p95=0.04, p99=0.045),
+            # p50 doubled, but by less than the noise floor
+            ping=_stats(p50=0.002, throughput=60.0),
+        )
+
+        failed = regressions(compare(results, baseline))
+        self.assertEqual(
+            sorted((row["endpoint"], row["metric"]) for row in failed),
+            [("bind", None), ("lookup", "p95"), ("ping", "throughput")],
+        )
+
+        # Endpoint tolerances override the defaults
+        failed = regressions(
+            compare(
+                results,
+                baseline,
+                tolerances={"throughput": 0.5},
+                endpoint_tolerances={"lookup": {"p95": 1.5}},
+            )
+        )
+        self.assertEqual([row["endpoint"] for row in failed], ["bind"])
+
+    def test_format_results(self):
+        stats = _stats()
+        stats["requests"] = 200
+        lines = format_results(_results(lookup=stats)).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(
+            lines[1].split(), ["lookup", "200", "100.0", "0.0%", "10.0", "20.0", "30.0"]
+        )
+
+
+@unittest.skipUnless(
+    os.environ.get(BASELINE_ENV), "%s is not set to a baseline file" % (BASELINE_ENV,)
+)
+class BenchmarkRegressionTest(unittest.TestCase):
+    def test_no_regressions(self):
+        base_url = get_or_launch_is()
+        results = run_benchmarks(
+            base_url,
+            get_shared_mailsink(),
+            get_shared_fake_hs().get_addr(),
+            requests=int(os.environ.get(REQUESTS_ENV, 200)),
+        )
+        if os.environ.get(RESULTS_ENV):
+            with open(os.environ[RESULTS_ENV], "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        failed = regressions(compare(results, load_results(os.environ[BASELINE_ENV])))
+        if failed:
+            self.fail("Regressions against baseline:\n" + format_comparison(failed))
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
@@ -33,11 +33,12 @@ class AccountTest(unittest.TestCase):
     def test_bind_notYourMxid(self):
         base_url = get_or_launch_is(False)
         api = IsApi(base_url, "v2", self.mail_sink)
-        api.make_account(self.fake_hs_addr, token_for_user("@bob:127.0.0.1:4490"))
+        server_name = self.fake_hs.get_server_name()
+        api.make_account(self.fake_hs_addr, token_for_user("@bob:%s" % (server_name,)))
 
         params = api.request_and_submit_email_code("perfectly_valid_email@nowhere.test")
         body = api.bind_email(
-            params["sid"], params["client_secret"], "@alice:127.0.0.1:4490"
+            params["sid"], params["client_secret"], "@alice:%s" % (server_name,)
         )
         self.assertEquals(body["errcode"], "M_UNAUTHORIZED")
 
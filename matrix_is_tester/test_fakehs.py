@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import ssl
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from six.moves import http_client
+
+from matrix_is_tester.fakehs import (
+    ENDPOINTS,
+    FakeHomeserver,
+    FakeHomeserverPool,
+    sample_latency,
+    token_for_user,
+    validate_behaviour,
+)
+from matrix_is_tester.is_api import IsApi
+from matrix_is_tester.launch_is import get_or_launch_is
+from matrix_is_tester.mailsink import get_shared_mailsink
+
+
+def _fixed(value):
+    return {"distribution": "fixed", "value": value}
+
+
+class BehaviourTest(unittest.TestCase):
+    def test_defaults(self):
+        behaviour = validate_behaviour({"userinfo": {"error_rate": 0.5}})
+        self.assertEqual(set(behaviour), set(ENDPOINTS))
+        self.assertEqual(behaviour["userinfo"]["error_rate"], 0.5)
+        self.assertEqual(behaviour["userinfo"]["error_status"], 500)
+        self.assertIsNone(behaviour["version"]["latency"])
+
+    def test_invalid(self):
+        for behaviour in (
+            {"nonexistent": {}},
+            {"userinfo": {"error_rate": 1.5}},
+            {"userinfo": {"error_status": 200}},
+            {"userinfo": {"max_concurrency": 0}},
+            {"userinfo": {"latency": {"distribution": "gamma"}}},
+            {"userinfo": {"latency": {"distribution": "uniform", "min": 1}}},
+            {"userinfo": {"latency": {"distribution": "fixed", "value": -1}}},
+        ):
+            with self.assertRaises(ValueError, msg=repr(behaviour)):
+                validate_behaviour(behaviour)
+
+    def test_sample_latency(self):
+        self.assertEqual(sample_latency(None), 0)
+        self.assertEqual(sample_latency(_fixed(0.25)), 0.25)
+        for _ in range(100):
+            latency = sample_latency({"distribution": "uniform", "min": 1, "max": 2})
+            self.assertTrue(1 <= latency <= 2)
+            # Can't go negative, however wide the distribution
+            latency = sample_latency({"distribution": "normal", "mean": 0, "stddev": 1})
+            self.assertGreaterEqual(latency, 0)
+
+
+class FakeHomeserverTest(unittest.TestCase):
+    def setUp(self):
+        self.fake_hs = FakeHomeserver(port=0, workers=2)
+        self.fake_hs.launch()
+
+    def tearDown(self):
+        self.fake_hs.tearDown()
+
+    def _request(self, method, path, body=None):
+        # Don't verify the fake homeserver's self-signed certificate
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+        host, port = self.fake_hs.get_addr()
+        conn = http_client.HTTPSConnection(host, port, context=context)
+        try:
+            conn.request(method, path, body=None if body is None else json.dumps(body))
+            resp = conn.getresponse()
+            return resp.status, json.loads(resp.read())
+        finally:
+            conn.close()
+
+    def _userinfo(self, _=None):
+        return self._request(
+            "GET",
+            ENDPOINTS["userinfo"] + "?access_token=" + token_for_user("@a:b"),
+        )
+
+    def test_admin_endpoint(self):
+        status, body = self._request(
+            "PUT",
+            "/_fake/behaviour",
+            {"userinfo": {"error_rate": 1.0, "error_status": 503}},
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(body["userinfo"]["error_status"], 503)
+
+        self.assertEqual(self._userinfo()[0], 503)
+        self.assertEqual(self._request("GET", ENDPOINTS["version"])[0], 200)
+
+        status, body = self._request("GET", "/_fake/stats")
+        self.assertEqual(body["userinfo"]["requests"], 1)
+        self.assertEqual(body["userinfo"]["errors"], 1)
+
+        status, body = self._request(
+            "PUT", "/_fake/behaviour", {"userinfo": {"error_rate": 2}}
+        )
+        self.assertEqual(status, 400)
+        self.assertEqual(body["errcode"], "M_INVALID_PARAM")
+
+        # Endpoints left out go back to the default
+        self._request("PUT", "/_fake/behaviour", {})
+        self.assertEqual(self._userinfo(), (200, {"sub": "@a:b"}))
+
+    def test_concurrency_limit(self):
+        # The limit applies across both workers
+        self.fake_hs.set_behaviour(
+            {"userinfo": {"latency": _fixed(0.1), "max_concurrency": 2}}
+        )
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(6) as pool:
+            results = list(pool.map(self._userinfo, range(6)))
+        duration = time.monotonic() - start
+
+        self.assertEqual([status for status, _ in results], [200] * 6)
+        self.assertGreaterEqual(duration, 0.3)
+        stats = self.fake_hs.get_stats()["userinfo"]
+        self.assertEqual(stats["requests"], 6)
+        self.assertEqual(stats["peak_in_flight"], 2)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_slow_homeserver(self):
+        self.fake_hs.set_behaviour({"userinfo": {"latency": _fixed(0.3)}})
+
+        api = IsApi(get_or_launch_is(), "v2", get_shared_mailsink())
+        start = time.monotonic()
+        api.make_account(self.fake_hs.get_addr())
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertEqual(self.fake_hs.get_stats()["userinfo"]["requests"], 1)
+
+
+class FakeHomeserverPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = FakeHomeserverPool(3)
+        self.pool.launch()
+
+    def tearDown(self):
+        self.pool.tearDown()
+
+    def test_distinct_server_names(self):
+        self.assertEqual(len(set(self.pool.get_server_names())), 3)
+
+    def test_make_account_spreads(self):
+        base_url = get_or_launch_is()
+        for _ in range(30):
+            api = IsApi(base_url, "v2", get_shared_mailsink())
+            api.make_account(self.pool.get_addrs())
+            # The account is on one of the homeservers
+            self.assertTrue(
+                api.account()["user_id"].endswith(
+                    tuple(":" + name for name in self.pool.get_server_names())
+                )
+            )
+
+        stats = self.pool.get_stats()
+        counts = [stats[name]["userinfo"]["requests"] for name in stats]
+        self.assertEqual(sum(counts), 30)
+        # 30 accounts picked at random all missing one homeserver is
+        # vanishingly unlikely
+        self.assertNotIn(0, counts)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from matrix_is_tester.fakehs import get_shared_fake_hs, server_name_for
+from matrix_is_tester.fixture_cache import FixtureCache, seed_with_cache
+from matrix_is_tester.is_api import IsApi
+from matrix_is_tester.launch_is import get_launcher_pool, supports_snapshots
+from matrix_is_tester.mailsink import get_shared_mailsink
+
+try:
+    from matrix_is_tester.seed import Seeder
+except ImportError:
+    Seeder = None
+
+
+class FixtureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_lru_eviction(self):
+        cache = FixtureCache(self.tempdir, max_bytes=3500)
+        for key in ("a", "b", "c"):
+            cache.put(key, os.urandom(1000))
+            # Make sure each entry has a distinct last-used time
+            past = time.time() - 100 + len(cache.entries())
+            os.utime(cache._path(key), (past, past))
+
+        # a is used, so b is now the least recently used
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("d", os.urandom(1000))
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertIsNotNone(cache.get("d"))
+
+    def test_keeps_newest_even_if_too_big(self):
+        cache = FixtureCache(self.tempdir, max_bytes=10)
+        cache.put("big", os.urandom(1000))
+
+        self.assertIsNotNone(cache.get("big"))
+
+    def test_stale_entries_are_misses(self):
+        cache = FixtureCache(self.tempdir)
+        for key, data in (
+            ("empty", b""),
+            ("garbage", b"not a pickle"),
+            ("gone_module", b"cno_such_module\nFixture\n."),
+            ("gone_class", b"cos\nNoSuchFixture\n."),
+        ):
+            with open(cache._path(key), "wb") as f:
+                f.write(data)
+            self.assertIsNone(cache.get(key), key)
+
+    @unittest.skipIf(Seeder is None, "aiohttp is not installed")
+    def test_seed_with_cache(self):
+        launcher = get_launcher_pool().get(False)
+        if not supports_snapshots(launcher):
+            raise unittest.SkipTest("Launcher doesn't support snapshots")
+
+        cache = FixtureCache(self.tempdir)
+        hs_addr = get_shared_fake_hs().get_addr()
+        mail_sink = get_shared_mailsink()
+
+        report = seed_with_cache(
+            launcher, mail_sink, hs_addr, 10, prefix="fixturetest", cache=cache
+        )
+        self.assertFalse(report["cached"])
+        self.assertEqual(len(cache.entries()), 1)
+
+        # Lose the bindings, then get them back from the cache
+        get_launcher_pool().reset(False)
+        report = seed_with_cache(
+            launcher, mail_sink, hs_addr, 10, prefix="fixturetest", cache=cache
+        )
+        self.assertTrue(report["cached"])
+
+        # Fake homeservers on other ports, eg. under parallel workers, still
+        # get the same dataset
+        get_launcher_pool().reset(False)
+        other_addr = ("127.0.0.1", 1)
+        report = seed_with_cache(
+            launcher, mail_sink, other_addr, 10, prefix="fixturetest", cache=cache
+        )
+        self.assertTrue(report["cached"])
+        self.assertEqual(
+            report["server_names"],
+            {server_name_for(hs_addr): server_name_for(other_addr)},
+        )
+
+        address, mxid = report["bindings"][3]
+        api = IsApi(launcher.get_base_url(), "v2", mail_sink)
+        api.make_account(hs_addr)
+        pepper = api.hash_details()["lookup_pepper"]
+        lookup = "%s email" % (address,)
+        body = api.hashed_lookup([lookup], "none", pepper)
+        self.assertEqual(body["mappings"], {lookup: mxid})
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
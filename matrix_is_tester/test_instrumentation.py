@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import unittest
+
+from matrix_is_tester.instrumentation import Histogram, Instrumentation, percentile
+from matrix_is_tester.is_api import IsApi
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        # Imported here, so that the histogram tests don't need an IS
+        from matrix_is_tester.launch_is import get_or_launch_is
+
+        self.baseUrl = get_or_launch_is()
+        self.instrumentation = Instrumentation()
+        self.api = IsApi(self.baseUrl, "v2", None, instrumentation=self.instrumentation)
+
+    def test_records_calls(self):
+        self.api.ping()
+        self.api.ping()
+        self.api.register("", "")
+
+        stats = self.instrumentation.to_dict()
+
+        ping = stats["GET /_matrix/identity/v2"]
+        self.assertEqual(ping["wall_time"]["count"], 2)
+        self.assertEqual(ping["ttfb"]["count"], 2)
+        self.assertLessEqual(ping["ttfb"]["max"], ping["wall_time"]["max"])
+        self.assertEqual(ping["statuses"], {"200": 2})
+        self.assertEqual(ping["request_bytes"], 0)
+        self.assertGreater(ping["response_bytes"], 0)
+
+        register = stats["POST /_matrix/identity/v2/account/register"]
+        self.assertEqual(register["wall_time"]["count"], 1)
+        self.assertGreater(register["request_bytes"], 0)
+        self.assertNotIn("200", register["statuses"])
+
+    def test_export(self):
+        hook_calls = []
+        self.instrumentation.add_hook(lambda *args: hook_calls.append(args))
+        self.api.ping()
+
+        self.assertEqual(len(hook_calls), 1)
+        self.assertEqual(hook_calls[0][:2], ("GET /_matrix/identity/v2", 200))
+
+        f = io.StringIO()
+        self.instrumentation.write_jsonl(f)
+        lines = [json.loads(line) for line in f.getvalue().splitlines()]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]["endpoint"], "GET /_matrix/identity/v2")
+
+        f = io.StringIO()
+        self.instrumentation.write_prometheus(f)
+        self.assertIn(
+            'matrix_is_tester_requests_total{endpoint="GET /_matrix/identity/v2",'
+            'status="200"} 1',
+            f.getvalue(),
+        )
+
+
+class HistogramTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 21))
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 50), 10)
+        self.assertEqual(percentile(values, 95), 19)
+        self.assertEqual(percentile(values, 100), 20)
+        self.assertIsNone(percentile([], 50))
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for i in range(1, 10001):
+            histogram.record(i / 1000.0)
+
+        self.assertEqual(histogram.count, 10000)
+        self.assertEqual(histogram.percentile(0), 0.001)
+        self.assertAlmostEqual(histogram.percentile(50), 5.0, delta=5.0 / 1000)
+        self.assertAlmostEqual(histogram.percentile(99), 9.9, delta=9.9 / 1000)
+        self.assertEqual(histogram.percentile(100), 10.0)
+
+        other = Histogram()
+        other.record(20)
+        histogram.merge(other)
+        self.assertEqual(histogram.count, 10001)
+        self.assertEqual(histogram.max, 20000000)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
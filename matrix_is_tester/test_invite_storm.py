@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+
+from matrix_is_tester.fakehs import get_shared_fake_hs
+from matrix_is_tester.launch_is import get_or_launch_is
+from matrix_is_tester.mailsink import get_shared_mailsink
+
+try:
+    from matrix_is_tester.invite_storm import MAIL_LATENCY, InviteStorm, problems
+except ImportError:
+    InviteStorm = None
+
+
+@unittest.skipIf(InviteStorm is None, "aiohttp is not installed")
+class InviteStormTest(unittest.TestCase):
+    def test_invite_storm(self):
+        storm = InviteStorm(
+            get_or_launch_is(False),
+            get_shared_mailsink(),
+            get_shared_fake_hs().get_addr(),
+            # Some addresses get several invites, whose mails may arrive in
+            # any order
+            addresses=20,
+            rooms=3,
+            senders=3,
+            concurrency=10,
+        )
+        report = asyncio.run(storm.run(50))
+
+        self.assertEqual(problems(report), [])
+        self.assertEqual(report["stored"], 50)
+        self.assertEqual(report["delivered"], 50)
+        self.assertEqual(report["waits"][MAIL_LATENCY]["requests"], 50)
+        self.assertNotIn(MAIL_LATENCY, report["endpoints"])
+
+        # The server's long-term key comes back with every invite, but is
+        # only checked once (ephemeral keys are different each time)
+        checks = report["key_checks"]
+        self.assertGreater(checks["requests"], 0)
+        self.assertGreaterEqual(checks["hits"] + checks["coalesced"], 49)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+
+from matrix_is_tester.json_stream import parse_lookup_response, parse_streamed
+
+
+def _chunked(data, size):
+    chunks = []
+    while data:
+        chunks.append(data[:size])
+        data = data[size:]
+    return chunks
+
+
+class JsonStreamTest(unittest.TestCase):
+    def test_parse_lookup_response(self):
+        doc = {
+            "mappings": {
+                "h%d" % (i,): "@user%d:fake.test" % (i % 3,) for i in range(50)
+            },
+            "threepids": [
+                ["email", "ü%d@nowhere.test" % (i,), "@user:fake.test"]
+                for i in range(50)
+            ],
+            "other": [1.5, 20, {"a": None}],
+        }
+        data = json.dumps(doc, ensure_ascii=False, indent=1).encode("UTF-8")
+
+        # Every chunk size cuts some keys, numbers and multibyte characters
+        for size in (1, 2, 3, 7, 64, len(data)):
+            body = parse_lookup_response(_chunked(data, size))
+            self.assertEquals(body["mappings"], doc["mappings"])
+            self.assertEquals(
+                body["threepids"],
+                {(m, a): mxid for m, a, mxid in doc["threepids"]},
+            )
+            self.assertEquals(body["other"], doc["other"])
+
+    def test_numbers_across_chunks(self):
+        members = []
+        body = parse_streamed([b'{"a": [12', b"34, 5", b"6]}"], {"a": members.append})
+        self.assertEquals(body, {"a": None})
+        self.assertEquals(members, [1234, 56])
+
+    def test_every_split_point(self):
+        data = (
+            b'{"mappings": {"a": "b"}, "n": 12345.5, "e": 1e5, "f": -0.25E-3,'
+            b' "nums": [1.5e+2, -7, 10, true, null], "obj": {"x": 2.75, "y": 3E2}}'
+        )
+        doc = json.loads(data)
+        for i in range(1, len(data)):
+            chunks = [data[:i], data[i:]]
+            self.assertEquals(parse_lookup_response(chunks), doc)
+
+            nums = []
+            obj = {}
+            body = parse_streamed(chunks, {"nums": nums.append, "obj": obj.__setitem__})
+            self.assertEquals(body["n"], doc["n"])
+            self.assertEquals(body["e"], doc["e"])
+            self.assertEquals(body["f"], doc["f"])
+            self.assertEquals(nums, doc["nums"])
+            self.assertEquals(obj, doc["obj"])
+
+    def test_empty_containers(self):
+        self.assertEquals(
+            parse_lookup_response([b'{"mappings": {}, "threepids": []}']),
+            {"mappings": {}, "threepids": {}},
+        )
+        self.assertEquals(parse_lookup_response([b" { } "]), {})
+
+    def test_invalid(self):
+        for data in (
+            b'{"mappings": {"a": "b",}}',
+            b'{"mappings": {"a" "b"}}',
+            b'{"mappings": {"a": "b"',
+            b'{"threepids": [["email", "a"]]}',
+            b'{"mappings": {}} []',
+            b"[]",
+        ):
+            self.assertRaises(ValueError, parse_lookup_response, _chunked(data, 3))
+
+    def test_handler_errors_propagate(self):
+        def handler(member):
+            raise KeyError(member)
+
+        self.assertRaises(KeyError, parse_streamed, [b'{"a": [1]}'], {"a": handler})
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+import unittest
+
+from matrix_is_tester.fakehs import get_shared_fake_hs
+from matrix_is_tester.is_api import IsApi
+from matrix_is_tester.key_validity import KeyValidityCache
+from matrix_is_tester.launch_is import get_or_launch_is
+from matrix_is_tester.mailsink import get_shared_mailsink
+
+try:
+    from matrix_is_tester.async_is_api import AsyncIsApi, close_shared_client_sessions
+except ImportError:
+    AsyncIsApi = None
+
+
+class KeyValidityCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.baseUrl = get_or_launch_is(False)
+        self.mailSink = get_shared_mailsink()
+        self.api = IsApi(self.baseUrl, "v2", self.mailSink)
+        self.api.make_account(get_shared_fake_hs().get_addr())
+
+        body = self.api.store_invite(
+            {
+                "medium": "email",
+                "address": "keyvalidity@fake.test",
+                "room_id": "!aroom:fake.test",
+                "sender": "@keyvalidity:127.0.0.1:4490",
+            }
+        )
+        self.keys = body["public_keys"]
+        self.mailSink.wait_for_mail(to="keyvalidity@fake.test")
+
+    def test_cache(self):
+        cache = KeyValidityCache()
+        self.assertEqual(cache.validate_keys(self.api, self.keys), [True] * 2)
+        self.assertEqual(cache.validate_keys(self.api, self.keys), [True] * 2)
+
+        stats = cache.stats()
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["latency"]["count"], 2)
+
+    def test_ttl(self):
+        cache = KeyValidityCache(ttl=0.05)
+        key = self.keys[0]
+        cache.is_valid(self.api, key["key_validity_url"], key["public_key"])
+        time.sleep(0.1)
+        cache.is_valid(self.api, key["key_validity_url"], key["public_key"])
+
+        stats = cache.stats()
+        self.assertEqual(stats["expired"], 1)
+        self.assertEqual(stats["requests"], 2)
+
+    def test_eviction(self):
+        cache = KeyValidityCache(max_size=1)
+        cache.validate_keys(self.api, self.keys, concurrency=1)
+
+        stats = cache.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_bypass(self):
+        cache = KeyValidityCache(bypass=True)
+        cache.validate_keys(self.api, self.keys)
+        cache.validate_keys(self.api, self.keys)
+
+        stats = cache.stats()
+        self.assertEqual(stats["bypassed"], 4)
+        self.assertEqual(stats["hits"], 0)
+        self.assertEqual(stats["size"], 0)
+
+    @unittest.skipIf(AsyncIsApi is None, "aiohttp is not installed")
+    def test_async_batch(self):
+        cache = KeyValidityCache()
+        api = AsyncIsApi(self.baseUrl, "v2", self.mailSink)
+
+        async def validate():
+            try:
+                # Each key several times over, all at once
+                return await cache.async_validate_keys(api, self.keys * 5)
+            finally:
+                await close_shared_client_sessions()
+
+        self.assertEqual(asyncio.run(validate()), [True] * 10)
+        stats = cache.stats()
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["coalesced"] + stats["hits"], 8)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import time
+import unittest
+from queue import Empty
+
+from matrix_is_tester.fakehs import get_shared_fake_hs, token_for_user
+from matrix_is_tester.is_api import IsApi
+from matrix_is_tester.launch_is import (
+    LauncherPool,
+    _PoolEntry,
+    get_launcher_pool,
+    get_or_launch_is,
+    supports_snapshots,
+    wait_until_ready,
+)
+from matrix_is_tester.mailsink import MAIL_DELIVERY, get_shared_mailsink
+
+
+class _FailingLauncher(object):
+    def __init__(self):
+        self.torn_down = False
+
+    def launch(self):
+        raise Exception("Launch failed partway")
+
+    def tearDown(self):
+        self.torn_down = True
+
+
+class LaunchIsTest(unittest.TestCase):
+    def test_startup_times(self):
+        get_or_launch_is(False)
+
+        times = get_launcher_pool().startup_times()
+        self.assertIn("noTerms", times)
+        self.assertGreaterEqual(times["noTerms"]["ready"], times["noTerms"]["launch"])
+
+    def test_destroy_failed_launch(self):
+        pool = LauncherPool(ready_timeout=1)
+        entry = _PoolEntry(_FailingLauncher())
+        pool._entries["noTerms"] = entry
+        pool._launch("noTerms", entry)
+        self.assertIsNotNone(entry.error)
+
+        pool.destroy_all()
+        self.assertTrue(entry.launcher.torn_down)
+
+    def test_ready(self):
+        # Returns straight away for a running server
+        wait_until_ready(get_or_launch_is(False), 1)
+
+    def test_not_ready(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        with self.assertRaises(Exception):
+            wait_until_ready("http://127.0.0.1:%d" % (port,), 0.2)
+
+    def test_reset_restores_state(self):
+        pool = get_launcher_pool()
+        if not supports_snapshots(pool.get(False)):
+            raise unittest.SkipTest("Launcher doesn't support snapshots")
+
+        fake_hs = get_shared_fake_hs()
+        user_id = "@snapshot:%s" % (fake_hs.get_server_name(),)
+        api = IsApi(get_or_launch_is(False), "v2", get_shared_mailsink())
+        api.make_account(fake_hs.get_addr(), token_for_user(user_id))
+        params = api.request_and_submit_email_code("snapshot@nowhere.test")
+        api.bind_email(params["sid"], params["client_secret"], user_id)
+
+        api = IsApi(pool.reset(False).get_base_url(), "v2", get_shared_mailsink())
+        api.make_account(fake_hs.get_addr(), token_for_user(user_id))
+        pepper = api.hash_details()["lookup_pepper"]
+        body = api.hashed_lookup(["snapshot@nowhere.test email"], "none", pepper)
+
+        self.assertEqual(body["mappings"], {})
+
+    def test_clear_mail(self):
+        mail_sink = get_shared_mailsink()
+        api = IsApi(get_or_launch_is(False), "v1", mail_sink)
+        delivered = mail_sink.delivered
+        api.request_email_code("cleared@nowhere.test", "secret", 1)
+        for _ in range(100):
+            if mail_sink.delivered > delivered:
+                break
+            time.sleep(0.01)
+
+        self.assertGreaterEqual(mail_sink.clear(), 1)
+        with self.assertRaises(Empty):
+            mail_sink.wait_for_mail(to="cleared@nowhere.test", timeout=0.1)
+
+    def test_mail_deadline(self):
+        mail_sink = get_shared_mailsink()
+        start = time.monotonic()
+        with self.assertRaises(Empty):
+            mail_sink.wait_for_mail(
+                to="nobody@nowhere.test", timeout=30, deadline=start + 0.1
+            )
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_mail_delivery_latency(self):
+        mail_sink = get_shared_mailsink()
+        api = IsApi(get_or_launch_is(False), "v1", mail_sink)
+
+        def delivered():
+            stats = mail_sink.instrumentation.to_dict().get(MAIL_DELIVERY)
+            return stats["wall_time"]["count"] if stats else 0
+
+        before = delivered()
+        api.request_email_code("latency@nowhere.test", "secret", 1)
+        api.get_token_from_mail("latency@nowhere.test")
+        self.assertEqual(delivered(), before + 1)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
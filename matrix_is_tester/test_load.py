@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+
+from matrix_is_tester.fakehs import get_shared_fake_hs
+from matrix_is_tester.launch_is import get_or_launch_is
+from matrix_is_tester.mailsink import MAIL_DELIVERY, get_shared_mailsink
+
+try:
+    from matrix_is_tester.load import (
+        LoadContext,
+        LoadStats,
+        RequestFailed,
+        _run_iteration,
+        run_load,
+    )
+except ImportError:
+    LoadStats = None
+
+
+async def _fail():
+    raise KeyError("boom")
+
+
+async def _ok():
+    return {"errcode": "M_UNKNOWN"}
+
+
+@unittest.skipIf(LoadStats is None, "aiohttp is not installed")
+class LoadStatsTest(unittest.TestCase):
+    def test_report(self):
+        stats = LoadStats()
+        stats.start = 0
+        stats.end = 2.0
+        for latency in (0.1, 0.2, 0.3, 0.4):
+            stats.record("/lookup", latency)
+        stats.record("/lookup", 0.5, "M_LIMIT_EXCEEDED")
+        stats.record(MAIL_DELIVERY, 1.0, wait=True)
+        stats.record(MAIL_DELIVERY, 5.0, "Empty", wait=True)
+        stats.record_exception(IndexError())
+
+        report = stats.report()
+        self.assertEqual(report["requests"], 5)
+        self.assertEqual(report["throughput"], 2.5)
+        self.assertEqual(
+            report["errors"], {"M_LIMIT_EXCEEDED": 1, "exception:IndexError": 1}
+        )
+        self.assertEqual(list(report["endpoints"]), ["/lookup"])
+        lookup = report["endpoints"]["/lookup"]
+        self.assertEqual(lookup["requests"], 5)
+        self.assertEqual(lookup["error_rate"], 0.2)
+        self.assertEqual(lookup["p50"], 0.3)
+        self.assertEqual(lookup["p99"], 0.5)
+
+        # Waits are reported, but not as requests to the IS
+        self.assertEqual(report["waits"][MAIL_DELIVERY]["requests"], 2)
+        self.assertEqual(report["waits"][MAIL_DELIVERY]["errors"], {"Empty": 1})
+        self.assertEqual(sorted(stats.request_latencies()), [0.1, 0.2, 0.3, 0.4, 0.5])
+
+    def test_call(self):
+        stats = LoadStats()
+        self.assertEqual(asyncio.run(stats.call("/", _ok())), {"errcode": "M_UNKNOWN"})
+        with self.assertRaises(RequestFailed):
+            asyncio.run(stats.call("/", _fail()))
+        self.assertEqual(stats.errors["/"], {"M_UNKNOWN": 1, "KeyError": 1})
+
+    def test_unexpected_exceptions_are_counted(self):
+        # Scenarios that need an account fail without one
+        ctx = LoadContext("http://localhost:1", None, ("localhost", 1), LoadStats())
+        asyncio.run(_run_iteration(ctx, ["ping"], [1]))
+        self.assertEqual(ctx.stats.iterations, 1)
+        self.assertEqual(ctx.stats.exceptions, {"IndexError": 1})
+
+
+@unittest.skipIf(LoadStats is None, "aiohttp is not installed")
+class RunLoadTest(unittest.TestCase):
+    def _run_load(self, scenarios, **kwargs):
+        return asyncio.run(
+            run_load(
+                get_or_launch_is(False),
+                get_shared_mailsink(),
+                get_shared_fake_hs().get_addr(),
+                scenarios,
+                duration=1,
+                concurrency=2,
+                **kwargs
+            )
+        )
+
+    def test_weighted_scenarios(self):
+        report = self._run_load({"ping": 1, "lookup": 2, "register": 0}, accounts=2)
+
+        endpoints = report["endpoints"]
+        self.assertNotIn("/account/register", endpoints)
+        self.assertEqual(report["errors"], {})
+        self.assertGreater(endpoints["/"]["requests"], 0)
+        self.assertGreater(endpoints["/lookup"]["requests"], 0)
+        self.assertEqual(
+            endpoints["/"]["requests"] + endpoints["/lookup"]["requests"],
+            report["iterations"],
+        )
+
+    def test_needs_an_account(self):
+        with self.assertRaises(ValueError):
+            self._run_load({"ping": 1}, accounts=0)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
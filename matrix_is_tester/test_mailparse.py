@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from matrix_is_tester.is_api import token_from_mail
+from matrix_is_tester.mailparse import parse_mail
+
+_LINK = (
+    "https://is.test/_matrix/identity/api/v1/validate/email/submitToken"
+    "?token=linktoken&client_secret=s3cret&sid=1234"
+)
+
+
+class ParseMailTest(unittest.TestCase):
+    def test_bare_token(self):
+        mail = parse_mail(b"<<<abcdef>>>")
+        self.assertEquals(mail["token"], "abcdef")
+        self.assertEquals(mail["sids"], [])
+        self.assertIsNone(mail["invite"])
+        self.assertIsNone(mail["subject"])
+
+    def test_multipart(self):
+        message = MIMEMultipart("alternative")
+        message["Subject"] = "Confirm your email address"
+        message["From"] = "is@fake.test"
+        message["To"] = "someone@nowhere.test"
+        # Long enough to be wrapped, and encoded so that the token isn't in
+        # the raw message as it is
+        text = "Your code is <<<texttoken>>> or go to %s\n" % (_LINK,)
+        message.attach(MIMEText(text + "x" * 2000, "plain", "UTF-8"))
+        html = '<a href="%s">Confirm</a>' % (_LINK.replace("&", "&amp;"),)
+        message.attach(MIMEText(html, "html", "UTF-8"))
+
+        mail = parse_mail(message.as_bytes())
+        self.assertEquals(mail["subject"], "Confirm your email address")
+        self.assertEquals(mail["token"], "texttoken")
+        self.assertEquals(mail["sids"], ["1234"])
+
+    def test_token_from_link(self):
+        message = MIMEText('<a href="%s">Confirm</a>' % (_LINK,), "html", "UTF-8")
+        message["Subject"] = "Confirm"
+
+        mail = parse_mail(message.as_bytes())
+        self.assertEquals(mail["token"], "linktoken")
+        self.assertEquals(mail["sids"], ["1234"])
+
+    def test_invite(self):
+        invite = {"token": "invitetoken", "room_name": "my room é"}
+        mail = parse_mail(json.dumps(invite).encode("UTF-8"))
+        self.assertEquals(mail["invite"], invite)
+        self.assertEquals(mail["token"], "invitetoken")
+
+    def test_no_token(self):
+        mail = parse_mail(b"Subject: Hello\n\nNothing to see here")
+        mail["rctpto"] = ["someone@nowhere.test"]
+        self.assertIsNone(mail["token"])
+        with self.assertRaisesRegex(Exception, "someone@nowhere.test"):
+            token_from_mail(mail)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
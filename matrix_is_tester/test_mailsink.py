@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import smtplib
+import socket
+import time
+import unittest
+from queue import Empty
+
+from matrix_is_tester.instrumentation import Instrumentation
+from matrix_is_tester.mailsink import MailSink, _SmtpSinkProtocol
+
+
+class _Transport(object):
+    def __init__(self):
+        self.written = b""
+        self.closed = False
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 1234)
+
+    def write(self, data):
+        self.written += data
+
+    def close(self):
+        self.closed = True
+
+
+def _mail(to, received=None, sids=()):
+    return {
+        "rctpto": [to],
+        "sids": list(sids),
+        "received": time.time() if received is None else received,
+        "size": 0,
+    }
+
+
+class SmtpProtocolTest(unittest.TestCase):
+    def _connect(self, **kwargs):
+        self.delivered = []
+        protocol = _SmtpSinkProtocol(self.delivered.append, **kwargs)
+        transport = _Transport()
+        protocol.connection_made(transport)
+        return protocol, transport
+
+    def test_size_limit(self):
+        protocol, transport = self._connect(max_message_size=100)
+        protocol.data_received(b"EHLO test\r\nMAIL FROM:<a@x.test>\r\n")
+        self.assertIn(b"250 SIZE 100\r\n", transport.written)
+
+        protocol.data_received(b"RCPT TO:<b@x.test>\r\nDATA\r\n")
+        protocol.data_received(b"x" * 60)
+        self.assertFalse(transport.closed)
+        protocol.data_received(b"x" * 60)
+        self.assertTrue(transport.written.endswith(b"552 Message too big\r\n"))
+        self.assertTrue(transport.closed)
+        self.assertEqual(self.delivered, [])
+
+    def test_terminator_across_reads(self):
+        protocol, transport = self._connect()
+        protocol.data_received(b"HELO test\r\nMAIL FROM:<a@x.test>\r\n")
+        protocol.data_received(b"RCPT TO:<b@x.test>\r\nDATA\r\n<<<tok>>>\r")
+        protocol.data_received(b"\n.")
+        self.assertEqual(self.delivered, [])
+        protocol.data_received(b"\r\n")
+        self.assertEqual(len(self.delivered), 1)
+        self.assertEqual(self.delivered[0]["token"], "tok")
+
+    def test_commands_out_of_order(self):
+        protocol, transport = self._connect()
+        protocol.data_received(b"RCPT TO:<b@x.test>\r\nDATA\r\nFOO\r\n")
+        self.assertTrue(
+            transport.written.endswith(
+                b"503 Need MAIL first\r\n503 Need RCPT first\r\n"
+                b"502 Command not implemented\r\n"
+            )
+        )
+
+
+class MailSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.sink = MailSink(
+            port=0, timeout=5, instrumentation=Instrumentation(), keep_data=True
+        )
+        self.sink.launch()
+        self.addCleanup(self.sink.tearDown)
+
+    def _send(self, to, body):
+        smtp = smtplib.SMTP(*self.sink.get_addr())
+        try:
+            smtp.sendmail("is@sink.test", [to], body)
+        finally:
+            smtp.quit()
+
+    def test_claim_by_address_and_sid(self):
+        self._send("First@Sink.test", b"<<<one>>>")
+        self._send(
+            "second@sink.test", b"Go to https://is.test/validate?sid=abc&token=two\r\n"
+        )
+
+        mail = self.sink.wait_for_mail(sid="abc")
+        self.assertEqual(mail["token"], "two")
+        # Taken under one key, so gone from the others
+        with self.assertRaises(Empty):
+            self.sink.wait_for_mail(to="second@sink.test", timeout=0.1)
+
+        mail = self.sink.wait_for_mail(to="first@sink.test")
+        self.assertEqual(mail["token"], "one")
+        self.assertEqual(mail["rctpto"], ["First@Sink.test"])
+        self.assertEqual(self.sink.clear(), 0)
+
+    def test_dot_unstuffing(self):
+        self._send("dots@sink.test", b"<<<tok>>>\r\n.hidden\r\n..two\r\n.")
+        mail = self.sink.wait_for_mail(to="dots@sink.test")
+        self.assertEqual(mail["data"], b"<<<tok>>>\n.hidden\n..two\n.")
+
+    def test_pipelining(self):
+        sock = socket.create_connection(self.sink.get_addr())
+        self.addCleanup(sock.close)
+        transaction = (
+            b"MAIL FROM:<is@sink.test>\r\nRCPT TO:<piped%d@sink.test>\r\n"
+            b"DATA\r\n<<<%d>>>\r\n.\r\n"
+        )
+        sock.sendall(
+            b"EHLO test\r\n" + transaction % (1, 1) + transaction % (2, 2) + b"QUIT\r\n"
+        )
+        replies = b""
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            replies += data
+
+        codes = [line[:3] for line in replies.split(b"\r\n") if line]
+        self.assertEqual(codes[0], b"220")
+        # EHLO's lines, then 250 250 354 250 for each mail, then QUIT
+        self.assertEqual(codes[-9:], [b"250", b"250", b"354", b"250"] * 2 + [b"221"])
+        self.assertEqual(self.sink.wait_for_mail(to="piped1@sink.test")["token"], "1")
+        self.assertEqual(self.sink.wait_for_mail(to="piped2@sink.test")["token"], "2")
+
+    def test_unclaimed_mail_expires(self):
+        self.sink.unclaimed_ttl = 60
+        self.sink.max_unclaimed = 3
+        self.sink._deliver(_mail("old@sink.test", received=time.time() - 120))
+        for i in range(4):
+            self.sink._deliver(_mail("new%d@sink.test" % (i,), sids=["s%d" % (i,)]))
+
+        # The old one for its age, and the first new one to make room
+        self.assertEqual(self.sink.expired, 2)
+        self.assertNotIn(("to", "old@sink.test"), self.sink._unclaimed)
+        self.assertNotIn(("sid", "s0"), self.sink._unclaimed)
+        with self.assertRaises(Empty):
+            self.sink.wait_for_mail(to="new0@sink.test", timeout=0)
+        self.assertEqual(
+            self.sink.wait_for_mail(sid="s3")["rctpto"], ["new3@sink.test"]
+        )
+        self.assertEqual(self.sink.clear(), 2)
+
+    def test_requests_expire(self):
+        self.sink.max_unclaimed = 3
+        for i in range(5):
+            self.sink.mail_requested("lost%d@sink.test" % (i,))
+        self.assertEqual(
+            list(self.sink._requested),
+            [("to", "lost%d@sink.test" % (i,)) for i in (2, 3, 4)],
+        )
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
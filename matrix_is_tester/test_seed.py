@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from matrix_is_tester.fakehs import get_shared_fake_hs
+from matrix_is_tester.is_api import IsApi
+from matrix_is_tester.launch_is import get_or_launch_is
+from matrix_is_tester.mailsink import get_shared_mailsink
+
+try:
+    from matrix_is_tester.seed import Seeder, read_journal
+except ImportError:
+    Seeder = None
+
+
+@unittest.skipIf(Seeder is None, "aiohttp is not installed")
+class SeedTest(unittest.TestCase):
+    def setUp(self):
+        self.baseUrl = get_or_launch_is(False)
+        self.fakeHsAddr = get_shared_fake_hs().get_addr()
+        self.tempdir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.tempdir, "journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _seed(self, count):
+        seeder = Seeder(
+            self.baseUrl,
+            get_shared_mailsink(),
+            self.fakeHsAddr,
+            prefix="seedtest",
+            accounts=3,
+            journal=self.journal,
+            in_flight=8,
+            stage_workers=2,
+            mail_slots=4,
+        )
+        return asyncio.run(seeder.run(count))
+
+    def test_seed_and_resume(self):
+        report = self._seed(20)
+
+        self.assertEqual(report["bound"], 20)
+        self.assertEqual(report["failed"], 0)
+        self.assertEqual(len(read_journal(self.journal)), 20)
+
+        api = IsApi(self.baseUrl, "v2", None)
+        api.make_account(self.fakeHsAddr)
+        pepper = api.hash_details()["lookup_pepper"]
+        address, mxid = report["bindings"][7]
+        body = api.hashed_lookup(["%s email" % (address,)], "none", pepper)
+        self.assertEqual(body["mappings"], {"%s email" % (address,): mxid})
+
+        report = self._seed(25)
+
+        self.assertEqual(report["skipped"], 20)
+        self.assertEqual(report["bound"], 5)
+        self.assertEqual(len(report["bindings"]), 25)
+        self.assertEqual(len(read_journal(self.journal)), 25)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from matrix_is_tester.is_api import IsApi
+from matrix_is_tester.launch_is import get_or_launch_is
+from matrix_is_tester.session_pool import make_session
+
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.baseUrl = get_or_launch_is()
+
+    def test_shared_between_instances(self):
+        api1 = IsApi(self.baseUrl, "v2", None)
+        api2 = IsApi(self.baseUrl, "v2", None)
+
+        self.assertIs(api1.session, api2.session)
+
+    def test_connection_reused(self):
+        session = make_session()
+        api1 = IsApi(self.baseUrl, "v2", None, session=session)
+        api2 = IsApi(self.baseUrl, "v2", None, session=session)
+
+        api1.ping()
+        api2.ping()
+        api1.ping()
+
+        self.assertEqual(api1.connection_stats.requests, 3)
+        self.assertEqual(api1.connection_stats.opened, 1)
+        self.assertEqual(api1.connection_stats.reused, 2)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+
+try:
+    from matrix_is_tester.soak import _is_growing, analyse_windows, sample_process
+except ImportError:
+    analyse_windows = None
+
+
+def _window(rss=100, fds=10, p95=0.01, process=True):
+    return {
+        "process": {"rss": rss, "fds": fds} if process else None,
+        "endpoints": {"/lookup": {"p95": p95}},
+    }
+
+
+@unittest.skipIf(analyse_windows is None, "aiohttp is not installed")
+class AnalyseWindowsTest(unittest.TestCase):
+    def test_is_growing(self):
+        self.assertTrue(_is_growing([100, 100, 105, 120], 0.1))
+        # Dropped back at some point
+        self.assertFalse(_is_growing([100, 130, 120, 140], 0.1))
+        # Not by enough
+        self.assertFalse(_is_growing([100, 102, 104, 108], 0.1))
+
+    def test_steady(self):
+        windows = [_window() for _ in range(6)]
+        self.assertEqual(analyse_windows(windows), [])
+
+    def test_growth(self):
+        windows = [_window(rss=100 + i * 10, fds=10 + i) for i in range(6)]
+        flags = analyse_windows(windows)
+        self.assertEqual(len(flags), 2)
+        self.assertTrue(flags[0].startswith("rss grew in every window"))
+        self.assertTrue(flags[1].startswith("fds grew in every window"))
+
+    def test_warmup_is_skipped(self):
+        # Everything happens in the first window, which is warm-up
+        windows = [_window(rss=10, fds=1, p95=0.001)] + [_window() for _ in range(5)]
+        self.assertEqual(analyse_windows(windows), [])
+        self.assertNotEqual(analyse_windows(windows, warmup_windows=0), [])
+
+    def test_min_windows(self):
+        windows = [_window(rss=100 + i * 10, p95=0.01 * (i + 1)) for i in range(4)]
+        # Three windows after the warm-up aren't enough to judge
+        self.assertEqual(analyse_windows(windows), [])
+        self.assertNotEqual(analyse_windows(windows, min_windows=3), [])
+
+    def test_missing_process_samples(self):
+        windows = [_window(rss=100 + i * 10) for i in range(6)]
+        windows[3]["process"] = None
+        self.assertEqual(analyse_windows(windows), [])
+
+    def test_latency_drift(self):
+        windows = [_window(p95=0.01) for _ in range(5)] + [_window(p95=0.02)]
+        self.assertEqual(
+            analyse_windows(windows),
+            ["/lookup p95 latency drifted from 10.0ms to 20.0ms"],
+        )
+        self.assertEqual(analyse_windows(windows, drift_threshold=1.5), [])
+
+    def test_latency_drift_from_nothing(self):
+        # No baseline to drift from
+        windows = [_window(p95=0) for _ in range(5)] + [_window(p95=0.5)]
+        self.assertEqual(analyse_windows(windows), [])
+
+
+@unittest.skipIf(analyse_windows is None, "aiohttp is not installed")
+class SampleProcessTest(unittest.TestCase):
+    def test_sample_process(self):
+        if not os.path.exists("/proc/self/status"):
+            raise unittest.SkipTest("/proc isn't available")
+
+        sample = sample_process(os.getpid())
+        self.assertGreater(sample["rss"], 0)
+        self.assertGreater(sample["fds"], 0)
+
+    def test_no_such_process(self):
+        # Above the largest PID Linux allows
+        self.assertIsNone(sample_process(2**22 + 1))
+
+
+if __name__ == "__main__":
+    import sys
+
+    from twisted.python import log
+
+    log.startLogging(sys.stdout)
+    unittest.main()
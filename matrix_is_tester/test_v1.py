@@ -51,6 +51,35 @@ class V1Test(BaseApiTest, unittest.TestCase):
         )
         self.assertEquals(len(body["threepids"]), 2)
 
+    def test_bulk_lookup_streamed(self):
+        params = self.api.request_and_submit_email_code("thing4@nowhere.test")
+        self.api.bind_email(params["sid"], params["client_secret"], "@thing4:fake.test")
+
+        body = self.api.bulk_lookup(
+            [("email", "thing4@nowhere.test"), ("email", "thing5@nowhere.test")],
+            stream=True,
+        )
+
+        self.assertEquals(
+            body["threepids"], {("email", "thing4@nowhere.test"): "@thing4:fake.test"}
+        )
+
+    def test_bulk_lookup_chunked(self):
+        params = self.api.request_and_submit_email_code("thing6@nowhere.test")
+        self.api.bind_email(params["sid"], params["client_secret"], "@thing6:fake.test")
+
+        threepids = [("email", "thing6-%d@nowhere.test" % (i,)) for i in range(10)]
+        threepids.insert(7, ("email", "thing6@nowhere.test"))
+        self.api.reset_lookup_chunk_stats()
+        body = self.api.bulk_lookup(threepids, chunk_size=3)
+
+        self.assertEquals(
+            body["threepids"], [["email", "thing6@nowhere.test", "@thing6:fake.test"]]
+        )
+        stats = self.api.lookup_chunk_stats()
+        self.assertEquals(sorted(stats.keys()), [2, 3])
+        self.assertEquals(stats[3]["count"], 3)
+
     def test_bind_and_lookup(self):
         params = self.api.request_and_submit_email_code("fakeemail3@nowhere.test")
         body = self.api.bind_email(
@@ -18,8 +18,9 @@
 
 import unittest
 
+from matrix_is_tester.account_pool import get_test_account_pool
 from matrix_is_tester.base_api_test import BaseApiTest
-from matrix_is_tester.fakehs import get_shared_fake_hs, token_for_user
+from matrix_is_tester.is_api import lookup_hash, lookup_hashes
 
 
 class V2Test(BaseApiTest, unittest.TestCase):
@@ -28,20 +29,23 @@ class V2Test(BaseApiTest, unittest.TestCase):
     def setUp(self):
         super(V2Test, self).setUp()
 
-        self.fakeHs = get_shared_fake_hs()
-        self.api.make_account(
-            self.fakeHs.get_addr(), token_for_user("@commonapitests:127.0.0.1:4490")
-        )
+        # Lease an account registered ahead of time rather than registering
+        # one for every test
+        self.accountPool = get_test_account_pool()
+        self.account = self.accountPool.lease()
+        self.userId = self.account.user_id
+        self.api.use_account(self.account)
+
+    def tearDown(self):
+        self.accountPool.release(self.account)
 
     def test_bind_and_lookup(self):
         params = self.api.request_and_submit_email_code("fakeemail3@nowhere.test")
-        body = self.api.bind_email(
-            params["sid"], params["client_secret"], "@commonapitests:127.0.0.1:4490"
-        )
+        body = self.api.bind_email(params["sid"], params["client_secret"], self.userId)
 
         self.assertEquals(body["medium"], "email")
         self.assertEquals(body["address"], "fakeemail3@nowhere.test")
-        self.assertEquals(body["mxid"], "@commonapitests:127.0.0.1:4490")
+        self.assertEquals(body["mxid"], self.userId)
 
         hash_details = self.api.hash_details()
 
@@ -51,9 +55,71 @@ class V2Test(BaseApiTest, unittest.TestCase):
         )
 
         self.assertIn(lookup_str, body2["mappings"])
+        self.assertEquals(body2["mappings"][lookup_str], self.userId)
+
+    def test_bind_and_sha256_lookup(self):
+        params = self.api.request_and_submit_email_code("fakeemail4@nowhere.test")
+        self.api.bind_email(params["sid"], params["client_secret"], self.userId)
+
+        hash_details = self.api.hash_details()
+        self.assertIn("sha256", hash_details["algorithms"])
+        pepper = hash_details["lookup_pepper"]
+
+        bound_hash = lookup_hash("fakeemail4@nowhere.test", "email", pepper)
+        unbound_hash = lookup_hash("unbound@nowhere.test", "email", pepper)
+        body = self.api.hashed_lookup([bound_hash, unbound_hash], "sha256", pepper)
+
+        self.assertEquals(body["mappings"], {bound_hash: self.userId})
+
+    def test_sha256_lookup_streamed(self):
+        params = self.api.request_and_submit_email_code("fakeemail6@nowhere.test")
+        self.api.bind_email(params["sid"], params["client_secret"], self.userId)
+
+        pepper = self.api.hash_details()["lookup_pepper"]
+        threepids = [("email", "unbound%d@nowhere.test" % (i,)) for i in range(20)]
+        threepids.append(("email", "fakeemail6@nowhere.test"))
+        hashes = lookup_hashes(threepids, pepper)
+
+        body = self.api.hashed_lookup(hashes, "sha256", pepper, stream=True)
+        self.assertEquals(
+            body, self.api.hashed_lookup(hashes, "sha256", pepper, stream=False)
+        )
+        self.assertEquals(body["mappings"], {hashes[-1]: self.userId})
+
+    def test_sha256_lookup_chunked(self):
+        params = self.api.request_and_submit_email_code("fakeemail7@nowhere.test")
+        self.api.bind_email(params["sid"], params["client_secret"], self.userId)
+
+        pepper = self.api.hash_details()["lookup_pepper"]
+        threepids = [("email", "unbound%d@nowhere.test" % (i,)) for i in range(30)]
+        threepids.insert(12, ("email", "fakeemail7@nowhere.test"))
+        hashes = lookup_hashes(threepids, pepper)
+
+        for stream in (False, True):
+            body = self.api.hashed_lookup(
+                hashes, "sha256", pepper, stream=stream, chunk_size=4, concurrency=3
+            )
+            self.assertEquals(body["mappings"], {hashes[12]: self.userId})
+
+        # Errors from any chunk are passed back
+        body = self.api.hashed_lookup(hashes, "sha256", "wrong pepper", chunk_size=4)
+        self.assertEquals(body["errcode"], "M_INVALID_PEPPER")
+
+    def test_lookup_hashes(self):
+        params = self.api.request_and_submit_email_code("fakeemail5@nowhere.test")
+        self.api.bind_email(params["sid"], params["client_secret"], self.userId)
+
+        pepper = self.api.hash_details()["lookup_pepper"]
+        threepids = [("email", "unbound%d@nowhere.test" % (i,)) for i in range(50)]
+        threepids.insert(25, ("email", "fakeemail5@nowhere.test"))
+        hashes = lookup_hashes(threepids, pepper, chunk_size=7)
+
         self.assertEquals(
-            body2["mappings"][lookup_str], "@commonapitests:127.0.0.1:4490"
+            hashes,
+            [lookup_hash(address, medium, pepper) for medium, address in threepids],
         )
+        body = self.api.hashed_lookup(hashes, "sha256", pepper)
+        self.assertEquals(body["mappings"], {hashes[25]: self.userId})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2026 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+
+def get_worker_id():
+    """
+    Returns an ID for this process if it is one of several test runners
+    working in parallel (under `trial -j N` or pytest-xdist, or when
+    MATRIX_IS_TESTER_WORKER is set), or None if the tests are running serially.
+
+    Each worker gets its own identity server, mail sink and fake homeserver,
+    so these listen on free ports rather than the fixed ones.
+    """
+    worker_id = os.environ.get("MATRIX_IS_TESTER_WORKER")
+    if worker_id:
+        return worker_id
+
+    worker_id = os.environ.get("PYTEST_XDIST_WORKER")
+    if worker_id:
+        return worker_id
+
+    # trial's workers run twisted/trial/_dist/workertrial.py as a script, each
+    # in its own numbered working directory
+    if sys.argv and os.path.basename(sys.argv[0]).startswith("workertrial.py"):
+        return "trial-%s" % (os.path.basename(os.getcwd()),)
+
+    return None
+
+
+def port_for_worker(default_port):
+    """
+    Returns the port a server should listen on: its usual one when running
+    serially, or 0 to pick a free one when running in a worker.
+    """
+    if get_worker_id() is None:
+        return default_port
+    return 0
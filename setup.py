@@ -7,6 +7,12 @@ setup(
     description="Black-box integration testing for Matrix Identity Servers",
     long_description=open("README.md").read(),
     install_requires=["Twisted>=19.2.1", "requests>=2.22.0", "six>=1.13.0"],
-    extras_require={"lint": ["flake8>=3.7.8", "isort>=4.3.21", "black>=21.6b0"]},
+    extras_require={
+        "async": ["aiohttp>=3.6"],
+        "lint": ["flake8>=3.7.8", "isort>=4.3.21", "black>=21.6b0"],
+    },
     include_package_data=True,
+    entry_points={
+        "console_scripts": ["matrix-is-tester = matrix_is_tester.__main__:main"]
+    },
 )